@@ -112,12 +112,22 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primero, para medir toda la petición (Server-Timing y /metrics)
+    'trafico.metricas.MetricasMiddleware',
+    # brotli/gzip según Accept-Encoding (antes de todo lo que lee o escribe el cuerpo)
+    'trafico.compresion.CompresionMiddleware',
+    # Una réplica de lectura por petición; tras escribir, todo a la primaria
+    'trafico.replicas.ReplicasMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Perfilado bajo demanda (usa request.user)
+    'trafico.perfilado.PerfiladoMiddleware',
+    # Presupuesto de consultas SQL por vista (cabecera X-Consultas)
+    'trafico.presupuestos.PresupuestoConsultasMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -158,18 +168,104 @@ DATABASES = {
     }
 }
 
+# Réplicas de lectura: DB_REPLICA_HOSTS="host1,host2:5433" (misma BD, usuario y contraseña que default).
+# Las lecturas del ORM y el SQL crudo de solo lectura van a una réplica (trafico/replicas.py).
+# Para probar en local basta apuntar a la misma BD: DB_REPLICA_HOSTS=localhost
+REPLICAS_BD = []
+for _i, _host in enumerate(filter(None, os.getenv("DB_REPLICA_HOSTS", "").split(",")), start=1):
+    _host, _, _puerto = _host.strip().partition(":")
+    DATABASES[f"replica{_i}"] = {
+        **DATABASES["default"],
+        "HOST": _host,
+        "PORT": _puerto or DATABASES["default"]["PORT"],
+        # En los tests la réplica es un alias de la BD de prueba de default
+        "TEST": {"MIRROR": "default"},
+    }
+    REPLICAS_BD.append(f"replica{_i}")
+
+DATABASE_ROUTERS = ["trafico.replicas.EnrutadorReplicas"]
+# Segundos tras una invalidación de caché en que se lee de la primaria (mayor que el retraso de las réplicas)
+REPLICAS_RETRASO_MAX = float(os.getenv("REPLICAS_RETRASO_MAX", "10"))
+
+# Caché: Redis si se define REDIS_URL (compartida entre workers), si no memoria local
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Segundos que se cachean las estadísticas de /trafico/estadisticas/
+ESTADISTICAS_CACHE_TIMEOUT = 60 * 60
+
+# Caché de respuestas de paradas y predicciones (trafico/cache_http.py)
+CACHE_HTTP_TIMEOUT = 60 * 60
+CACHE_HTTP_MAX_BYTES = 5 * 1024 * 1024  # respuestas por streaming más grandes no se guardan
+
+# Timers por etapa, cabecera Server-Timing y /metrics (formato Prometheus)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# Quién puede leer /metrics: IPs o redes (METRICS_IPS="10.0.0.0/8,127.0.0.1") o Bearer METRICS_TOKEN
+METRICS_IPS = [ip.strip() for ip in os.getenv("METRICS_IPS", "127.0.0.1,::1").split(",") if ip.strip()]
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Perfilado bajo demanda: staff con X-Perfilar: 1 o ?_perfilar=1, más una fracción muestreada
+PERFILADO_DIR = Path(os.getenv("PERFILADO_DIR", BASE_DIR / "cache" / "perfiles"))
+PERFILADO_MUESTREO = float(os.getenv("PERFILADO_MUESTREO", "0"))
+PERFILADO_MAX = 50
+
+# Presupuesto de consultas por vista: off | log (warning) | error (PresupuestoExcedido)
+PRESUPUESTO_CONSULTAS_MODO = os.getenv("PRESUPUESTO_CONSULTAS_MODO", "log" if DEBUG else "off")
+# Vistas de terceros, por nombre de URL (las propias usan @presupuesto_consultas)
+PRESUPUESTOS_CONSULTAS = {
+    "token_refresh": 1,
+}
+
+# Caché en disco de los vector tiles (/tiles/{z}/{x}/{y}.mvt)
+TILES_CACHE_DIR = Path(os.getenv("TILES_CACHE_DIR", BASE_DIR / "cache" / "tiles"))
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.AllowAny",
-    )
+    ),
+    # Cubetas de tokens por usuario de los endpoints caros (trafico/limites.py)
+    "DEFAULT_THROTTLE_RATES": {
+        "prediccion": os.getenv("LIMITE_PREDICCION", "60/min"),
+        "recomendacion": os.getenv("LIMITE_RECOMENDACION", "20/min"),
+        "matriz": os.getenv("LIMITE_MATRIZ", "30/min"),
+        "exportacion": os.getenv("LIMITE_EXPORTACION", "6/min"),
+    },
+    # orjson si está instalado (si no, equivale a JSONRenderer)
+    "DEFAULT_RENDERER_CLASSES": (
+        "trafico.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
 }
 
+# Cálculos de modelo simultáneos en todo el backend (turnos en la caché compartida)
+LIMITE_COMPUTOS = int(os.getenv("LIMITE_COMPUTOS", "2"))
+COLA_COMPUTOS_SEGUNDOS = 10  # espera máxima en cola antes de responder 429
+COMPUTO_MAX_SEGUNDOS = 120  # un turno no liberado (worker caído) expira a este tiempo
 
+# Los modelos Prophet reciben longitud_km/paradas_cercanas de la BD (trafico/metadatos.py)
+# en vez de los de su entrenamiento. Activar solo después de reentrenar con esos valores.
+REGRESORES_DESDE_BD = os.getenv("REGRESORES_DESDE_BD", "0") == "1"
 
-print(f'Current database engine is {DATABASES["default"]["NAME"]}')
+# Compresión de respuestas (trafico/compresion.py); brotli requiere el paquete opcional `brotli`
+COMPRESION_MINIMO = 1024  # bytes
+COMPRESION_GZIP_NIVEL = 6
+COMPRESION_BROTLI_CALIDAD = 5  # 0-11: más alto comprime más pero cuesta mucha CPU por petición
+# Relleno aleatorio (bytes) del gzip de peticiones con Authorization o cookies, contra BREACH
+COMPRESION_RELLENO_MAX = 100
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -214,6 +310,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CORS_ALLOW_ALL_ORIGINS = True
 MAPBOX_ACCESS_TOKEN = os.getenv("MAPBOX_ACCESS_TOKEN")
+# Configurable para apuntar el proxy de /api/matrix/ a un servidor local de pruebas
+MAPBOX_API_URL = os.getenv("MAPBOX_API_URL", "https://api.mapbox.com")
 
 
 
@@ -0,0 +1,34 @@
+"""
+Settings para la suite de benchmarks y pruebas sin PostGIS ni red:
+SpatiaLite en un archivo local, caché en memoria y sin perfilado por muestreo.
+
+    python manage.py benchmark --settings=api.settings_bench
+"""
+from .settings import *  # noqa: F401,F403
+
+(BASE_DIR / "cache").mkdir(exist_ok=True)
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.contrib.gis.db.backends.spatialite",
+        "NAME": os.getenv("BENCH_DB", str(BASE_DIR / "cache" / "benchmark.sqlite3")),
+    }
+}
+
+# Sin réplicas de lectura (ver DB_REPLICA_HOSTS en settings.py)
+REPLICAS_BD = []
+
+# Ruta a mod_spatialite si no está en el path de la librería dinámica
+if os.getenv("SPATIALITE_LIBRARY_PATH"):
+    SPATIALITE_LIBRARY_PATH = os.getenv("SPATIALITE_LIBRARY_PATH")
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+PERFILADO_MUESTREO = 0.0
+
+# Los comandos benchmark* se niegan a correr sin esto (ver trafico/benchmarks.py)
+BENCHMARKS = True
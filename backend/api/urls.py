@@ -3,7 +3,9 @@ from django.contrib import admin
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
-from trafico.views import Segmentos,matrix_api
+from trafico.views import Segmentos,matrix_api,vector_tile
+from trafico.metricas import metricas
+from trafico.admin import perfil_descarga, perfil_detalle, perfiles_lista
 from rest_framework_simplejwt.views import TokenObtainPairView,TokenRefreshView
 from auth_api.views import RegisterView, CustomTokenObtainPairView
 
@@ -23,6 +25,10 @@ schema_view = get_schema_view(
 # --- Rutas de la API ---
 urlpatterns = [
     # 1. Endpoints de Datos
+    # Perfiles de peticiones (antes de admin/ para que no los capture el admin)
+    path("admin/perfiles/", admin.site.admin_view(perfiles_lista), name="perfiles_lista"),
+    path("admin/perfiles/<str:perfil_id>/", admin.site.admin_view(perfil_detalle), name="perfil_detalle"),
+    path("admin/perfiles/<str:perfil_id>.prof", admin.site.admin_view(perfil_descarga), name="perfil_descarga"),
     path('admin/',admin.site.urls),
     path('api/segmentos/', Segmentos.as_view(), name='segmentos'),
     path("api/", include("traffic_predictor.urls")),  # Incluir URLs del predictor de tráfico
@@ -30,9 +36,13 @@ urlpatterns = [
     path("api/auth/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("api/auth/register/", RegisterView.as_view(), name="register"),
     path("trafico/", include("trafico.urls")),  
+    path("tiles/<int:z>/<int:x>/<int:y>.mvt", vector_tile, name="vector-tile"),
     # 2. Endpoint para Matrix API (Mapbox)
     path('api/matrix/', matrix_api, name='matrix-api'),
 
+    # Métricas (Prometheus)
+    path("metrics", metricas, name="metrics"),
+
     # 2. Documentación Swagger (UI)
     path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
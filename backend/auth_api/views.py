@@ -5,7 +5,9 @@ from .serializers import CustomTokenObtainPairSerializer, UserSerializer
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from rest_framework_simplejwt.views import TokenObtainPairView
+from trafico.presupuestos import presupuesto_consultas
 
+@presupuesto_consultas(4)
 class RegisterView(APIView):
     """
     Vista para registrar un nuevo usuario.
@@ -28,5 +30,6 @@ class RegisterView(APIView):
             return Response({"message": "Usuario registrado exitosamente."}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+@presupuesto_consultas(3)
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
\ No newline at end of file
@@ -1,31 +1,63 @@
 # paradas_osm.py
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+OVERPASS_URL = os.getenv("OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+OVERPASS_TIMEOUT = 60
 
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+_session = None
 
 
-def get_bus_stops_in_segment_bbox(segmento, padding=0.0005):
+def get_session(pool_size=10):
     """
-    Dado un objeto Segmento (con geometria = LineStringField SRID 4326),
-    consulta en OpenStreetMap las paradas oficiales de bus (highway=bus_stop)
-    dentro de un bounding box alrededor del segmento.
+    Session HTTP compartida (keep-alive + pool de conexiones) con reintentos
+    y backoff para los 429/5xx habituales de Overpass.
+    """
+    global _session
+    if _session is None:
+        retry = Retry(
+            total=3,
+            backoff_factor=1.0,
+            status_forcelist=(429, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "POST"}),
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        _session = requests.Session()
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
 
-    Retorna una lista de diccionarios con:
-    - id (osm_id)
-    - lat
-    - lon
-    - name
+
+def bbox_de_segmento(segmento, padding=0.0005):
+    """
+    Bounding box de Overpass (south, west, north, east) alrededor del segmento.
     """
     # extent = (minx, miny, maxx, maxy) = (lon_min, lat_min, lon_max, lat_max)
     minx, miny, maxx, maxy = segmento.geometria.extent
+    return (miny - padding, minx - padding, maxy + padding, maxx + padding)
+
+
+def bbox_combinado(bboxes):
+    """Un solo bbox que cubre todos los dados."""
+    bboxes = list(bboxes)
+    return (
+        min(b[0] for b in bboxes),
+        min(b[1] for b in bboxes),
+        max(b[2] for b in bboxes),
+        max(b[3] for b in bboxes),
+    )
 
-    # Overpass usa: (south, west, north, east) = (lat_min, lon_min, lat_max, lon_max)
-    south = miny - padding
-    west = minx - padding
-    north = maxy + padding
-    east = maxx + padding
 
-    query = f"""
+def consulta_paradas(bbox):
+    south, west, north, east = bbox
+    return f"""
     [out:json];
     node
       ["highway"="bus_stop"]
@@ -33,10 +65,51 @@ def get_bus_stops_in_segment_bbox(segmento, padding=0.0005):
     out body;
     """
 
-    response = requests.post(OVERPASS_URL, data={"data": query}, timeout=60)
+
+def consultar_overpass(query, url=None, cache_dir=None, offline=False, max_edad=None):
+    """
+    Ejecuta una consulta Overpass y retorna el JSON.
+    Si hay cache_dir, la respuesta cruda se guarda en disco (clave = hash de
+    URL + consulta). Se reutiliza solo con offline=True (nunca se sale a la
+    red) o si tiene menos de `max_edad` segundos; si no, se vuelve a pedir
+    y se reemplaza, así las paradas nuevas de OSM llegan en cada carga.
+    """
+    url = url or OVERPASS_URL
+    ruta = None
+
+    if cache_dir:
+        clave = hashlib.sha1(f"{url}\n{query}".encode()).hexdigest()
+        ruta = Path(cache_dir) / f"{clave}.json"
+        try:
+            edad = time.time() - ruta.stat().st_mtime
+        except FileNotFoundError:
+            edad = None
+        if edad is not None and (offline or (max_edad is not None and edad < max_edad)):
+            return json.loads(ruta.read_bytes())
+
+    if offline:
+        raise FileNotFoundError(f"Respuesta de Overpass no cacheada (modo offline): {ruta}")
+
+    response = get_session().post(url, data={"data": query}, timeout=OVERPASS_TIMEOUT)
     response.raise_for_status()
-    data = response.json()
 
+    if ruta is not None:
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        tmp = ruta.with_suffix(".tmp")
+        tmp.write_bytes(response.content)
+        os.replace(tmp, ruta)
+
+    return response.json()
+
+
+def parsear_paradas(data):
+    """
+    Convierte la respuesta de Overpass en una lista de diccionarios con:
+    - id (osm_id)
+    - lat
+    - lon
+    - name
+    """
     bus_stops = []
 
     for el in data.get("elements", []):
@@ -50,3 +123,17 @@ def get_bus_stops_in_segment_bbox(segmento, padding=0.0005):
         )
 
     return bus_stops
+
+
+def get_bus_stops_in_bbox(bbox, **kwargs):
+    """Paradas oficiales (highway=bus_stop) dentro de un bbox (south, west, north, east)."""
+    return parsear_paradas(consultar_overpass(consulta_paradas(bbox), **kwargs))
+
+
+def get_bus_stops_in_segment_bbox(segmento, padding=0.0005, **kwargs):
+    """
+    Dado un objeto Segmento (con geometria = LineStringField SRID 4326),
+    consulta en OpenStreetMap las paradas oficiales de bus (highway=bus_stop)
+    dentro de un bounding box alrededor del segmento.
+    """
+    return get_bus_stops_in_bbox(bbox_de_segmento(segmento, padding), **kwargs)
@@ -1,79 +1,19 @@
-import pandas as pd
-import joblib
 import os
-import numpy as np
-from django.utils import timezone
 from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
 
-# Importamos los modelos
 from .models import PrediccionPorSegmento, PrediccionRutaOptima
-from trafico.models import Segmento, RutaAlterna
-
-BASE_PATH = os.path.join(
-    os.path.dirname(os.path.abspath(__file__)),
-    "models"
-)
-
-# INFO SEGMENTOS (Tu configuración original)
-SEGMENTOS_INFO = {
-    1: {"longitud_km": 12.755, "paradas_cercanas": 6},
-    2: {"longitud_km": 13.073, "paradas_cercanas": 4},
-    3: {"longitud_km": 12.969, "paradas_cercanas": 3},
-    4: {"longitud_km": 13.055, "paradas_cercanas": 5},
-    5: {"longitud_km": 12.614, "paradas_cercanas": 3},
-    6: {"longitud_km": 13.621, "paradas_cercanas": 6},
-    7: {"longitud_km": 13.167, "paradas_cercanas": 2},
-    8: {"longitud_km": 13.335, "paradas_cercanas": 2},
-    9: {"longitud_km": 15.138, "paradas_cercanas": 4},
-    10: {"longitud_km": 41.974, "paradas_cercanas": 1},
-}
-
-DIAS_ES = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
-
-# --- FUNCIONES AUXILIARES (Tus funciones originales de cálculo) ---
-
-def congestion_base_hora(h: int) -> float:
-    if 0 <= h <= 4: return 1
-    if h == 5: return 3.5
-    if 6 <= h <= 10: return np.random.uniform(4.5, 5)
-    if 11 <= h <= 12: return np.random.uniform(3, 4)
-    if 13 <= h <= 15: return 3
-    if 16 <= h <= 21: return np.random.uniform(4.5, 5)
-    if h == 22: return 3.5
-    if h == 23: return np.random.uniform(1, 2)
-    return 2
-
-def velocidad_por_congestion(cong: float) -> float:
-    if cong < 2: return np.random.uniform(40, 55)
-    if cong < 3: return np.random.uniform(30, 40)
-    if cong < 4: return np.random.uniform(20, 30)
-    return np.random.uniform(6, 12)
-
-def carga_por_congestion(cong: float, segmento_id: int) -> int:
-    carga = 200 + cong * 90
-    if cong >= 4.3: carga *= 1.35
-    if segmento_id in (1, 2): carga *= 1.10
-    return int(carga)
-
-def load_model_nuevo(segmento_id: int):
-    model_path = os.path.join(BASE_PATH, f"model_segmento_nuevo_{segmento_id}.pkl")
-    if not os.path.exists(model_path):
-        raise FileNotFoundError(f"No existe modelo para segmento {segmento_id}")
-    return joblib.load(model_path)
-
-
-# ============================================================
-# 1. PREDICCIÓN DE TRÁFICO (Genera y Guarda en BD)
-# ============================================================
-import pandas as pd
-import numpy as np
-import joblib
-import os
-from datetime import timedelta
-from django.utils import timezone
+from trafico.models import RutaAlterna
+from trafico.metadatos import info_segmento, obtener as obtener_metadatos
+from trafico import limites, metricas, presupuestos
+from trafico.tiles import invalidar_hora
+from trafico.perezoso import importar
 
-from .models import PrediccionPorSegmento
-from trafico.models import Segmento
+# Se cargan en la primera predicción, no al importar las URLs
+pd = importar("pandas")
+np = importar("numpy")
+joblib = importar("joblib")
 
 # -----------------------------------
 # CONFIGURACIÓN
@@ -84,21 +24,14 @@ BASE_PATH = os.path.join(
     "models"
 )
 
-SEGMENTOS_INFO = {
-    1: {"longitud_km": 12.755, "paradas_cercanas": 6},
-    2: {"longitud_km": 13.073, "paradas_cercanas": 4},
-    3: {"longitud_km": 12.969, "paradas_cercanas": 3},
-    4: {"longitud_km": 13.055, "paradas_cercanas": 5},
-    5: {"longitud_km": 12.614, "paradas_cercanas": 3},
-    6: {"longitud_km": 13.621, "paradas_cercanas": 6},
-    7: {"longitud_km": 13.167, "paradas_cercanas": 2},
-    8: {"longitud_km": 13.335, "paradas_cercanas": 2},
-    9: {"longitud_km": 15.138, "paradas_cercanas": 4},
-    10: {"longitud_km": 41.974, "paradas_cercanas": 1},
-}
-
 DIAS_ES = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
 
+# Regresores que describen el segmento. Los .pkl se entrenaron con los valores
+# de dataset_trafico_30dias.csv, que no coinciden con los derivados de la
+# geometría (trafico/metadatos.py): hasta reentrenar y activar
+# REGRESORES_DESDE_BD el modelo recibe los valores de su entrenamiento.
+REGRESORES_SEGMENTO = ("longitud_km", "paradas_cercanas")
+
 
 # -----------------------------------
 # FUNCIONES AUXILIARES
@@ -130,11 +63,33 @@ def carga_por_congestion(cong, segmento_id):
     return int(carga)
 
 
+def regresores_segmento(model, info_seg):
+    """
+    {regresor: valor} de longitud_km y paradas_cercanas para el modelo.
+    Sin REGRESORES_DESDE_BD se usan los del entrenamiento, que Prophet
+    guarda en model.history (estandarizados con mu/std; las columnas
+    constantes quedan tal cual). Si el modelo no los tiene, los de la BD.
+    """
+    valores = {nombre: info_seg[nombre] for nombre in REGRESORES_SEGMENTO}
+    if getattr(settings, "REGRESORES_DESDE_BD", False):
+        return valores
+
+    historia = getattr(model, "history", None)
+    for nombre in REGRESORES_SEGMENTO:
+        props = getattr(model, "extra_regressors", {}).get(nombre)
+        if historia is None or props is None or nombre not in historia.columns:
+            continue
+        valores[nombre] = float(historia[nombre].iloc[-1]) * props.get("std", 1.0) + props.get("mu", 0.0)
+    return valores
+
+
 def load_model_nuevo(segmento_id):
     model_path = os.path.join(BASE_PATH, f"model_segmento_nuevo_{segmento_id}.pkl")
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"No existe modelo para segmento {segmento_id}")
-    return joblib.load(model_path)
+    modelo = joblib.load(model_path)
+    metricas.modelo_cargado(segmento_id)
+    return modelo
 
 
 # ============================================================
@@ -146,7 +101,9 @@ def predict_congestion_24h(segmento_id: int, fecha: str | None = None):
     # -------------------------
     # Validación
     # -------------------------
-    if segmento_id not in SEGMENTOS_INFO:
+    # Longitud y paradas derivadas de la geometría (caché en memoria, sin consulta)
+    info_seg = info_segmento(segmento_id)
+    if info_seg is None:
         raise ValueError(f"Segmento {segmento_id} no definido")
 
     # -------------------------
@@ -173,14 +130,14 @@ def predict_congestion_24h(segmento_id: int, fecha: str | None = None):
     # -------------------------
     # Buscar en BD (cache)
     # -------------------------
-    preds_bd = PrediccionPorSegmento.objects.filter(
-        segmento_id=segmento_id,
-        fecha_hora_prediccion__range=(fecha_inicio, fecha_fin)
-    ).order_by("fecha_hora_prediccion")
-
-    info_seg = SEGMENTOS_INFO[segmento_id]
-
-    if preds_bd.count() >= 24:
+    with metricas.etapa("prediccion_cache_bd"):
+        preds_bd = list(PrediccionPorSegmento.objects.filter(
+            segmento_id=segmento_id,
+            fecha_hora_prediccion__range=(fecha_inicio, fecha_fin)
+        ).order_by("fecha_hora_prediccion"))
+
+    metricas.cache("predicciones_bd", len(preds_bd) >= 24)
+    if len(preds_bd) >= 24:
         resultados = []
         for p in preds_bd:
             resultados.append({
@@ -197,111 +154,123 @@ def predict_congestion_24h(segmento_id: int, fecha: str | None = None):
             })
         return resultados
 
-    # -------------------------
-    # Cargar modelo
-    # -------------------------
-    model = load_model_nuevo(segmento_id)
-    tipo_dia = DIAS_ES[fecha_base_dt.weekday()]
-
-    # -------------------------
-    # Generar dataframe 24h futuros
-    # -------------------------
-    rows = []
-    for h in range(24):
-        precipitacion = 0.0
-        if h in (16, 17, 18, 19, 20):
-            precipitacion = float(np.random.choice([0, 0, 0.5, 1.5, 3]))
-
-        rows.append({
-            "ds": fecha_base_dt + timedelta(hours=h),
-            "hour": h,
-            "hora": f"{h:02d}:00",
-            "fecha": fecha_base_dt.strftime("%Y-%m-%d"),
-            "tipo_dia": tipo_dia,
-            "precipitacion": precipitacion,
-            "entrada_estudiantes": 1 if h == 7 else 0,
-            "salida_estudiantes": 1 if h in (12, 17) else 0,
-            "entrada_trabajadores": 1 if h == 7 else 0,
-            "salida_trabajadores": 1 if h == 17 else 0,
-            "construccion_vial": 1 if segmento_id == 1 else 0,
-            "longitud_km": info_seg["longitud_km"],
-            "paradas_cercanas": info_seg["paradas_cercanas"],
-        })
+    # Turno global de cómputo: evita que muchas peticiones a la vez saturen la CPU con Prophet
+    with limites.computo():
+        # -------------------------
+        # Cargar modelo
+        # -------------------------
+        with metricas.etapa("prediccion_carga_modelo"):
+            model = load_model_nuevo(segmento_id)
+        tipo_dia = DIAS_ES[fecha_base_dt.weekday()]
+        regresores = regresores_segmento(model, info_seg)
+
+        # -------------------------
+        # Generar dataframe 24h futuros
+        # -------------------------
+        rows = []
+        for h in range(24):
+            precipitacion = 0.0
+            if h in (16, 17, 18, 19, 20):
+                precipitacion = float(np.random.choice([0, 0, 0.5, 1.5, 3]))
+
+            rows.append({
+                "ds": fecha_base_dt + timedelta(hours=h),
+                "hour": h,
+                "hora": f"{h:02d}:00",
+                "fecha": fecha_base_dt.strftime("%Y-%m-%d"),
+                "tipo_dia": tipo_dia,
+                "precipitacion": precipitacion,
+                "entrada_estudiantes": 1 if h == 7 else 0,
+                "salida_estudiantes": 1 if h in (12, 17) else 0,
+                "entrada_trabajadores": 1 if h == 7 else 0,
+                "salida_trabajadores": 1 if h == 17 else 0,
+                "construccion_vial": 1 if segmento_id == 1 else 0,
+                "longitud_km": regresores["longitud_km"],
+                "paradas_cercanas": regresores["paradas_cercanas"],
+            })
 
-    future_df = pd.DataFrame(rows)
-    future_df = pd.get_dummies(future_df, columns=["tipo_dia"], drop_first=False)
+        future_df = pd.DataFrame(rows)
+        future_df = pd.get_dummies(future_df, columns=["tipo_dia"], drop_first=False)
     
-    future_df['ds'] = future_df['ds'].dt.tz_localize(None)
+        future_df['ds'] = future_df['ds'].dt.tz_localize(None)
 
-    # Asegurar columnas requeridas por Prophet
-    for reg in model.extra_regressors.keys():
-        if reg not in future_df.columns:
-            future_df[reg] = 0
+        # Asegurar columnas requeridas por Prophet
+        for reg in model.extra_regressors.keys():
+            if reg not in future_df.columns:
+                future_df[reg] = 0
 
-    # -------------------------
-    # Pronóstico Prophet
-    # -------------------------
-    forecast = model.predict(future_df)
+        # -------------------------
+        # Pronóstico Prophet
+        # -------------------------
+        with metricas.etapa("prediccion_modelo"):
+            forecast = model.predict(future_df)
 
-    def clamp(v): return max(1, min(5, float(v)))
+        def clamp(v): return max(1, min(5, float(v)))
 
-    resultados = []
-    objetos_db = []
-    segmento_obj = Segmento.objects.get(pk=segmento_id)
-
-    # -------------------------
-    # Construcción final de 24 horas
-    # -------------------------
-    for i, f in forecast.iterrows():
-        h = int(future_df.loc[i, "hour"])
-
-        base = congestion_base_hora(h)
-        y_model = clamp(f["yhat"])
-        nivel = clamp(0.7 * base + 0.3 * y_model)
-
-        vel = velocidad_por_congestion(nivel)
-        long_km = float(future_df.loc[i, "longitud_km"])
-        tiempo = (long_km / vel) * 60
-        carga = carga_por_congestion(nivel, segmento_id)
-
-        fecha_hora_exacta = future_df.loc[i, "ds"]
-
-        # Asegurar aware datetime
-        if timezone.is_naive(fecha_hora_exacta):
-            fecha_hora_exacta = timezone.make_aware(fecha_hora_exacta)
-
-        # JSON
-        resultados.append({
-            "segmento_id": segmento_id,
-            "fecha": future_df.loc[i, "fecha"],
-            "hora": future_df.loc[i, "hora"],
-            "nivel_congestion": round(nivel, 2),
-            "velocidad_kmh": round(vel, 2),
-            "tiempo_estimado_min": round(tiempo, 2),
-            "longitud_km": long_km,
-            "carga_vehicular": carga,
-            "paradas_cercanas": int(future_df.loc[i, "paradas_cercanas"]),
-        })
-
-        # Para guardar en BD
-        objetos_db.append(
-            PrediccionPorSegmento(
-                segmento=segmento_obj,
-                fecha_hora_prediccion=fecha_hora_exacta,
-                nivel_congestion_predicho=int(round(nivel)),
-                velocidad_estimada=round(vel, 2),
-            )
-        )
+        resultados = []
+        objetos_db = []
+
+        # -------------------------
+        # Construcción final de 24 horas
+        # -------------------------
+        with metricas.etapa("prediccion_postproceso"):
+            for i, f in forecast.iterrows():
+                h = int(future_df.loc[i, "hour"])
+
+                base = congestion_base_hora(h)
+                y_model = clamp(f["yhat"])
+                nivel = clamp(0.7 * base + 0.3 * y_model)
+
+                vel = velocidad_por_congestion(nivel)
+                # El tiempo usa la longitud real, no el regresor del modelo
+                long_km = info_seg["longitud_km"]
+                tiempo = (long_km / vel) * 60
+                carga = carga_por_congestion(nivel, segmento_id)
+
+                fecha_hora_exacta = future_df.loc[i, "ds"]
+
+                # Asegurar aware datetime
+                if timezone.is_naive(fecha_hora_exacta):
+                    fecha_hora_exacta = timezone.make_aware(fecha_hora_exacta)
+
+                # JSON
+                resultados.append({
+                    "segmento_id": segmento_id,
+                    "fecha": future_df.loc[i, "fecha"],
+                    "hora": future_df.loc[i, "hora"],
+                    "nivel_congestion": round(nivel, 2),
+                    "velocidad_kmh": round(vel, 2),
+                    "tiempo_estimado_min": round(tiempo, 2),
+                    "longitud_km": long_km,
+                    "carga_vehicular": carga,
+                    "paradas_cercanas": info_seg["paradas_cercanas"],
+                })
+
+                # Para guardar en BD
+                objetos_db.append(
+                    PrediccionPorSegmento(
+                        segmento_id=segmento_id,
+                        fecha_hora_prediccion=fecha_hora_exacta,
+                        nivel_congestion_predicho=int(round(nivel)),
+                        velocidad_estimada=round(vel, 2),
+                    )
+                )
 
     # -------------------------
     # Guardar en BD
     # -------------------------
-    PrediccionPorSegmento.objects.filter(
-        segmento=segmento_obj,
-        fecha_hora_prediccion__range=(fecha_inicio, fecha_fin)
-    ).delete()
+    with metricas.etapa("prediccion_guardado"):
+        PrediccionPorSegmento.objects.filter(
+            segmento_id=segmento_id,
+            fecha_hora_prediccion__range=(fecha_inicio, fecha_fin)
+        ).delete()
+
+        PrediccionPorSegmento.objects.bulk_create(objetos_db)
 
-    PrediccionPorSegmento.objects.bulk_create(objetos_db)
+    # bulk_create no dispara señales: invalidamos los vector tiles de esas horas.
+    # La caché HTTP no: ninguna respuesta guardada incluye un día que recién se calcula.
+    for obj in objetos_db:
+        invalidar_hora(obj.fecha_hora_prediccion)
 
     return resultados
 
@@ -309,6 +278,7 @@ def predict_congestion_24h(segmento_id: int, fecha: str | None = None):
 # ============================================================
 # 2. PREDICCIÓN DE MEJOR RUTA (Consume lo anterior)
 # ============================================================
+@metricas.etapa("recomendacion")
 def recomendar_mejor_segmento(fecha_hora_str):
 
     # 1. Parsear la fecha
@@ -325,8 +295,9 @@ def recomendar_mejor_segmento(fecha_hora_str):
     # 2. Revisar si ya está guardado en BD
     cached = PrediccionRutaOptima.objects.filter(
         fecha_hora_objetivo=dt_hora
-    ).first()
+    ).select_related("ruta_recomendada__segmento_inicio").first()
 
+    metricas.cache("recomendacion_bd", cached is not None)
     if cached:
         return {
             "fecha_hora": dt_hora,
@@ -337,43 +308,54 @@ def recomendar_mejor_segmento(fecha_hora_str):
         }
 
     # 3. Evaluar TODOS los segmentos existentes
-    segmentos = Segmento.objects.all()
-    if not segmentos.exists():
+    metadatos = obtener_metadatos()
+    if not metadatos:
         return {"error": "No hay segmentos definidos"}
 
+    # Predicciones de la hora para todos los segmentos en una sola consulta
+    preds = {
+        p.segmento_id: p
+        for p in PrediccionPorSegmento.objects.filter(fecha_hora_prediccion=dt_hora)
+    }
+
+    faltantes = [seg_id for seg_id in metadatos if seg_id not in preds]
+    if faltantes:
+        # Si no existe predicción → generarla (el costo por segmento lo declara la vista)
+        presupuestos.items(len(faltantes))
+        for seg_id in faltantes:
+            try:
+                predict_congestion_24h(seg_id, dt_hora.date().strftime("%Y-%m-%d"))
+            except FileNotFoundError:
+                continue  # segmento sin modelo entrenado
+        preds.update(
+            (p.segmento_id, p)
+            for p in PrediccionPorSegmento.objects.filter(
+                segmento_id__in=faltantes,
+                fecha_hora_prediccion=dt_hora
+            )
+        )
+
     mejor_seg = None
     menor_tiempo = float("inf")
     mejor_nivel = None
 
-    for seg in segmentos:
-        pred = PrediccionPorSegmento.objects.filter(
-            segmento_id=seg.segmento_id,
-            fecha_hora_prediccion=dt_hora
-        ).first()
-
-        if not pred:
-            # Si no existe predicción → generarla
-            predict_congestion_24h(seg.segmento_id, dt_hora.date().strftime("%Y-%m-%d"))
-            pred = PrediccionPorSegmento.objects.filter(
-                segmento_id=seg.segmento_id,
-                fecha_hora_prediccion=dt_hora
-            ).first()
-
+    for seg_id, info in metadatos.items():
+        pred = preds.get(seg_id)
         if not pred:
             continue
 
         # Cálculo de tiempo estimado
         velocidad = float(pred.velocidad_estimada or 30)
-        distancia = seg.longitud_km or 10
+        distancia = info["longitud_km"] or 10
         tiempo = (distancia / velocidad) * 60  # minutos
         nivel = pred.nivel_congestion_predicho
 
         if tiempo < menor_tiempo:
             menor_tiempo = tiempo
-            mejor_seg = seg
+            mejor_seg = seg_id
             mejor_nivel = nivel
 
-    if not mejor_seg:
+    if mejor_seg is None:
         return {"error": "No se pudo determinar el mejor segmento"}
 
     # 4. Guardar resultado en BD como PrediccionRutaOptima
@@ -381,8 +363,8 @@ def recomendar_mejor_segmento(fecha_hora_str):
         fecha_hora_objetivo=dt_hora,
         defaults={
             "ruta_recomendada": RutaAlterna.objects.create(
-                nombre=f"Segmento {mejor_seg.segmento_id} (individual)",
-                segmento_inicio=mejor_seg,
+                nombre=f"Segmento {mejor_seg} (individual)",
+                segmento_inicio_id=mejor_seg,
                 activa=False
             ),
             "tiempo_promedio_estimado": menor_tiempo,
@@ -392,7 +374,7 @@ def recomendar_mejor_segmento(fecha_hora_str):
 
     return {
         "fecha_hora": dt_hora,
-        "mejor_segmento": mejor_seg.segmento_id,
+        "mejor_segmento": mejor_seg,
         "tiempo_estimado_min": round(menor_tiempo, 2),
         "nivel_congestion": mejor_nivel,
         "origen": "calculo_real"
@@ -13,10 +13,21 @@ BASE_PATH = os.path.join(
 os.makedirs(BASE_PATH, exist_ok=True)
 
 
-def train_all_segments():
+def train_all_segments(metadatos=None):
+    """
+    metadatos: {segmento_id: {"longitud_km", "paradas_cercanas"}} (p. ej.
+    trafico.metadatos.obtener()) para entrenar con los valores de la BD en
+    vez de los del CSV. Después se activa REGRESORES_DESDE_BD.
+    """
     print("📄 Cargando dataset: dataset_trafico_30dias.csv")
     df = pd.read_csv("dataset_trafico_30dias.csv")
 
+    if metadatos:
+        for columna in ("longitud_km", "paradas_cercanas"):
+            df[columna] = df["segmento_id"].map(
+                {seg: info[columna] for seg, info in metadatos.items()}
+            ).fillna(df[columna])
+
     # ---------------------------------
     # Columnas básicas para Prophet
     # ---------------------------------
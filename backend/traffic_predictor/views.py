@@ -1,4 +1,5 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.exceptions import Throttled
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
@@ -8,6 +9,9 @@ from drf_yasg import openapi
 
 # Importamos funciones de lógica de tráfico
 from .predict import predict_congestion_24h, recomendar_mejor_segmento
+from trafico import cache_http
+from trafico.limites import PrediccionThrottle, RecomendacionThrottle, Saturado
+from trafico.presupuestos import presupuesto_consultas
 
 
 # ----------------------------
@@ -19,7 +23,7 @@ predict_request_schema = openapi.Schema(
     properties={
         "segmento_id": openapi.Schema(
             type=openapi.TYPE_INTEGER,
-            description="ID del segmento (1-10)",
+            description="ID del segmento",
             default=1
         ),
         "fecha": openapi.Schema(
@@ -49,13 +53,27 @@ route_request_schema = openapi.Schema(
 # ==========================================
 # ENDPOINT 1: PREDECIR CONGESTIÓN (24H)
 # ==========================================
+def _segmento_pedido(request):
+    """Las respuestas cacheadas se invalidan por segmento (ver trafico/signals.py)."""
+    try:
+        return str(int(request.data["segmento_id"]))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
 @swagger_auto_schema(
     method='post',
     request_body=predict_request_schema,
     responses={200: "Predicción de 24h generada correctamente"}
 )
+@presupuesto_consultas(5)
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@throttle_classes([PrediccionThrottle])
+# Solo con fecha explícita: sin ella la predicción es la del día en curso
+@cache_http.cachear(
+    "prediccion", grupos=("predicciones",), si=lambda request: "fecha" in request.data, parte=_segmento_pedido
+)
 def predict_traffic(request):
     """
     Devuelve la predicción hora por hora de un segmento específico.
@@ -76,6 +94,8 @@ def predict_traffic(request):
 
         return Response(resultado, status=status.HTTP_200_OK)
 
+    except Saturado as e:
+        raise Throttled(wait=e.espera, detail=str(e))
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -88,8 +108,11 @@ def predict_traffic(request):
     request_body=route_request_schema,
     responses={200: "Mejor segmento calculado correctamente"}
 )
+# Por segmento sin predicción: lectura, borrado e inserción
+@presupuesto_consultas(10, por_item=3)
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@throttle_classes([RecomendacionThrottle])
 def get_best_segment(request):
     data = request.data
     fecha_hora = data.get("fecha_hora")
@@ -97,5 +120,8 @@ def get_best_segment(request):
     if not fecha_hora:
         return Response({"error": "Debe enviar fecha_hora"}, status=400)
 
-    resultado = recomendar_mejor_segmento(fecha_hora)
+    try:
+        resultado = recomendar_mejor_segmento(fecha_hora)
+    except Saturado as e:
+        raise Throttled(wait=e.espera, detail=str(e))
     return Response(resultado)
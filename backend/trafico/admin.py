@@ -1,6 +1,10 @@
 from django.contrib.gis.admin import GISModelAdmin
 from django.contrib import admin
-from .models import Segmento, MedicionTrafico, RutaAlterna, RutaAlternaSegmento
+from django.http import FileResponse, Http404
+from django.template.response import TemplateResponse
+
+from . import perfilado
+from .models import Segmento, MedicionTrafico, MedicionHoraria, MedicionDiaria, RutaAlterna, RutaAlternaSegmento
 
 class SegmentoAdmin(GISModelAdmin):
     # Opcional: centrar mapa (pero será un mapa "default", no OSM bonito)
@@ -17,4 +21,37 @@ class RutaAlternaAdmin(admin.ModelAdmin):
 
 admin.site.register(Segmento, SegmentoAdmin)
 admin.site.register(MedicionTrafico)
+admin.site.register(MedicionHoraria)
+admin.site.register(MedicionDiaria)
 admin.site.register(RutaAlterna, RutaAlternaAdmin)
+
+
+# ------------------------------
+# Perfiles de peticiones (trafico/perfilado.py)
+# ------------------------------
+def perfiles_lista(request):
+    contexto = {
+        **admin.site.each_context(request),
+        "title": "Perfiles de peticiones",
+        "perfiles": perfilado.listar(),
+    }
+    return TemplateResponse(request, "admin/trafico/perfiles.html", contexto)
+
+
+def perfil_detalle(request, perfil_id):
+    perfil = perfilado.obtener(perfil_id)
+    if perfil is None:
+        raise Http404("Perfil no encontrado")
+    contexto = {
+        **admin.site.each_context(request),
+        "title": f"Perfil {perfil_id}",
+        "perfil": perfil,
+    }
+    return TemplateResponse(request, "admin/trafico/perfil_detalle.html", contexto)
+
+
+def perfil_descarga(request, perfil_id):
+    if perfilado.obtener(perfil_id) is None:
+        raise Http404("Perfil no encontrado")
+    archivo = perfilado.directorio() / f"{perfil_id}.prof"
+    return FileResponse(archivo.open("rb"), as_attachment=True, filename=archivo.name)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class TraficoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'trafico'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,226 @@
+# trafico/benchmarks.py
+"""
+Piezas de la suite de benchmarks (comando `benchmark`).
+
+- ModeloFalso imita la parte de la interfaz de Prophet que usa
+  traffic_predictor/predict.py (extra_regressors y predict(df) -> yhat),
+  para medir el resto del camino sin Prophet ni los .pkl reales.
+- Datos sintéticos (paradas) y un cronómetro común.
+- Comparación de resultados contra una base guardada en JSON.
+- Arranque de un proceso nuevo (settings, URLs y primera petición), con
+  el detalle de `python -X importtime`.
+- aislado(): los comandos benchmark* solo corren con api.settings_bench y
+  dentro de una caché en memoria propia y carpetas temporales para tiles y
+  perfiles, sin tocar la caché compartida ni las versiones de caché.
+"""
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+
+from .models import ParadaBus
+
+# Regresores con los que se entrenaron los modelos (ver training.py)
+REGRESORES = (
+    "precipitacion",
+    "entrada_estudiantes",
+    "salida_estudiantes",
+    "entrada_trabajadores",
+    "salida_trabajadores",
+    "construccion_vial",
+    "longitud_km",
+    "paradas_cercanas",
+)
+# Un caso es regresión si tarda más que la base por encima de esta fracción
+TOLERANCIA = 0.20
+# Librerías que no deberían cargarse al arrancar (ver trafico/perezoso.py)
+PESADOS = ("pandas", "numpy", "joblib", "prophet", "cmdstanpy", "shapely", "pyproj", "networkx", "requests")
+
+# Lo que hace un worker al levantarse: settings + apps, URLs (todas las vistas) y una petición
+_SCRIPT_ARRANQUE = """
+import json, sys, time
+inicio = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+aplicacion = get_wsgi_application()
+setup = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+urls = time.perf_counter()
+estado = []
+environ = {"REQUEST_METHOD": "GET", "PATH_INFO": sys.argv[1], "HTTP_HOST": "localhost",
+           "REMOTE_ADDR": "127.0.0.1", "SERVER_NAME": "localhost", "SERVER_PORT": "80", "wsgi.url_scheme": "http",
+           "wsgi.input": sys.stdin.buffer, "wsgi.errors": sys.stderr}
+b"".join(aplicacion(environ, lambda s, h, e=None: estado.append(s)))
+fin = time.perf_counter()
+print(json.dumps({
+    "setup_ms": (setup - inicio) * 1000,
+    "urls_ms": (urls - setup) * 1000,
+    "peticion_ms": (fin - urls) * 1000,
+    "estado": estado[0] if estado else None,
+    "pesados": [m for m in json.loads(sys.argv[2]) if m in sys.modules],
+}))
+"""
+
+
+@contextmanager
+def aislado():
+    """
+    Entorno de la suite: exige BENCHMARKS (api.settings_bench) y, mientras
+    dura, usa una caché en memoria propia (lo que también aísla
+    versiones_cache) y carpetas temporales para TILES_CACHE_DIR y
+    PERFILADO_DIR. Retorna la carpeta temporal.
+    """
+    if not getattr(settings, "BENCHMARKS", False):
+        raise ImproperlyConfigured("Los benchmarks solo corren con --settings=api.settings_bench")
+
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as carpeta, override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": carpeta}},
+        TILES_CACHE_DIR=Path(carpeta) / "tiles",
+        PERFILADO_DIR=Path(carpeta) / "perfiles",
+    ):
+        yield Path(carpeta)
+
+
+class ModeloFalso:
+    """Sustituto de Prophet: curva diaria determinista con dos picos (7:00 y 17:00)."""
+
+    def __init__(self, segmento_id):
+        self.segmento_id = segmento_id
+        self.extra_regressors = {nombre: {} for nombre in REGRESORES}
+
+    def predict(self, df):
+        horas = pd.to_datetime(df["ds"]).dt.hour.to_numpy()
+        picos = np.exp(-((horas - 7) ** 2) / 4) + np.exp(-((horas - 17) ** 2) / 6)
+        yhat = 1.5 + 3.0 * picos + 0.05 * self.segmento_id
+        return pd.DataFrame({
+            "ds": df["ds"].to_numpy(),
+            "yhat": yhat,
+            "yhat_lower": yhat - 0.5,
+            "yhat_upper": yhat + 0.5,
+        })
+
+
+def crear_paradas_sinteticas(segmentos, total, semilla=0):
+    """Crea `total` paradas repartidas cerca de los vértices de los segmentos."""
+    aleatorio = random.Random(semilla)
+    paradas = []
+    for i in range(total):
+        segmento = segmentos[i % len(segmentos)]
+        lon, lat = aleatorio.choice(segmento.geometria.coords)
+        paradas.append(ParadaBus(
+            segmento_id=segmento.segmento_id,
+            osm_id=f"benchmark-{i}",
+            nombre=f"Parada {i}",
+            geom=Point(lon + aleatorio.uniform(-1e-4, 1e-4), lat + aleatorio.uniform(-1e-4, 1e-4), srid=4326),
+        ))
+    ParadaBus.objects.bulk_create(paradas, batch_size=2_000)
+    return len(paradas)
+
+
+def medir(funcion, repeticiones=1):
+    """
+    Ejecuta `funcion(i)` `repeticiones` veces (i = número de repetición).
+    Retorna {"ms": mediana, "min_ms", "cpu_ms": mediana de CPU del proceso, "n"}.
+    """
+    tiempos, cpu = [], []
+    for i in range(repeticiones):
+        inicio, inicio_cpu = time.perf_counter(), time.process_time()
+        funcion(i)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        cpu.append((time.process_time() - inicio_cpu) * 1000)
+    return {
+        "ms": round(statistics.median(tiempos), 3),
+        "min_ms": round(min(tiempos), 3),
+        "cpu_ms": round(statistics.median(cpu), 3),
+        "n": len(tiempos),
+    }
+
+
+def guardar(resultado, ruta):
+    ruta = Path(ruta)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    ruta.write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding="utf-8")
+
+
+def cargar(ruta):
+    ruta = Path(ruta)
+    if not ruta.exists():
+        return None
+    return json.loads(ruta.read_text(encoding="utf-8"))
+
+
+def comparar(actual, base, tolerancia=TOLERANCIA):
+    """
+    [(caso, ms_base, ms_actual, cambio, regresion)] para los casos presentes
+    en ambos; cambio = ms_actual / ms_base - 1 (positivo = más lento).
+    """
+    filas = []
+    for caso, medicion in actual["casos"].items():
+        previa = base.get("casos", {}).get(caso)
+        if not previa or not previa.get("ms"):
+            continue
+        cambio = medicion["ms"] / previa["ms"] - 1
+        filas.append((caso, previa["ms"], medicion["ms"], cambio, cambio > tolerancia))
+    return filas
+
+
+def arrancar(ruta="/metrics", importtime=False):
+    """
+    Levanta un intérprete nuevo con los mismos settings, carga las URLs y
+    atiende `ruta`. Retorna el JSON del script más "total_ms" (reloj de
+    pared, incluye el intérprete) y, con importtime, "importaciones":
+    [(ms_acumulados, modulo)] de los módulos de primer nivel.
+    """
+    comando = [sys.executable]
+    if importtime:
+        comando += ["-X", "importtime"]
+    comando += ["-c", _SCRIPT_ARRANQUE, ruta, json.dumps(PESADOS)]
+    entorno = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE,
+        # Las carpetas de aislado() también para el proceso nuevo
+        "TILES_CACHE_DIR": str(settings.TILES_CACHE_DIR),
+        "PERFILADO_DIR": str(settings.PERFILADO_DIR),
+    }
+
+    inicio = time.perf_counter()
+    proceso = subprocess.run(
+        comando, cwd=settings.BASE_DIR, env=entorno, capture_output=True, text=True,
+        stdin=subprocess.DEVNULL,
+    )
+    total = (time.perf_counter() - inicio) * 1000
+    if proceso.returncode != 0:
+        raise RuntimeError(f"El arranque falló:\n{proceso.stderr[-2000:]}")
+
+    resultado = json.loads(proceso.stdout.strip().splitlines()[-1])
+    resultado["total_ms"] = total
+    if importtime:
+        resultado["importaciones"] = _importaciones(proceso.stderr)
+    return resultado
+
+
+def _importaciones(salida):
+    """Parsea `-X importtime` (una línea "import time: propio | acumulado | módulo" por import)."""
+    filas = []
+    for linea in salida.splitlines():
+        if not linea.startswith("import time:") or "imported package" in linea:
+            continue
+        _, acumulado, modulo = linea[len("import time:"):].split("|")
+        # La indentación del nombre indica el anidamiento: un espacio = primer nivel
+        if modulo.startswith("  "):
+            continue
+        filas.append((int(acumulado) / 1000, modulo.strip()))
+    return sorted(filas, reverse=True)
@@ -0,0 +1,174 @@
+# trafico/cache_http.py
+"""
+Caché de respuestas de las vistas de solo lectura (paradas, predicciones).
+
+    @api_view(["GET"])
+    @cachear("paradas", grupos=("paradas",))
+    def vista(request): ...
+
+El decorador va debajo de @api_view: corre después de la autenticación y
+los permisos de DRF. La clave incluye la ruta, los query params (y el
+cuerpo en POST), el formato negociado, el alcance (público o por usuario)
+y la versión de cada grupo de datos del que depende la respuesta. Las
+señales de Segmento, ParadaBus y PrediccionPorSegmento suben la versión
+de su grupo con invalidar(); las entradas viejas expiran solas. Con
+`parte` la versión se acota a una parte del grupo (las predicciones, por
+segmento): invalidar(grupo, parte=...) solo descarta esas respuestas.
+
+Como la clave cambia con las versiones, también sirve de ETag: un
+If-None-Match (o If-Modified-Since) vigente se responde 304 sin tocar la
+caché ni la BD. La cabecera X-Cache indica HIT/MISS y los aciertos se
+cuentan en /metrics (trafico_cache_total{cache="http_<nombre>"}).
+"""
+import functools
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from . import metricas
+from .respuestas import etag_coincide, no_modificado
+from .versiones_cache import incrementar_version, obtener_version
+
+GRUPOS = ("segmentos", "paradas", "predicciones")
+
+
+def _prefijos(grupos, parte=None):
+    """Un prefijo por grupo y, con parte, otro por la parte de cada grupo."""
+    prefijos = [f"cache_http:{g}" for g in grupos]
+    if parte is not None:
+        prefijos += [f"cache_http:{g}:{parte}" for g in grupos]
+    return prefijos
+
+
+def invalidar(*grupos, parte=None):
+    """
+    Descarta las respuestas que dependen de esos grupos (se llama desde las
+    señales). Con parte, solo las de esa parte de cada grupo.
+    """
+    for grupo in grupos:
+        prefijo = f"cache_http:{grupo}" if parte is None else f"cache_http:{grupo}:{parte}"
+        incrementar_version(f"{prefijo}:version")
+        # Siempre avanza: dos cambios en el mismo segundo no deben dar el mismo Last-Modified
+        previo = cache.get(f"{prefijo}:modificado", 0)
+        cache.set(f"{prefijo}:modificado", max(int(time.time()), previo + 1), timeout=None)
+
+
+def ultima_modificacion(*grupos, parte=None):
+    """Epoch (s) del último invalidar() de los grupos; la primera vez, el momento de la consulta."""
+    ahora = int(time.time())
+    claves = [f"{prefijo}:modificado" for prefijo in _prefijos(grupos, parte)]
+    for clave in claves:
+        cache.add(clave, ahora, timeout=None)
+    return max(cache.get_many(claves).values(), default=ahora)
+
+
+def _huella(request, grupos, por_usuario, parte=None):
+    alcance = f"u{request.user.pk}" if por_usuario and request.user.is_authenticated else "publico"
+    partes = {
+        "metodo": request.method,
+        "ruta": request.path,
+        "params": sorted(request.query_params.lists()),
+        "cuerpo": request.data if request.method == "POST" else None,
+        "formato": getattr(request.accepted_renderer, "format", None),
+        "alcance": alcance,
+        "versiones": [obtener_version(f"{prefijo}:version") for prefijo in _prefijos(grupos, parte)],
+    }
+    return hashlib.sha1(json.dumps(partes, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _cabeceras(respuesta, etag, modificado, por_usuario, estado_cache=None):
+    respuesta["ETag"] = etag
+    respuesta["Last-Modified"] = http_date(modificado)
+    # El navegador guarda la respuesta pero revalida siempre (If-None-Match)
+    respuesta["Cache-Control"] = "private, no-cache" if por_usuario else "no-cache"
+    if estado_cache:
+        respuesta["X-Cache"] = estado_cache
+    patch_vary_headers(respuesta, ("Accept", "Authorization") if por_usuario else ("Accept",))
+    return respuesta
+
+
+def _guardar_streaming(contenido, content_type, clave, timeout):
+    """Reenvía los fragmentos al cliente y guarda el cuerpo completo si no supera CACHE_HTTP_MAX_BYTES."""
+    maximo = settings.CACHE_HTTP_MAX_BYTES
+    fragmentos, tamano = [], 0
+    for fragmento in contenido:
+        if fragmentos is not None:
+            tamano += len(fragmento)
+            if tamano > maximo:
+                fragmentos = None
+            else:
+                fragmentos.append(fragmento)
+        yield fragmento
+    if fragmentos is not None:
+        cache.set(clave, ("bytes", b"".join(fragmentos), content_type), timeout)
+
+
+def cachear(nombre, grupos, por_usuario=False, si=None, timeout=None, parte=None):
+    """
+    Decorador de vistas DRF (debajo de @api_view).
+
+    - grupos: datos de los que depende la respuesta (ver GRUPOS).
+    - por_usuario: la respuesta depende del usuario; si no, se comparte.
+    - si: función request -> bool; solo se cachea cuando retorna True.
+    - parte: función request -> str | None; la parte de los grupos de la
+      que depende la respuesta (ver invalidar()).
+
+    Si los datos cambian mientras corre la vista (la propia vista o una
+    escritura concurrente), la respuesta se entrega pero no se guarda.
+    """
+    desconocidos = set(grupos) - set(GRUPOS)
+    if desconocidos:
+        raise ValueError(f"Grupos de caché desconocidos: {', '.join(sorted(desconocidos))}")
+
+    def decorar(vista):
+        @functools.wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            if si is not None and not si(request):
+                return vista(request, *args, **kwargs)
+
+            parte_pedida = parte(request) if parte is not None else None
+            huella = _huella(request, grupos, por_usuario, parte_pedida)
+            etag = f'"{huella}"'
+            modificado = ultima_modificacion(*grupos, parte=parte_pedida)
+            if request.method in ("GET", "HEAD"):
+                if etag_coincide(request, etag) or no_modificado(request, modificado):
+                    metricas.cache(f"http_{nombre}", True)
+                    return _cabeceras(HttpResponseNotModified(), etag, modificado, por_usuario)
+
+            clave = f"cache_http:{nombre}:{huella}"
+            guardado = cache.get(clave)
+            metricas.cache(f"http_{nombre}", guardado is not None)
+            if guardado is not None:
+                if guardado[0] == "bytes":
+                    respuesta = HttpResponse(guardado[1], content_type=guardado[2])
+                else:
+                    respuesta = Response(guardado[1])
+                return _cabeceras(respuesta, etag, modificado, por_usuario, "HIT")
+
+            respuesta = vista(request, *args, **kwargs)
+            if respuesta.status_code != 200:
+                return respuesta  # errores y 404 no se cachean
+            if _huella(request, grupos, por_usuario, parte_pedida) != huella:
+                # Guardada con la versión vieja nunca se leería, y con la nueva podría estar atrasada
+                respuesta["X-Cache"] = "MISS"
+                return respuesta
+
+            duracion = timeout if timeout is not None else settings.CACHE_HTTP_TIMEOUT
+            if isinstance(respuesta, StreamingHttpResponse):
+                respuesta.streaming_content = _guardar_streaming(
+                    respuesta.streaming_content, respuesta["Content-Type"], clave, duracion
+                )
+            else:
+                cache.set(clave, ("datos", respuesta.data), duracion)
+            return _cabeceras(respuesta, etag, modificado, por_usuario, "MISS")
+
+        return envoltura
+
+    return decorar
@@ -0,0 +1,152 @@
+# trafico/compresion.py
+"""
+Compresión de respuestas negociada por Accept-Encoding: brotli (si el
+paquete opcional `brotli` está instalado) o gzip.
+
+- Solo tipos que comprimen bien (JSON, texto, CSV, vector tiles) y de al
+  menos COMPRESION_MINIMO bytes; las que ya traen Content-Encoding (el
+  blob gzip de /api/segmentos/) se dejan tal cual.
+- Las respuestas por streaming (paradas, exportaciones) se comprimen
+  fragmento a fragmento, sin juntar el cuerpo en memoria.
+- El ETag pasa a débil (W/"..."): el cuerpo ya no es byte a byte el mismo.
+- BREACH: una respuesta a una petición con credenciales (Authorization o
+  cookies) puede mezclar secretos con texto del atacante. Esas van solo en
+  gzip y con un nombre de archivo aleatorio en la cabecera, de 1 a
+  COMPRESION_RELLENO_MAX bytes, para que la longitud no delate cuánto
+  comprimió (la misma defensa que GZipMiddleware de Django). Brotli no tiene
+  dónde rellenar, así que no se usa para ellas.
+"""
+import gzip
+import re
+import secrets
+import string
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from . import metricas
+
+try:
+    import brotli
+except ImportError:  # dependencia opcional
+    brotli = None
+
+COMPRIMIBLES = re.compile(r"^(text/|application/(json|geo\+json|javascript|xml|vnd\.mapbox-vector-tile))")
+
+
+def disponibles():
+    """Codificaciones soportadas, en orden de preferencia."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def con_credenciales(request):
+    """True si la petición trae Authorization o cookies (su respuesta puede llevar secretos)."""
+    return "Authorization" in request.headers or bool(request.COOKIES)
+
+
+def _calidades(accept_encoding):
+    """{codificación: q} de una cabecera Accept-Encoding."""
+    aceptadas = {}
+    for parte in accept_encoding.split(","):
+        nombre, _, parametros = parte.strip().partition(";")
+        q = 1.0
+        if parametros.strip().startswith("q="):
+            try:
+                q = float(parametros.strip()[2:])
+            except ValueError:
+                q = 0.0
+        aceptadas[nombre.strip().lower()] = q
+    return aceptadas
+
+
+def acepta(accept_encoding, codificacion):
+    """True si el cliente acepta la codificación (respeta q=0 y '*')."""
+    aceptadas = _calidades(accept_encoding)
+    return aceptadas.get(codificacion, aceptadas.get("*", 0.0)) > 0
+
+
+def negociar(accept_encoding, relleno=False):
+    """La mejor codificación que acepta el cliente, o None. Con `relleno`, solo gzip."""
+    for codificacion in ("gzip",) if relleno else disponibles():
+        if acepta(accept_encoding, codificacion):
+            return codificacion
+    return None
+
+
+def _rellenar(datos):
+    """
+    Pone un nombre de archivo aleatorio (FNAME) en la cabecera gzip de
+    `datos`, que empiezan con los 10 bytes fijos de la cabecera.
+    """
+    largo = 1 + secrets.randbelow(settings.COMPRESION_RELLENO_MAX)
+    nombre = "".join(secrets.choice(string.ascii_letters) for _ in range(largo)).encode()
+    cabecera = bytearray(datos[:10])
+    cabecera[3] |= gzip.FNAME
+    return bytes(cabecera) + nombre + b"\x00" + datos[10:]
+
+
+def comprimir(contenido, codificacion, relleno=False):
+    if codificacion == "br":
+        return brotli.compress(contenido, quality=settings.COMPRESION_BROTLI_CALIDAD)
+    comprimido = gzip.compress(contenido, compresslevel=settings.COMPRESION_GZIP_NIVEL, mtime=0)
+    return _rellenar(comprimido) if relleno else comprimido
+
+
+def _comprimir_flujo(fragmentos, codificacion, relleno=False):
+    if codificacion == "br":
+        compresor = brotli.Compressor(quality=settings.COMPRESION_BROTLI_CALIDAD)
+        for fragmento in fragmentos:
+            salida = compresor.process(fragmento) + compresor.flush()
+            if salida:
+                yield salida
+        yield compresor.finish()
+        return
+
+    compresor = zlib.compressobj(settings.COMPRESION_GZIP_NIVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    # zlib escribe la cabecera gzip con la primera salida: ahí va el relleno
+    pendiente_relleno = relleno
+    for fragmento in fragmentos:
+        salida = compresor.compress(fragmento) + compresor.flush(zlib.Z_SYNC_FLUSH)
+        if salida:
+            if pendiente_relleno:
+                salida, pendiente_relleno = _rellenar(salida), False
+            yield salida
+    salida = compresor.flush()
+    yield _rellenar(salida) if pendiente_relleno else salida
+
+
+class CompresionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if response.has_header("Content-Encoding") or not COMPRIMIBLES.match(response.get("Content-Type", "")):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESION_MINIMO:
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        relleno = con_credenciales(request)
+        codificacion = negociar(request.headers.get("Accept-Encoding", ""), relleno)
+        if codificacion is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = _comprimir_flujo(response.streaming_content, codificacion, relleno)
+            del response["Content-Length"]
+        else:
+            with metricas.etapa("compresion"):
+                comprimido = comprimir(response.content, codificacion, relleno)
+            if len(comprimido) >= len(response.content):
+                return response
+            response.content = comprimido
+            response["Content-Length"] = str(len(comprimido))
+
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = codificacion
+        return response
@@ -0,0 +1,209 @@
+# trafico/estadisticas.py
+"""
+Estadísticas de tráfico por segmento calculadas dentro de PostgreSQL
+(percentile_cont, date_trunc, funciones de ventana) y cacheadas por
+(segmento, rango). La caché se invalida por versión al ingerir datos.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+
+from . import replicas
+from .models import MedicionTrafico, ResumenMediciones, Segmento
+from .versiones_cache import incrementar_version, obtener_version
+
+CACHE_TIMEOUT = getattr(settings, "ESTADISTICAS_CACHE_TIMEOUT", 60 * 60)
+HORAS_SEMANA = 7 * 24
+_VERSION_GLOBAL = "todos"
+
+_carga = contextvars.ContextVar("estadisticas_carga", default=None)
+
+
+class BackendNoSoportado(Exception):
+    """La consulta usa funciones de PostgreSQL/PostGIS y la BD es otra."""
+
+
+# ------------------------------
+# Versionado de caché
+# ------------------------------
+def _clave_version(segmento):
+    return f"estadisticas:version:{segmento}"
+
+
+def invalidar_estadisticas(segmentos=None):
+    """
+    Invalida las estadísticas cacheadas de los segmentos dados (o de todos).
+    Se llama después de ingerir o borrar mediciones.
+    """
+    claves = [_VERSION_GLOBAL] + list(segmentos or [])
+    if segmentos is None:
+        claves += list(Segmento.objects.values_list("segmento_id", flat=True))
+
+    for segmento in set(claves):
+        incrementar_version(_clave_version(segmento))
+
+
+@contextmanager
+def carga_masiva():
+    """
+    Agrupa las invalidaciones de una carga fila a fila (cargar_datos): las
+    mediciones guardadas dentro invalidan sus segmentos una sola vez, al salir.
+    """
+    segmentos = set()
+    token = _carga.set(segmentos)
+    try:
+        yield
+    finally:
+        _carga.reset(token)
+        if segmentos:
+            invalidar_estadisticas(segmentos)
+
+
+def medicion_guardada(segmento_id):
+    """Desde la señal post_save de MedicionTrafico."""
+    segmentos = _carga.get()
+    if segmentos is None:
+        invalidar_estadisticas([segmento_id])
+    else:
+        segmentos.add(segmento_id)
+
+
+def _clave(segmento, desde, hasta):
+    # Una consulta de un solo segmento depende de su versión; la de
+    # todos los segmentos depende de la versión global.
+    version = obtener_version(_clave_version(segmento if segmento is not None else _VERSION_GLOBAL))
+    return f"estadisticas:{version}:{segmento or _VERSION_GLOBAL}:{desde.isoformat()}:{hasta.isoformat()}"
+
+
+def estadisticas_cacheadas(segmento, desde, hasta):
+    clave = _clave(segmento, desde, hasta)
+    datos = cache.get(clave)
+    if datos is None:
+        datos = calcular_estadisticas(segmento, desde, hasta)
+        cache.set(clave, datos, CACHE_TIMEOUT)
+    return datos
+
+
+# ------------------------------
+# Consultas (PostgreSQL)
+# ------------------------------
+def _filtro(segmento, desde, hasta):
+    sql = "fecha_hora >= %s AND fecha_hora < %s"
+    params = [desde, hasta]
+    if segmento is not None:
+        sql += " AND segmento_id = %s"
+        params.append(segmento)
+    return sql, params
+
+
+def calcular_estadisticas(segmento, desde, hasta):
+    """
+    Retorna una lista (un elemento por segmento) con arreglos compactos:
+    - velocidad: promedio, p50, p90
+    - histograma_congestion: muestras por nivel 1..5
+    - perfil_semanal: 168 valores (lunes 00h .. domingo 23h), null sin datos
+    - tendencia: promedio diario, media móvil de 7 días y pendiente (km/h por día)
+    """
+    if connection.vendor != "postgresql":
+        raise BackendNoSoportado("Las estadísticas requieren PostgreSQL")
+
+    tabla = MedicionTrafico._meta.db_table
+    filtro, params = _filtro(segmento, desde, hasta)
+    tz = settings.TIME_ZONE
+    niveles = ResumenMediciones.NIVELES_CONGESTION
+    conteos = ", ".join(
+        f"count(*) FILTER (WHERE nivel_congestion = {n})" for n in niveles
+    )
+
+    resultado = {}
+
+    with connections[replicas.lectura()].cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT segmento_id,
+                   count(*),
+                   avg(velocidad_promedio)::float,
+                   percentile_cont(ARRAY[0.5, 0.9]) WITHIN GROUP (ORDER BY velocidad_promedio::float),
+                   {conteos}
+            FROM {tabla}
+            WHERE {filtro}
+            GROUP BY segmento_id
+            ORDER BY segmento_id
+            """,
+            params,
+        )
+        for seg_id, muestras, promedio, (p50, p90), *histograma in cursor.fetchall():
+            resultado[seg_id] = {
+                "segmento": seg_id,
+                "muestras": muestras,
+                "velocidad": {
+                    "promedio": round(promedio, 2),
+                    "p50": round(p50, 2),
+                    "p90": round(p90, 2),
+                },
+                "histograma_congestion": histograma,
+                "perfil_semanal": {
+                    "velocidad": [None] * HORAS_SEMANA,
+                    "congestion": [None] * HORAS_SEMANA,
+                },
+                "tendencia": {"dias": [], "velocidad": [], "media_movil_7d": [], "pendiente_kmh_dia": None},
+            }
+
+        if not resultado:
+            return []
+
+        # Perfil por hora de la semana (isodow: 1 = lunes)
+        cursor.execute(
+            f"""
+            SELECT segmento_id,
+                   ((extract(isodow FROM fecha_hora AT TIME ZONE %s) - 1) * 24
+                     + extract(hour FROM fecha_hora AT TIME ZONE %s))::int AS slot,
+                   avg(velocidad_promedio)::float,
+                   avg(nivel_congestion)::float
+            FROM {tabla}
+            WHERE {filtro}
+            GROUP BY 1, 2
+            """,
+            [tz, tz] + params,
+        )
+        for seg_id, slot, velocidad, congestion in cursor.fetchall():
+            perfil = resultado[seg_id]["perfil_semanal"]
+            perfil["velocidad"][slot] = round(velocidad, 2)
+            perfil["congestion"][slot] = round(congestion, 2)
+
+        # Tendencia diaria con media móvil y pendiente de regresión
+        cursor.execute(
+            f"""
+            WITH diario AS (
+                SELECT segmento_id,
+                       date_trunc('day', fecha_hora AT TIME ZONE %s) AS dia,
+                       avg(velocidad_promedio)::float AS velocidad
+                FROM {tabla}
+                WHERE {filtro}
+                GROUP BY 1, 2
+            )
+            SELECT segmento_id,
+                   dia::date,
+                   velocidad,
+                   avg(velocidad) OVER (
+                       PARTITION BY segmento_id ORDER BY dia
+                       ROWS BETWEEN 6 PRECEDING AND CURRENT ROW
+                   ),
+                   regr_slope(velocidad, extract(epoch FROM dia) / 86400.0)
+                       OVER (PARTITION BY segmento_id)
+            FROM diario
+            ORDER BY segmento_id, dia
+            """,
+            [tz] + params,
+        )
+        for seg_id, dia, velocidad, media_movil, pendiente in cursor.fetchall():
+            tendencia = resultado[seg_id]["tendencia"]
+            tendencia["dias"].append(dia.isoformat())
+            tendencia["velocidad"].append(round(velocidad, 2))
+            tendencia["media_movil_7d"].append(round(media_movil, 2))
+            tendencia["pendiente_kmh_dia"] = round(pendiente, 4) if pendiente is not None else None
+
+    return list(resultado.values())
@@ -0,0 +1,205 @@
+# trafico/exportar.py
+"""
+Exportación por streaming de mediciones y predicciones.
+
+Las filas se leen con un cursor del lado del servidor (QuerySet.iterator)
+como tuplas de values_list, sin pasar por modelos ni serializadores DRF,
+y se codifican por bloques. La memoria usada no depende del total de filas.
+El alias de BD se fija antes de devolver el generador: la respuesta se
+itera después de ReplicasMiddleware.
+"""
+import csv
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from traffic_predictor.models import PrediccionPorSegmento
+from . import replicas
+from .models import MedicionTrafico
+
+FILAS_POR_BLOQUE = 5_000
+
+# fuente -> (modelo, campo de fecha, columnas)
+FUENTES = {
+    "mediciones": (
+        MedicionTrafico,
+        "fecha_hora",
+        ("id", "segmento_id", "fecha_hora", "velocidad_promedio", "nivel_congestion"),
+    ),
+    "predicciones": (
+        PrediccionPorSegmento,
+        "fecha_hora_prediccion",
+        ("id", "segmento_id", "fecha_hora_prediccion", "nivel_congestion_predicho", "velocidad_estimada"),
+    ),
+}
+
+# formato -> (content type, extensión)
+FORMATOS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+}
+
+
+class ExportacionError(ValueError):
+    """Parámetros de exportación inválidos (se responde 400)."""
+
+
+def columnas(fuente):
+    return FUENTES[fuente][2]
+
+
+def filas(fuente, segmento=None, desde=None, hasta=None, bloque=FILAS_POR_BLOQUE, alias=None):
+    """Itera tuplas (en orden de fecha) leyendo con cursor del lado del servidor."""
+    if fuente not in FUENTES:
+        raise ExportacionError(f"Fuente desconocida: {fuente}")
+
+    modelo, campo_fecha, cols = FUENTES[fuente]
+    qs = modelo.objects.using(alias or replicas.lectura())
+    if segmento is not None:
+        qs = qs.filter(segmento_id=segmento)
+    if desde is not None:
+        qs = qs.filter(**{f"{campo_fecha}__gte": desde})
+    if hasta is not None:
+        qs = qs.filter(**{f"{campo_fecha}__lt": hasta})
+
+    return qs.order_by(campo_fecha, "id").values_list(*cols).iterator(chunk_size=bloque)
+
+
+def _bloques(iterable, tamaño=None):
+    tamaño = tamaño or FILAS_POR_BLOQUE
+    bloque = []
+    for fila in iterable:
+        bloque.append(fila)
+        if len(bloque) >= tamaño:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+def _valor_json(v):
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, datetime):
+        return v.isoformat()
+    return v
+
+
+# ------------------------------
+# Codificadores (generadores de bytes)
+# ------------------------------
+class _Eco:
+    """Pseudo-archivo para csv.writer: write() devuelve la línea en vez de guardarla."""
+
+    def write(self, valor):
+        return valor
+
+
+class _Buffer:
+    """Archivo binario en memoria que se vacía después de cada bloque."""
+
+    def __init__(self):
+        self.partes = []
+        self.posicion = 0
+        self.closed = False
+
+    def write(self, data):
+        self.partes.append(bytes(data))
+        self.posicion += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.posicion
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def vaciar(self):
+        data = b"".join(self.partes)
+        self.partes = []
+        return data
+
+
+def generar_csv(cols, iterable):
+    writer = csv.writer(_Eco())
+    yield writer.writerow(cols).encode()
+    for bloque in _bloques(iterable):
+        yield "".join(writer.writerow(fila) for fila in bloque).encode()
+
+
+def generar_ndjson(cols, iterable):
+    for bloque in _bloques(iterable):
+        yield "".join(
+            json.dumps(dict(zip(cols, map(_valor_json, fila)))) + "\n" for fila in bloque
+        ).encode()
+
+
+def _esquema_arrow(pa, modelo, cols):
+    tipos = {
+        "DateTimeField": pa.timestamp("us", tz="UTC"),
+        "DecimalField": pa.float64(),
+        "IntegerField": pa.int64(),
+        "BigAutoField": pa.int64(),
+        "ForeignKey": pa.int64(),
+    }
+    campos = []
+    for col in cols:
+        campo = modelo._meta.get_field(col.removesuffix("_id"))
+        campos.append(pa.field(col, tipos.get(campo.get_internal_type(), pa.string())))
+    return pa.schema(campos)
+
+
+def _generar_arrow(fuente, cols, iterable, parquet):
+    # pyarrow es opcional: solo se necesita para estos formatos
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportacionError("Los formatos parquet/arrow requieren el paquete pyarrow")
+
+    esquema = _esquema_arrow(pa, FUENTES[fuente][0], cols)
+    sink = _Buffer()
+    if parquet:
+        writer = pyarrow.parquet.ParquetWriter(sink, esquema)
+    else:
+        writer = pyarrow.ipc.new_stream(sink, esquema)
+
+    def generar():
+        for bloque in _bloques(iterable):
+            datos = [
+                [float(v) if isinstance(v, Decimal) else v for v in columna]
+                for columna in zip(*bloque)
+            ]
+            writer.write_batch(pa.record_batch(datos, schema=esquema))
+            yield sink.vaciar()
+        writer.close()
+        yield sink.vaciar()
+
+    return generar()
+
+
+def exportar(fuente, formato, segmento=None, desde=None, hasta=None, alias=None):
+    """
+    Retorna un generador de bytes con la exportación en el formato pedido.
+    Valida los parámetros antes de abrir el cursor. `alias` es la BD de
+    lectura (por defecto, replicas.lectura() en este momento).
+    """
+    if fuente not in FUENTES:
+        raise ExportacionError(f"Fuente desconocida: {fuente}. Opciones: {', '.join(FUENTES)}")
+    if formato not in FORMATOS:
+        raise ExportacionError(f"Formato desconocido: {formato}. Opciones: {', '.join(FORMATOS)}")
+
+    cols = columnas(fuente)
+    iterable = filas(fuente, segmento=segmento, desde=desde, hasta=hasta, alias=alias)
+
+    if formato == "csv":
+        return generar_csv(cols, iterable)
+    if formato == "ndjson":
+        return generar_ndjson(cols, iterable)
+    return _generar_arrow(fuente, cols, iterable, parquet=(formato == "parquet"))
@@ -0,0 +1,33 @@
+import django_filters
+
+from .models import MedicionTrafico, MedicionHoraria, MedicionDiaria
+
+
+class MedicionFilter(django_filters.FilterSet):
+    """Filtros: ?segmento=1&nivel_congestion=4&desde=2025-11-06T00:00&hasta=2025-11-07T00:00"""
+    desde = django_filters.IsoDateTimeFilter(field_name="fecha_hora", lookup_expr="gte")
+    hasta = django_filters.IsoDateTimeFilter(field_name="fecha_hora", lookup_expr="lt")
+
+    class Meta:
+        model = MedicionTrafico
+        fields = ["segmento", "nivel_congestion"]
+
+
+class MedicionHorariaFilter(django_filters.FilterSet):
+    """Filtros: ?segmento=1&desde=2025-11-01T00:00&hasta=2025-11-08T00:00"""
+    desde = django_filters.IsoDateTimeFilter(field_name="hora", lookup_expr="gte")
+    hasta = django_filters.IsoDateTimeFilter(field_name="hora", lookup_expr="lt")
+
+    class Meta:
+        model = MedicionHoraria
+        fields = ["segmento"]
+
+
+class MedicionDiariaFilter(django_filters.FilterSet):
+    """Filtros: ?segmento=1&desde=2025-11-01&hasta=2025-12-01"""
+    desde = django_filters.DateFilter(field_name="fecha", lookup_expr="gte")
+    hasta = django_filters.DateFilter(field_name="fecha", lookup_expr="lt")
+
+    class Meta:
+        model = MedicionDiaria
+        fields = ["segmento"]
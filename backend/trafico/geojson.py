@@ -0,0 +1,141 @@
+# trafico/geojson.py
+"""
+Payload precalculado del mapa de segmentos (/api/segmentos/).
+
+La geometría casi nunca cambia, así que el JSON se construye una sola vez
+por (formato, zoom), se guarda comprimido con gzip junto a su ETag y se
+sirve tal cual. Las señales de Segmento invalidan la versión y el blob
+se reconstruye en la primera petición posterior.
+
+En PostgreSQL el documento completo se arma en la BD (json_agg +
+ST_AsGeoJSON, simplificando con ST_SimplifyPreserveTopology) y llega como
+un único texto; en otros motores se construye en Python.
+"""
+import gzip
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db import connection, connections
+
+from . import metricas, replicas
+from .models import Segmento
+from .versiones_cache import incrementar_version, obtener_version
+
+FORMATOS = ("lista", "geojson")
+ZOOM_MAX = 22
+# Desde este zoom se sirve la geometría completa (sin simplificar)
+ZOOM_DETALLE = 17
+
+_CLAVE_VERSION = "segmentos_mapa:version"
+# Los blobs de versiones viejas quedan huérfanos y expiran solos
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def tolerancia_para_zoom(zoom):
+    """
+    Tolerancia de simplificación en grados: medio píxel de un tile de 256 px
+    en ese zoom (360° / 256 / 2^zoom / 2). None = sin simplificar.
+    """
+    if zoom is None or zoom >= ZOOM_DETALLE:
+        return None
+    return 360.0 / (256 * 2 ** zoom) / 2
+
+
+def _geometria(segmento, tolerancia):
+    geom = segmento.geometria
+    if geom is None:
+        return None
+    if tolerancia:
+        geom = geom.simplify(tolerancia, preserve_topology=True)
+    return [list(c) for c in geom.coords]
+
+
+def _construir_postgres(formato, tolerancia):
+    geom = "ST_SimplifyPreserveTopology(geometria, %s)" if tolerancia else "geometria"
+    coordenadas = f"(ST_AsGeoJSON({geom})::json -> 'coordinates')"
+
+    if formato == "geojson":
+        seleccion = f"""
+            json_build_object(
+                'type', 'FeatureCollection',
+                'features', COALESCE(json_agg(json_build_object(
+                    'type', 'Feature',
+                    'id', segmento_id,
+                    'properties', json_build_object('segmento_id', segmento_id, 'nombre', nombre),
+                    'geometry', json_build_object('type', 'LineString', 'coordinates', {coordenadas})
+                ) ORDER BY segmento_id), '[]'::json)
+            )
+        """
+    else:
+        seleccion = f"""
+            COALESCE(json_agg(json_build_object(
+                'segmento_id', segmento_id, 'nombre', nombre, 'geometry', {coordenadas}
+            ) ORDER BY segmento_id), '[]'::json)
+        """
+
+    with connections[replicas.lectura()].cursor() as cursor:
+        cursor.execute(
+            f"SELECT ({seleccion})::text FROM {Segmento._meta.db_table}",
+            [tolerancia] if tolerancia else [],
+        )
+        return cursor.fetchone()[0].encode()
+
+
+def construir(formato="lista", zoom=None):
+    """
+    Genera el JSON del mapa. 'lista' mantiene el formato histórico del
+    frontend ([{segmento_id, nombre, geometry: [[lng, lat], ...]}]);
+    'geojson' devuelve un FeatureCollection.
+    """
+    tolerancia = tolerancia_para_zoom(zoom)
+    if connection.vendor == "postgresql":
+        return _construir_postgres(formato, tolerancia)
+
+    segmentos = Segmento.objects.only("segmento_id", "nombre", "geometria").order_by("segmento_id")
+
+    if formato == "geojson":
+        payload = {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "id": s.segmento_id,
+                    "properties": {"segmento_id": s.segmento_id, "nombre": s.nombre},
+                    "geometry": {"type": "LineString", "coordinates": _geometria(s, tolerancia)},
+                }
+                for s in segmentos
+            ],
+        }
+    else:
+        payload = [
+            {"segmento_id": s.segmento_id, "nombre": s.nombre, "geometry": _geometria(s, tolerancia)}
+            for s in segmentos
+        ]
+
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def obtener(formato="lista", zoom=None):
+    """
+    Retorna (cuerpo_gzip, etag) del payload, construyéndolo si no está en caché.
+    """
+    if zoom is not None:
+        zoom = max(0, min(int(zoom), ZOOM_MAX))
+        if zoom >= ZOOM_DETALLE:
+            zoom = None  # todas las variantes de detalle comparten el mismo blob
+
+    clave = f"segmentos_mapa:{obtener_version(_CLAVE_VERSION)}:{formato}:{zoom}"
+    blob = cache.get(clave)
+    metricas.cache("segmentos_mapa", blob is not None)
+    if blob is None:
+        cuerpo = construir(formato, zoom)
+        etag = '"%s"' % hashlib.sha1(cuerpo).hexdigest()
+        blob = (gzip.compress(cuerpo, compresslevel=9), etag)
+        cache.set(clave, blob, CACHE_TIMEOUT)
+    return blob
+
+
+def invalidar():
+    """Descarta todos los blobs precalculados (se llama desde las señales de Segmento)."""
+    incrementar_version(_CLAVE_VERSION)
@@ -0,0 +1,138 @@
+# trafico/limites.py
+"""
+Control de admisión de los endpoints caros.
+
+- Límite de tasa por usuario (o IP si es anónimo) con una cubeta de
+  tokens en la caché de Django, compartida entre workers: throttles de
+  DRF con su tasa en REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"]. Al vaciarse
+  la cubeta DRF responde 429 con Retry-After.
+- Límite global de cálculos de modelo simultáneos: LIMITE_COMPUTOS turnos
+  en la caché (cache.add es atómico). Quien no consigue turno espera en
+  cola hasta COLA_COMPUTOS_SEGUNDOS y, si sigue sin turno, recibe
+  Saturado (la vista responde 429 con Retry-After). Un turno de un worker
+  caído se libera solo a los COMPUTO_MAX_SEGUNDOS.
+
+Las decisiones se cuentan en /metrics (trafico_admision_total) y la
+espera en cola en trafico_cola_computo_segundos.
+
+La cubeta se lee y escribe sin bloqueo: con peticiones simultáneas del
+mismo usuario puede dejar pasar alguna de más, pero nunca rechaza de más.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import SimpleRateThrottle
+
+from . import metricas
+
+# Cada cuánto se reintenta conseguir un turno mientras se espera en cola
+SONDEO_SEGUNDOS = 0.05
+
+
+class Saturado(Exception):
+    """No hubo turno de cómputo libre dentro de la espera máxima."""
+
+    def __init__(self, espera):
+        super().__init__("El servidor está procesando demasiadas predicciones; reintente en unos segundos")
+        self.espera = espera
+
+
+# ------------------------------
+# Límite de tasa (cubeta de tokens)
+# ------------------------------
+class CubetaTokensThrottle(SimpleRateThrottle):
+    """
+    Cubeta de `n` tokens que se rellena a n por periodo ("60/min"): permite
+    ráfagas de hasta n peticiones y, en promedio, n por periodo.
+    """
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {"scope": self.scope, "ident": ident}
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+
+        ahora = self.timer()
+        por_segundo = self.num_requests / self.duration
+        tokens, ultimo = self.cache.get(self.key, (self.num_requests, ahora))
+        tokens = min(self.num_requests, tokens + (ahora - ultimo) * por_segundo)
+
+        if tokens < 1:
+            self.espera = (1 - tokens) / por_segundo
+            metricas.admision(self.scope, "rechazada")
+            return False
+
+        self.cache.set(self.key, (tokens - 1, ahora), self.duration)
+        metricas.admision(self.scope, "permitida")
+        return True
+
+    def wait(self):
+        return getattr(self, "espera", None)
+
+
+class PrediccionThrottle(CubetaTokensThrottle):
+    scope = "prediccion"
+
+
+class RecomendacionThrottle(CubetaTokensThrottle):
+    scope = "recomendacion"
+
+
+class MatrizThrottle(CubetaTokensThrottle):
+    scope = "matriz"
+
+
+class ExportacionThrottle(CubetaTokensThrottle):
+    scope = "exportacion"
+
+
+# ------------------------------
+# Límite de cómputo concurrente
+# ------------------------------
+def _turnos():
+    return [f"limites:computo:{i}" for i in range(settings.LIMITE_COMPUTOS)]
+
+
+def _tomar_turno(dueno):
+    for clave in _turnos():
+        if cache.add(clave, dueno, timeout=settings.COMPUTO_MAX_SEGUNDOS):
+            return clave
+    return None
+
+
+@contextmanager
+def computo():
+    """
+    Turno para un cálculo de modelo. Espera en cola hasta
+    COLA_COMPUTOS_SEGUNDOS; si no consigue turno lanza Saturado.
+    """
+    dueno = uuid.uuid4().hex
+    inicio = time.monotonic()
+    clave = _tomar_turno(dueno)
+    if clave is None:
+        limite = inicio + settings.COLA_COMPUTOS_SEGUNDOS
+        while clave is None:
+            if time.monotonic() >= limite:
+                metricas.admision("computo", "rechazada")
+                raise Saturado(espera=max(1, settings.COLA_COMPUTOS_SEGUNDOS))
+            time.sleep(SONDEO_SEGUNDOS)
+            clave = _tomar_turno(dueno)
+        metricas.admision("computo", "en_cola", espera=time.monotonic() - inicio)
+    else:
+        metricas.admision("computo", "permitida")
+
+    try:
+        yield
+    finally:
+        # Solo se libera si sigue siendo nuestro (pudo expirar y tomarlo otro)
+        if cache.get(clave) == dueno:
+            cache.delete(clave)
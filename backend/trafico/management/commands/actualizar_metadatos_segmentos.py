@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from trafico import metadatos
+from trafico.paradas import DISTANCIA_POR_DEFECTO
+
+
+class Command(BaseCommand):
+    help = (
+        "Calcula la longitud geodésica (km) y las paradas cercanas de cada segmento "
+        "a partir de su geometría y las guarda en Segmento"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dist", type=float, default=DISTANCIA_POR_DEFECTO,
+            help="Metros máximos entre una parada y el segmento",
+        )
+
+    def handle(self, *args, **options):
+        total = metadatos.refrescar(options["dist"])
+        self.stdout.write(self.style.SUCCESS(f"Metadatos actualizados para {total} segmentos ✅"))
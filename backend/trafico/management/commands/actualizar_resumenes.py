@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from trafico.agregados import LOTE_POR_DEFECTO, actualizar_resumenes
+
+
+class Command(BaseCommand):
+    help = (
+        "Actualiza los resúmenes horario y diario de mediciones procesando solo "
+        "las filas nuevas desde la última marca de agua (pensado para un cron)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lote", type=int, default=LOTE_POR_DEFECTO,
+            help=f"Mediciones por transacción (default: {LOTE_POR_DEFECTO})",
+        )
+
+    def handle(self, *args, **options):
+        procesadas, segmentos = actualizar_resumenes(lote=options["lote"])
+        self.stdout.write(self.style.SUCCESS(
+            f"{procesadas} mediciones nuevas agregadas ({len(segmentos)} segmentos) ✅"
+        ))
@@ -0,0 +1,218 @@
+import io
+import platform
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from unittest import mock
+
+import joblib
+import numpy as np
+from django.conf import settings
+from django.core.management import call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.renderers import JSONRenderer
+
+from traffic_predictor import predict
+from trafico import benchmarks, compresion, geojson, metadatos, renderers
+from trafico.models import MedicionTrafico, ParadaBus, Segmento
+from trafico.paradas import paradas_json
+from trafico.renderers import ORJSONRenderer
+from trafico.serializers import ParadaBusSerializer, SegmentoMapSerializer
+from trafico.views import MedicionList
+
+FECHA_BASE = date(2025, 3, 3)
+
+
+class _Deshacer(Exception):
+    """Sale del atomic() para descartar todo lo que creó la suite."""
+
+
+class Command(BaseCommand):
+    help = (
+        "Suite de benchmarks sin red ni PostGIS (usar con --settings=api.settings_bench): "
+        "arranque, predicción, recomendación, serialización del mapa/paradas y cargar_datos. "
+        "Guarda el resultado en JSON y lo compara con una base"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--modelos", choices=["falso", "real"], default="falso",
+                            help="falso: ModeloFalso sin Prophet; real: los .pkl de traffic_predictor/models")
+        parser.add_argument("--repeticiones", type=int, default=5, help="Repeticiones por caso (se informa la mediana)")
+        parser.add_argument("--paradas", type=int, default=2_000, help="Paradas sintéticas para la serialización")
+        parser.add_argument("--salida", default=str(Path(settings.BASE_DIR) / "cache" / "benchmarks" / "ultimo.json"),
+                            help="Archivo JSON con el resultado")
+        parser.add_argument("--base", default=str(Path(settings.BASE_DIR) / "benchmarks" / "base.json"),
+                            help="Resultado de referencia contra el que se compara")
+        parser.add_argument("--guardar-base", action="store_true", help="Guarda este resultado como nueva base")
+        parser.add_argument("--tolerancia", type=float, default=benchmarks.TOLERANCIA,
+                            help="Fracción de aumento a partir de la cual un caso es regresión (default 0.2)")
+        parser.add_argument("--estricto", action="store_true", help="Termina con error si hay regresiones")
+
+    def handle(self, *args, **options):
+        try:
+            with benchmarks.aislado() as carpeta:
+                casos = self._suite(options, carpeta)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        resultado = {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "entorno": {
+                "python": platform.python_version(),
+                "bd": connection.vendor,
+                "modelos": options["modelos"],
+                "repeticiones": self.repeticiones,
+            },
+            "casos": casos,
+        }
+        benchmarks.guardar(resultado, options["salida"])
+        self.stdout.write(f"Resultado guardado en {options['salida']}")
+
+        self._comparar(resultado, options)
+
+        if options["guardar_base"]:
+            benchmarks.guardar(resultado, options["base"])
+            self.stdout.write(self.style.SUCCESS(f"Nueva base guardada en {options['base']} ✅"))
+
+    # ------------------------------
+    # Preparación
+    # ------------------------------
+    def _suite(self, options, carpeta):
+        if connection.vendor == "sqlite":
+            # La BD de la suite es propia (SpatiaLite): se crea/actualiza sola
+            call_command("migrate", verbosity=0)
+
+        self.repeticiones = max(1, options["repeticiones"])
+        casos = {}
+        with self._modelos(options["modelos"], carpeta / "modelos"):
+            try:
+                with transaction.atomic():
+                    self._ejecutar(casos, options)
+                    raise _Deshacer
+            except _Deshacer:
+                pass
+        return casos
+
+    def _modelos(self, tipo, carpeta):
+        if tipo == "real":
+            return nullcontext()
+
+        # Un .pkl por segmento del dataset: también se mide joblib.load
+        carpeta.mkdir()
+        for segmento_id in range(1, 11):
+            joblib.dump(benchmarks.ModeloFalso(segmento_id), Path(carpeta) / f"model_segmento_nuevo_{segmento_id}.pkl")
+        return mock.patch.object(predict, "BASE_PATH", str(carpeta))
+
+    def _caso(self, casos, nombre, medicion, **extra):
+        casos[nombre] = {**medicion, **extra}
+        detalle = "".join(f", {k}={v}" for k, v in extra.items())
+        self.stdout.write(f"  {nombre:<28} {medicion['ms']:>10.2f} ms (mín {medicion['min_ms']:.2f}, cpu {medicion['cpu_ms']:.2f}, n={medicion['n']}{detalle})")
+
+    # ------------------------------
+    # Casos
+    # ------------------------------
+    def _ejecutar(self, casos, options):
+        np.random.seed(0)  # predict.py usa np.random para el ruido horario
+        n = self.repeticiones
+
+        # Arranque de un proceso nuevo hasta la primera respuesta (fuera de esta transacción)
+        arranque = benchmarks.arrancar()
+        self._caso(casos, "arranque", benchmarks.medir(lambda _: benchmarks.arrancar(), n),
+                   pesados=len(arranque["pesados"]))
+
+        # cargar_datos: segmentos y mediciones del dataset del repo
+        medicion = benchmarks.medir(lambda _: call_command("cargar_datos", stdout=io.StringIO()))
+        filas = MedicionTrafico.objects.count()
+        self._caso(casos, "cargar_datos", medicion, filas_por_s=round(filas / (medicion["ms"] / 1000), 1))
+
+        segmentos = list(Segmento.objects.only("segmento_id", "geometria"))
+        if not segmentos:
+            raise CommandError("cargar_datos no creó segmentos")
+        benchmarks.crear_paradas_sinteticas(segmentos, options["paradas"])
+        metadatos.invalidar()
+        segmento_id = segmentos[0].segmento_id
+
+        def fecha(dias):
+            return (FECHA_BASE + timedelta(days=dias)).isoformat()
+
+        # Predicción: primera llamada del proceso, fechas nuevas y fecha ya guardada en BD
+        self._caso(casos, "prediccion_frio", benchmarks.medir(
+            lambda _: predict.predict_congestion_24h(segmento_id, fecha(0))
+        ))
+        self._caso(casos, "prediccion_caliente", benchmarks.medir(
+            lambda i: predict.predict_congestion_24h(segmento_id, fecha(1 + i)), n
+        ))
+        self._caso(casos, "prediccion_cache_bd", benchmarks.medir(
+            lambda _: predict.predict_congestion_24h(segmento_id, fecha(0)), n
+        ))
+
+        # Recomendación: horas sin predicciones (las genera para todos los segmentos) y hora ya resuelta
+        self._caso(casos, "recomendacion_calculo", benchmarks.medir(
+            lambda i: predict.recomendar_mejor_segmento(f"{fecha(100 + i)} 08:00:00"), n
+        ))
+        self._caso(casos, "recomendacion_cache_bd", benchmarks.medir(
+            lambda _: predict.recomendar_mejor_segmento(f"{fecha(100)} 08:00:00"), n
+        ))
+
+        # Serialización del mapa de segmentos y de las paradas
+        mapa = Segmento.objects.only("segmento_id", "nombre", "geometria").order_by("segmento_id")
+        self._caso(casos, "segmentos_serializador", benchmarks.medir(
+            lambda _: JSONRenderer().render(SegmentoMapSerializer(mapa.all(), many=True).data), n
+        ))
+        self._caso(casos, "segmentos_json", benchmarks.medir(lambda _: geojson.construir("lista"), n))
+
+        total_paradas = ParadaBus.objects.count()
+        self._caso(casos, "paradas_serializador", benchmarks.medir(
+            lambda _: JSONRenderer().render(ParadaBusSerializer(ParadaBus.objects.order_by("id"), many=True).data), n
+        ), paradas=total_paradas)
+        self._caso(casos, "paradas_json", benchmarks.medir(lambda _: b"".join(paradas_json()), n),
+                   paradas=total_paradas)
+
+        # Respuestas grandes: render DRF vs orjson y bytes en el cable sin comprimir / gzip / brotli
+        self._respuestas(casos, {
+            "paradas": ParadaBusSerializer(ParadaBus.objects.order_by("id"), many=True).data,
+            "mediciones": MedicionList.serializer_class(MedicionList.queryset[:1000], many=True).data,
+            "predicciones": [
+                fila
+                for s in segmentos
+                for fila in predict.predict_congestion_24h(s.segmento_id, fecha(0))
+            ],
+        })
+
+    def _respuestas(self, casos, payloads):
+        n = self.repeticiones
+        for nombre, datos in payloads.items():
+            cuerpo = JSONRenderer().render(datos)
+            self._caso(casos, f"render_{nombre}_drf", benchmarks.medir(lambda _: JSONRenderer().render(datos), n),
+                       bytes=len(cuerpo))
+            if renderers.orjson is not None:
+                self._caso(casos, f"render_{nombre}_orjson",
+                           benchmarks.medir(lambda _: ORJSONRenderer().render(datos), n),
+                           bytes=len(ORJSONRenderer().render(datos)))
+            for codificacion in compresion.disponibles():
+                self._caso(casos, f"{codificacion}_{nombre}",
+                           benchmarks.medir(lambda _: compresion.comprimir(cuerpo, codificacion), n),
+                           bytes=len(compresion.comprimir(cuerpo, codificacion)))
+
+    # ------------------------------
+    # Comparación
+    # ------------------------------
+    def _comparar(self, resultado, options):
+        base = benchmarks.cargar(options["base"])
+        if not base or not base.get("casos"):
+            self.stdout.write(f"Sin base en {options['base']} (grabarla en la máquina de referencia con --guardar-base)")
+            return
+
+        filas = benchmarks.comparar(resultado, base, options["tolerancia"])
+        regresiones = [f for f in filas if f[4]]
+        self.stdout.write(f"Comparación con la base del {base.get('fecha')}:")
+        for caso, ms_base, ms_actual, cambio, regresion in filas:
+            linea = f"  {caso:<28} {ms_base:>10.2f} → {ms_actual:>10.2f} ms ({cambio:+.0%})"
+            self.stdout.write(self.style.ERROR(linea + " REGRESIÓN") if regresion else linea)
+
+        if regresiones and options["estricto"]:
+            raise CommandError(f"{len(regresiones)} casos más lentos que la base (> {options['tolerancia']:.0%})")
+        if not regresiones:
+            self.stdout.write(self.style.SUCCESS("Sin regresiones ✅"))
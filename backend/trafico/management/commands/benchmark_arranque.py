@@ -0,0 +1,54 @@
+import statistics
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from trafico import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el arranque de un proceso nuevo (settings, URLs y primera petición) "
+        "y resume `python -X importtime`: los módulos que más tardan y las librerías "
+        "pesadas que se cargaron antes de la primera petición. Usar con --settings=api.settings_bench"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ruta", default="/metrics", help="Primera petición (default: /metrics, sin BD)")
+        parser.add_argument("--repeticiones", type=int, default=5, help="Se informa la mediana")
+        parser.add_argument("--top", type=int, default=15, help="Módulos de primer nivel a listar")
+        parser.add_argument("--estricto", action="store_true",
+                            help="Termina con error si alguna librería pesada se cargó al arrancar")
+
+    def handle(self, *args, **options):
+        try:
+            with benchmarks.aislado():
+                # La primera corrida (con importtime) también calienta la caché de .pyc
+                detalle = benchmarks.arrancar(options["ruta"], importtime=True)
+                corridas = [benchmarks.arrancar(options["ruta"]) for _ in range(max(1, options["repeticiones"]))]
+        except (ImproperlyConfigured, RuntimeError) as e:
+            raise CommandError(str(e))
+
+        def mediana(campo):
+            return statistics.median(c[campo] for c in corridas)
+
+        self.stdout.write(
+            f"Arranque hasta la primera respuesta ({options['ruta']} → {corridas[0]['estado']}): "
+            f"{mediana('total_ms'):.0f} ms (mediana de {len(corridas)})"
+        )
+        self.stdout.write(f"  settings y apps      {mediana('setup_ms'):>8.0f} ms")
+        self.stdout.write(f"  URLs y vistas        {mediana('urls_ms'):>8.0f} ms")
+        self.stdout.write(f"  primera petición     {mediana('peticion_ms'):>8.0f} ms")
+
+        self.stdout.write("\nMódulos de primer nivel más lentos (-X importtime, acumulado):")
+        for ms, modulo in detalle["importaciones"][:options["top"]]:
+            self.stdout.write(f"  {ms:>8.1f} ms  {modulo}")
+
+        pesados = detalle["pesados"]
+        if not pesados:
+            self.stdout.write(self.style.SUCCESS("\nNinguna librería pesada cargada al arrancar ✅"))
+            return
+        mensaje = f"Librerías pesadas cargadas al arrancar: {', '.join(pesados)}"
+        if options["estricto"]:
+            raise CommandError(mensaje)
+        self.stdout.write(self.style.WARNING(f"\n{mensaje}"))
@@ -0,0 +1,87 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from trafico import benchmarks, geojson
+from trafico.models import ParadaBus, Segmento
+from trafico.paradas import paradas_json
+from trafico.serializers import ParadaBusSerializer, SegmentoMapSerializer
+
+
+class _Deshacer(Exception):
+    """Sale del atomic() para descartar las paradas sintéticas."""
+
+
+def _medir(funcion, repeticiones):
+    """Mejor tiempo (s) de `repeticiones` ejecuciones y el tamaño del resultado."""
+    mejor, tamano = float("inf"), 0
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        cuerpo = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+        tamano = len(cuerpo)
+    return mejor, tamano
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara serializadores DRF contra el JSON generado en la BD para las paradas "
+        "(N paradas sintéticas, se descartan al terminar) y el mapa de segmentos. "
+        "Usar con --settings=api.settings_bench"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--paradas", type=int, default=10_000,
+                            help="Paradas sintéticas a crear para la medición (default: 10000)")
+        parser.add_argument("--repeticiones", type=int, default=5,
+                            help="Se informa el mejor tiempo de N ejecuciones (default: 5)")
+
+    def handle(self, *args, **options):
+        try:
+            with benchmarks.aislado():
+                self._comparar_todo(options)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+    def _comparar_todo(self, options):
+        segmentos = list(Segmento.objects.only("segmento_id", "geometria"))
+        if not segmentos:
+            raise CommandError(
+                "No hay segmentos en la BD de la suite "
+                "(cargar_datos --settings=api.settings_bench, o correr antes `benchmark`)"
+            )
+        repeticiones = max(1, options["repeticiones"])
+
+        try:
+            with transaction.atomic():
+                total = benchmarks.crear_paradas_sinteticas(segmentos, options["paradas"])
+                self.stdout.write(f"{ParadaBus.objects.count():,} paradas en la BD (incluye {total:,} sintéticas)")
+                self.comparar(
+                    "paradas",
+                    lambda: JSONRenderer().render(ParadaBusSerializer(ParadaBus.objects.order_by("id"), many=True).data),
+                    lambda: b"".join(paradas_json()),
+                    repeticiones,
+                )
+                raise _Deshacer
+        except _Deshacer:
+            pass
+
+        serializados = Segmento.objects.only("segmento_id", "nombre", "geometria").order_by("segmento_id")
+        self.comparar(
+            "segmentos",
+            lambda: JSONRenderer().render(SegmentoMapSerializer(serializados.all(), many=True).data),
+            lambda: geojson.construir("lista"),
+            repeticiones,
+        )
+
+    def comparar(self, nombre, serializador, bd, repeticiones):
+        t_serializador, tamano_serializador = _medir(serializador, repeticiones)
+        t_bd, tamano_bd = _medir(bd, repeticiones)
+        self.stdout.write(
+            f"  {nombre}: serializador {t_serializador * 1000:.1f} ms ({tamano_serializador:,} bytes) | "
+            f"JSON en BD {t_bd * 1000:.1f} ms ({tamano_bd:,} bytes)"
+        )
+        self.stdout.write(self.style.SUCCESS(f"  → {t_serializador / max(t_bd, 1e-9):.1f}x más rápido"))
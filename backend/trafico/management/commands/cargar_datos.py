@@ -1,12 +1,15 @@
 import csv
 import os
 from pathlib import Path
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.gis.geos import LineString
 from trafico.models import Segmento, MedicionTrafico 
+from trafico.agregados import actualizar_resumenes
+from trafico.estadisticas import carga_masiva
+from trafico import metadatos, metricas
 from datetime import datetime
 
-class Command(BaseCommand):
+class Command(metricas.ConTiempos, BaseCommand):
     help = 'Carga datos de tráfico desde un CSV'
 
     def handle(self, *args, **kwargs):
@@ -22,7 +25,9 @@ class Command(BaseCommand):
             return
 
         try:
-            with open(csv_file_path, newline='', encoding='utf-8') as csvfile:
+            # Las señales de cada medición invalidan las estadísticas una sola vez, al terminar
+            with open(csv_file_path, newline='', encoding='utf-8') as csvfile, metricas.etapa("carga_csv"), \
+                    carga_masiva():
                 reader = csv.DictReader(csvfile)
                 count_mediciones = 0
                 
@@ -72,6 +77,22 @@ class Command(BaseCommand):
                         self.stdout.write(self.style.WARNING(f"Error guardando medicion: {e}"))
 
                 self.stdout.write(self.style.SUCCESS(f'¡ÉXITO! Total mediciones cargadas: {count_mediciones}'))
-        
+
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error abriendo el archivo CSV: {e}'))
+            return
+
+        # Mantener al día los resúmenes horario/diario del dashboard
+        try:
+            with metricas.etapa("resumenes"):
+                procesadas, _ = actualizar_resumenes()
+        except Exception as e:
+            raise CommandError(f'Error actualizando los resúmenes: {e}') from e
+        self.stdout.write(self.style.SUCCESS(f'Resúmenes actualizados con {procesadas} mediciones'))
+
+        # Longitud y paradas cercanas de los segmentos nuevos
+        try:
+            with metricas.etapa("metadatos"):
+                metadatos.refrescar()
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f'Error abriendo el archivo CSV: {e}'))
\ No newline at end of file
+            raise CommandError(f'Error actualizando los metadatos de los segmentos: {e}') from e
\ No newline at end of file
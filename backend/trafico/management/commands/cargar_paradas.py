@@ -1,75 +1,146 @@
-from django.core.management.base import BaseCommand
+import math
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import shapely
+from django.conf import settings
 from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
 
 from trafico.models import Segmento, ParadaBus
+from trafico import cache_http, metadatos, metricas, tiles
 
-# 👇 Ajusta este import según dónde tengas la función
-# Por ejemplo si está en traffic_predictor/paradas_osm.py:
-# from traffic_predictor.paradas_osm import get_bus_stops_in_segment_bbox
-from paradas_osm import get_bus_stops_in_segment_bbox
-
+from paradas_osm import (
+    bbox_combinado,
+    bbox_de_segmento,
+    get_bus_stops_in_bbox,
+)
 
 
-class Command(BaseCommand):
-    help = "Carga paradas oficiales de bus (OSM) para cada segmento"
-
-    def handle(self, *args, **options):
-        segmentos = Segmento.objects.all()
+def asignar_paradas(segmentos, paradas, distancia_max):
+    """
+    Asigna cada parada al segmento más cercano (a menos de `distancia_max`
+    metros) usando un STRtree en memoria. Las coordenadas se proyectan a
+    metros con una equirrectangular local, suficiente a escala de ciudad.
+    Retorna una lista de (parada, segmento).
+    """
+    if not segmentos or not paradas:
+        return []
 
-        if not segmentos.exists():
-            self.stdout.write(self.style.WARNING("No hay segmentos en la BD"))
-            return
+    lat0 = np.mean([c[1] for s in segmentos for c in s.geometria.coords])
+    escala = np.array([111_320.0 * math.cos(math.radians(lat0)), 110_540.0])
 
-        for segmento in segmentos:
-            self.stdout.write(
-                self.style.NOTICE(
-                    f"Buscando paradas para segmento {segmento.segmento_id} - {segmento.nombre}..."
-                )
-            )
+    lineas = [shapely.LineString(np.asarray(s.geometria.coords) * escala) for s in segmentos]
+    arbol = shapely.STRtree(lineas)
 
-            # Esta función debe devolver una lista de paradas con lon/lat, id y nombre.
-            paradas = get_bus_stops_in_segment_bbox(segmento)
+    puntos = shapely.points(np.array([(p["lon"], p["lat"]) for p in paradas]) * escala)
+    idx_paradas, idx_segmentos = arbol.query_nearest(
+        puntos, max_distance=distancia_max, all_matches=False
+    )
 
-            if not paradas:
-                self.stdout.write("  → Sin paradas encontradas para este segmento")
-                continue
+    return [(paradas[i], segmentos[j]) for i, j in zip(idx_paradas, idx_segmentos)]
 
-            creadas = 0
 
-            for parada in paradas:
-                # ⚠️ ADAPTA ESTAS CLAVES A LO QUE DEVUELVE TU FUNCION
-                # Ejemplo típico de Overpass: {"id": 123, "lat": ..., "lon": ..., "tags": {"name": "Parada X"}}
-                osm_id = str(parada.get("osm_id") or parada.get("id"))
-
-                if not osm_id:
-                    continue
-
-                # Evitar duplicados por osm_id
-                if ParadaBus.objects.filter(osm_id=osm_id).exists():
-                    continue
+class Command(metricas.ConTiempos, BaseCommand):
+    help = "Carga paradas oficiales de bus (OSM) para cada segmento"
 
-                lon = parada.get("lon")
-                lat = parada.get("lat")
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--modo", choices=["unico", "concurrente"], default="unico",
+            help="unico: una consulta con el bbox combinado; concurrente: una por segmento en paralelo",
+        )
+        parser.add_argument("--workers", type=int, default=4, help="Consultas simultáneas en modo concurrente")
+        parser.add_argument("--padding", type=float, default=0.0005, help="Margen del bbox en grados")
+        parser.add_argument(
+            "--distancia-max", type=float, default=60.0,
+            help="Distancia máxima (m) de una parada a su segmento",
+        )
+        parser.add_argument(
+            "--cache-dir", default=str(Path(settings.BASE_DIR) / "cache" / "overpass"),
+            help="Directorio donde se guardan las respuestas crudas de Overpass",
+        )
+        parser.add_argument("--offline", action="store_true", help="Usar solo respuestas cacheadas")
+        parser.add_argument(
+            "--usar-cache", type=float, nargs="?", const=24.0, metavar="HORAS",
+            help="Reutilizar respuestas cacheadas de menos de HORAS (default 24) en vez de consultar Overpass",
+        )
+        parser.add_argument("--overpass-url", help="URL alternativa (p. ej. un servidor local de pruebas)")
 
-                if lon is None or lat is None:
-                    continue
+    def handle(self, *args, **options):
+        segmentos = list(Segmento.objects.only("segmento_id", "nombre", "geometria"))
 
-                nombre = (
-                    parada.get("name")
-                    or parada.get("tags", {}).get("name")
-                    or ""
-                )
+        if not segmentos:
+            self.stdout.write(self.style.WARNING("No hay segmentos en la BD"))
+            return
 
-                ParadaBus.objects.create(
-                    segmento=segmento,
-                    osm_id=osm_id,
-                    nombre=nombre,
-                    geom=Point(lon, lat),
-                )
-                creadas += 1
+        consulta = {
+            "url": options["overpass_url"],
+            "cache_dir": options["cache_dir"],
+            "offline": options["offline"],
+            "max_edad": options["usar_cache"] * 3600 if options["usar_cache"] is not None else None,
+        }
+        bboxes = [bbox_de_segmento(s, options["padding"]) for s in segmentos]
+
+        try:
+            with metricas.etapa("paradas_overpass"):
+                paradas = self.consultar(segmentos, bboxes, consulta, options)
+        except FileNotFoundError as e:
+            raise CommandError(str(e))
+
+        if not paradas:
+            self.stdout.write("  → Sin paradas encontradas")
+            return
 
-            self.stdout.write(
-                self.style.SUCCESS(f"  → {creadas} paradas creadas para este segmento")
+        with metricas.etapa("paradas_asignacion"):
+            asignadas = asignar_paradas(segmentos, paradas, options["distancia_max"])
+        self.stdout.write(f"  → {len(paradas)} paradas en OSM, {len(asignadas)} cerca de algún segmento")
+
+        with metricas.etapa("paradas_guardado"):
+            nuevas, existentes = self.guardar(asignadas)
+
+        if nuevas:
+            # bulk_create no dispara señales
+            tiles.invalidar_geometrias()
+            cache_http.invalidar("paradas")
+            # paradas_cercanas de cada segmento
+            with metricas.etapa("metadatos"):
+                metadatos.refrescar()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Carga de paradas finalizada: {len(nuevas)} nuevas, {len(existentes)} ya existían ✅"
+        ))
+
+    def consultar(self, segmentos, bboxes, consulta, options):
+        if options["modo"] == "unico":
+            self.stdout.write(self.style.NOTICE(f"Consultando Overpass para {len(segmentos)} segmentos (bbox combinado)..."))
+            return get_bus_stops_in_bbox(bbox_combinado(bboxes), **consulta)
+
+        self.stdout.write(self.style.NOTICE(
+            f"Consultando Overpass por segmento ({options['workers']} en paralelo)..."
+        ))
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            respuestas = pool.map(lambda b: get_bus_stops_in_bbox(b, **consulta), bboxes)
+            # Una parada puede caer en el bbox de varios segmentos
+            return list({p["id"]: p for lote in respuestas for p in lote}.values())
+
+    def guardar(self, asignadas):
+        existentes = set(
+            ParadaBus.objects.filter(osm_id__in=[str(p["id"]) for p, _ in asignadas])
+            .values_list("osm_id", flat=True)
+        )
+
+        nuevas = [
+            ParadaBus(
+                segmento=segmento,
+                osm_id=str(parada["id"]),
+                nombre=parada.get("name") or "",
+                geom=Point(parada["lon"], parada["lat"], srid=4326),
             )
+            for parada, segmento in asignadas
+            if str(parada["id"]) not in existentes
+        ]
 
-        self.stdout.write(self.style.SUCCESS("Carga de paradas finalizada ✅"))
+        # ignore_conflicts cubre una carrera con otra carga simultánea
+        ParadaBus.objects.bulk_create(nuevas, batch_size=1000, ignore_conflicts=True)
+        return nuevas, existentes
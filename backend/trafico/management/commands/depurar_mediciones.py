@@ -0,0 +1,71 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from trafico.agregados import actualizar_resumenes, marca_actual
+from trafico.estadisticas import invalidar_estadisticas
+from trafico.models import MedicionTrafico
+
+
+class Command(BaseCommand):
+    help = (
+        "Elimina las mediciones crudas con más de N días. Antes actualiza los "
+        "resúmenes horario/diario, así el historial queda en MedicionHoraria"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dias", type=int, default=90,
+            help="Conservar mediciones crudas de los últimos N días (default: 90)",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Solo muestra cuántas filas se procesarían",
+        )
+
+    def handle(self, *args, **options):
+        dias = options["dias"]
+        if dias < 1:
+            self.stdout.write(self.style.ERROR("--dias debe ser mayor o igual a 1"))
+            return
+
+        corte = timezone.now() - timedelta(days=dias)
+
+        if options["dry_run"]:
+            antiguas = MedicionTrafico.objects.filter(fecha_hora__lt=corte).count()
+            self.stdout.write(
+                f"Se depurarían {antiguas} mediciones anteriores a {corte:%Y-%m-%d %H:%M}"
+            )
+            return
+
+        procesadas, _ = actualizar_resumenes()
+        self.stdout.write(f"Resúmenes actualizados con {procesadas} mediciones nuevas")
+
+        # Solo se borran filas ya incluidas en los resúmenes (id <= marca de agua)
+        antiguas = MedicionTrafico.objects.filter(fecha_hora__lt=corte, id__lte=marca_actual())
+
+        primera = antiguas.aggregate(inicio=Min("fecha_hora"))["inicio"]
+        if primera is None:
+            self.stdout.write(self.style.SUCCESS("No hay mediciones anteriores al corte ✅"))
+            return
+
+        # Borramos por ventanas de un día para acotar cada transacción
+        inicio = primera
+        total_borradas = 0
+
+        while inicio < corte:
+            fin = min(inicio + timedelta(days=1), corte)
+            borradas, _ = antiguas.filter(fecha_hora__gte=inicio, fecha_hora__lt=fin).delete()
+            total_borradas += borradas
+            if borradas:
+                self.stdout.write(f"... {inicio:%Y-%m-%d}: {borradas} mediciones eliminadas")
+            inicio = fin
+
+        if total_borradas:
+            invalidar_estadisticas()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Depuración finalizada: {total_borradas} mediciones crudas eliminadas ✅"
+        ))
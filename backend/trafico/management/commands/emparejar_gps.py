@@ -0,0 +1,114 @@
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+
+from trafico import map_matching, metricas
+from trafico.models import Segmento
+
+
+class Command(metricas.ConTiempos, BaseCommand):
+    help = (
+        "Empareja pings GPS crudos (CSV: vehiculo_id,fecha_hora,lat,lon[,velocidad]) con los "
+        "segmentos y carga las mediciones agregadas por segmento y cubeta de tiempo"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("archivo", nargs="?", help="CSV de pings (ordenados por tiempo)")
+        parser.add_argument("--cubeta", type=int, default=map_matching.CUBETA_MINUTOS, help="Minutos por cubeta")
+        parser.add_argument("--distancia", type=float, default=map_matching.DISTANCIA_MAXIMA,
+                            help="Distancia máxima (m) de un ping a su segmento")
+        parser.add_argument("--bloque", type=int, default=200_000, help="Filas del CSV por lote")
+        parser.add_argument("--dry-run", action="store_true", help="Solo emparejar, sin guardar")
+        parser.add_argument("--benchmark", type=int, metavar="N",
+                            help="Mide el throughput con N pings sintéticos sobre los segmentos (no guarda)")
+
+    def handle(self, *args, **options):
+        if options["benchmark"]:
+            return self.benchmark(options["benchmark"], options)
+
+        if not options["archivo"]:
+            raise CommandError("Indica el archivo CSV o usa --benchmark N")
+
+        emparejador = map_matching.Emparejador(
+            cubeta_minutos=options["cubeta"], distancia_max=options["distancia"]
+        )
+        inicio = time.perf_counter()
+
+        try:
+            for bloque in pd.read_csv(options["archivo"], chunksize=options["bloque"]):
+                with metricas.etapa("gps_emparejamiento"):
+                    emparejador.procesar(bloque)
+                self.stdout.write(f"... {emparejador.pings} pings, {emparejador.emparejados} emparejados")
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        filas = emparejador.resultados()
+        segundos = time.perf_counter() - inicio
+        self.stdout.write(
+            f"  → {len(filas)} mediciones de {emparejador.emparejados}/{emparejador.pings} pings "
+            f"({emparejador.pings / max(segundos, 1e-9):,.0f} pings/s)"
+        )
+
+        if options["dry_run"]:
+            return
+
+        with metricas.etapa("gps_guardado"):
+            guardadas = map_matching.guardar(filas)
+        self.stdout.write(self.style.SUCCESS(f"{guardadas} mediciones cargadas ✅"))
+
+    def benchmark(self, total, options):
+        segmentos = list(Segmento.objects.only("segmento_id", "geometria"))
+        if not segmentos:
+            raise CommandError("No hay segmentos en la BD")
+
+        inicio = time.perf_counter()
+        indice = map_matching.IndiceSegmentos((s.segmento_id, s.geometria.coords) for s in segmentos)
+        self.stdout.write(f"Índice de {len(indice)} segmentos en {time.perf_counter() - inicio:.3f}s")
+
+        pings = _pings_sinteticos(segmentos, total)
+        emparejador = map_matching.Emparejador(
+            indice, cubeta_minutos=options["cubeta"], distancia_max=options["distancia"]
+        )
+
+        inicio = time.perf_counter()
+        for desde in range(0, total, options["bloque"]):
+            emparejador.procesar(pings.iloc[desde:desde + options["bloque"]])
+        filas = emparejador.resultados()
+        segundos = time.perf_counter() - inicio
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{total:,} pings en {segundos:.3f}s → {total / segundos:,.0f} pings/s "
+            f"({emparejador.emparejados:,} emparejados, {len(filas)} mediciones)"
+        ))
+
+
+def _pings_sinteticos(segmentos, total, intervalo=10, semilla=0):
+    """
+    Vehículos que recorren segmentos al azar con un ping cada `intervalo`
+    segundos y ~5 m de ruido, ordenados por tiempo como un feed real.
+    """
+    rng = np.random.default_rng(semilla)
+    por_vehiculo = 60
+    vehiculos = max(1, -(-total // por_vehiculo))  # el último puede quedar incompleto
+
+    extremos = np.array([(s.geometria.coords[0], s.geometria.coords[-1]) for s in segmentos])
+    elegido = rng.integers(len(segmentos), size=vehiculos)
+
+    vehiculo = np.repeat(np.arange(vehiculos), por_vehiculo)[:total]
+    paso = np.tile(np.arange(por_vehiculo), vehiculos)[:total]
+    avance = paso / (por_vehiculo - 1)
+
+    a = extremos[elegido[vehiculo], 0]
+    b = extremos[elegido[vehiculo], 1]
+    lonlat = a + (b - a) * avance[:, None] + rng.normal(0, 5e-5, size=(total, 2))
+
+    t = 1_700_000_000 + paso * intervalo + rng.integers(0, 3600, size=vehiculos)[vehiculo]
+    pings = pd.DataFrame({
+        "vehiculo_id": vehiculo,
+        "fecha_hora": t.astype(float),
+        "lon": lonlat[:, 0],
+        "lat": lonlat[:, 1],
+    })
+    return pings.sort_values("fecha_hora", kind="stable", ignore_index=True)
@@ -0,0 +1,49 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from trafico import exportar
+from trafico.parametros import parse_limite
+
+
+class Command(BaseCommand):
+    help = (
+        "Exporta mediciones o predicciones (CSV, NDJSON, Parquet o Arrow) leyendo "
+        "con un cursor del servidor, en memoria constante"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fuente", choices=list(exportar.FUENTES), default="mediciones")
+        parser.add_argument("--formato", choices=list(exportar.FORMATOS), default="csv")
+        parser.add_argument("--segmento", type=int, help="Filtrar por segmento_id")
+        parser.add_argument("--desde", help="YYYY-MM-DD o ISO 8601 (inclusive)")
+        parser.add_argument("--hasta", help="YYYY-MM-DD o ISO 8601 (exclusivo; una fecha incluye el día)")
+        parser.add_argument("--salida", help="Archivo de destino (por defecto stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            contenido = exportar.exportar(
+                options["fuente"],
+                options["formato"],
+                segmento=options["segmento"],
+                desde=parse_limite(options["desde"]),
+                hasta=parse_limite(options["hasta"], fin=True),
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if not options["salida"]:
+            for bloque in contenido:
+                sys.stdout.buffer.write(bloque)
+            sys.stdout.buffer.flush()
+            return
+
+        total = 0
+        with open(options["salida"], "wb") as destino:
+            for bloque in contenido:
+                destino.write(bloque)
+                total += len(bloque)
+
+        self.stderr.write(self.style.SUCCESS(
+            f"Exportación guardada en {options['salida']} ({total / 1024:.1f} KB) ✅"
+        ))
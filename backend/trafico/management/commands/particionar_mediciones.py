@@ -0,0 +1,128 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+TABLA = "trafico_mediciontrafico"
+
+
+def _sumar_meses(d, meses):
+    total = d.year * 12 + (d.month - 1) + meses
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _nombre_particion(mes):
+    return f"{TABLA}_p{mes:%Y_%m}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Particionado mensual (opcional) de MedicionTrafico en PostgreSQL. "
+        "Con --convertir transforma la tabla actual en una tabla particionada por "
+        "RANGE(fecha_hora); sin él solo crea las particiones de los próximos meses."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--convertir", action="store_true",
+            help="Convierte la tabla existente a particionada (operación única, bloquea la tabla)",
+        )
+        parser.add_argument(
+            "--meses-futuros", type=int, default=3,
+            help="Cantidad de particiones a crear por adelantado (default: 3)",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("El particionado solo está disponible en PostgreSQL")
+
+        particionada = self._es_particionada()
+
+        if options["convertir"]:
+            if particionada:
+                self.stdout.write(self.style.WARNING("La tabla ya está particionada"))
+            else:
+                self._convertir(options["meses_futuros"])
+                self.stdout.write(self.style.SUCCESS("Tabla convertida a particiones mensuales ✅"))
+            return
+
+        if not particionada:
+            raise CommandError(
+                "La tabla no está particionada. Ejecuta primero con --convertir"
+            )
+
+        mes_actual = timezone.now().date().replace(day=1)
+        creadas = self._crear_particiones(mes_actual, _sumar_meses(mes_actual, options["meses_futuros"]))
+        self.stdout.write(self.style.SUCCESS(f"{creadas} particiones nuevas ✅"))
+
+    # ------------------------------
+    # Helpers SQL
+    # ------------------------------
+    def _es_particionada(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [TABLA])
+            fila = cursor.fetchone()
+        return bool(fila) and fila[0] == "p"
+
+    def _crear_particiones(self, desde, hasta):
+        """Crea (si no existen) las particiones mensuales en [desde, hasta]."""
+        creadas = 0
+        mes = desde
+        with connection.cursor() as cursor:
+            while mes <= hasta:
+                siguiente = _sumar_meses(mes, 1)
+                nombre = _nombre_particion(mes)
+                cursor.execute("SELECT to_regclass(%s)", [nombre])
+                if cursor.fetchone()[0] is None:
+                    cursor.execute(
+                        f'CREATE TABLE "{nombre}" PARTITION OF {TABLA} '
+                        "FOR VALUES FROM (%s) TO (%s)",
+                        [mes.isoformat(), siguiente.isoformat()],
+                    )
+                    creadas += 1
+                mes = siguiente
+        return creadas
+
+    @transaction.atomic
+    def _convertir(self, meses_futuros):
+        with connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {TABLA} IN ACCESS EXCLUSIVE MODE")
+            cursor.execute(f"SELECT min(fecha_hora), max(fecha_hora) FROM {TABLA}")
+            minimo, maximo = cursor.fetchone()
+
+            cursor.execute(f"ALTER TABLE {TABLA} RENAME TO {TABLA}_old")
+
+            # La PK debe incluir la columna de partición; la identidad de "id"
+            # se copia y luego se sincroniza con el máximo existente.
+            cursor.execute(
+                f"CREATE TABLE {TABLA} (LIKE {TABLA}_old INCLUDING DEFAULTS INCLUDING IDENTITY) "
+                "PARTITION BY RANGE (fecha_hora)"
+            )
+            cursor.execute(f"ALTER TABLE {TABLA} ADD PRIMARY KEY (id, fecha_hora)")
+            # Red de seguridad para filas fuera del rango de particiones creado
+            cursor.execute(f"CREATE TABLE {TABLA}_default PARTITION OF {TABLA} DEFAULT")
+
+        hoy = timezone.now().date().replace(day=1)
+        desde = (minimo.date() if minimo else hoy).replace(day=1)
+        hasta = max(maximo.date().replace(day=1) if maximo else hoy, _sumar_meses(hoy, meses_futuros))
+        self._crear_particiones(desde, hasta)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {TABLA} SELECT * FROM {TABLA}_old")
+            cursor.execute(f"DROP TABLE {TABLA}_old")
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{TABLA}', 'id'), "
+                f"COALESCE((SELECT max(id) FROM {TABLA}), 1))"
+            )
+
+            # Índices y FK sobre la tabla padre (se propagan a cada partición)
+            cursor.execute(
+                f"CREATE INDEX medicion_seg_fecha_idx ON {TABLA} (segmento_id, fecha_hora DESC)"
+            )
+            cursor.execute(f"CREATE INDEX medicion_fecha_brin ON {TABLA} USING brin (fecha_hora)")
+            cursor.execute(
+                f"ALTER TABLE {TABLA} ADD CONSTRAINT {TABLA}_segmento_id_fk "
+                "FOREIGN KEY (segmento_id) REFERENCES trafico_segmento (segmento_id) "
+                "DEFERRABLE INITIALLY DEFERRED"
+            )
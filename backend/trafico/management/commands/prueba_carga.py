@@ -0,0 +1,220 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import numpy as np
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from requests.adapters import HTTPAdapter
+
+# Endpoints del tablero: (nombre, método, ruta)
+MAPA = ("segmentos", "GET", "/api/segmentos/")
+PARADAS = ("paradas", "GET", "/trafico/paradas/")
+PREDICCION = ("prediccion", "POST", "/api/predict-traffic/")
+RECOMENDACION = ("recomendacion", "POST", "/api/recommend-route/")
+
+
+def _rango(valor):
+    """'1-10' o '1,3,5' -> [1, ..., 10] / [1, 3, 5]."""
+    if "-" in valor:
+        inicio, fin = valor.split("-", 1)
+        return list(range(int(inicio), int(fin) + 1))
+    return [int(v) for v in valor.split(",") if v]
+
+
+def _credenciales(ruta):
+    """Archivo con un 'usuario:password' por línea -> [(usuario, password), ...]."""
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            lineas = [linea.strip() for linea in f]
+    except OSError as e:
+        raise CommandError(str(e))
+    cuentas = [tuple(linea.split(":", 1)) for linea in lineas if linea and not linea.startswith("#")]
+    if not cuentas or any(len(c) != 2 for c in cuentas):
+        raise CommandError(f"{ruta}: se espera un 'usuario:password' por línea")
+    return cuentas
+
+
+class Estadisticas:
+    """
+    Latencias y estados por endpoint. Los 429 (límite por usuario) se
+    cuentan aparte: no son errores del servidor sino del reparto de cuentas.
+    """
+
+    def __init__(self):
+        self.latencias = {}
+        self.estados = {}
+        self.errores = {}
+        self.limitadas = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, nombre, segundos, estado):
+        with self._lock:
+            self.latencias.setdefault(nombre, []).append(segundos)
+            self.estados.setdefault(nombre, {}).setdefault(estado, 0)
+            self.estados[nombre][estado] += 1
+            if estado == 429:
+                self.limitadas[nombre] = self.limitadas.get(nombre, 0) + 1
+            elif not isinstance(estado, int) or estado >= 400:
+                self.errores[nombre] = self.errores.get(nombre, 0) + 1
+
+    def resumen(self, duracion):
+        filas = {}
+        for nombre, latencias in sorted(self.latencias.items()):
+            ms = np.array(latencias) * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            filas[nombre] = {
+                "peticiones": len(ms),
+                "por_segundo": round(len(ms) / duracion, 2),
+                "errores_pct": round(100 * self.errores.get(nombre, 0) / len(ms), 2),
+                "limitadas_pct": round(100 * self.limitadas.get(nombre, 0) / len(ms), 2),
+                "p50_ms": round(p50, 1),
+                "p95_ms": round(p95, 1),
+                "p99_ms": round(p99, 1),
+                "max_ms": round(ms.max(), 1),
+                "estados": {str(k): v for k, v in self.estados[nombre].items()},
+            }
+        return filas
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga HTTP contra un servidor local con el tráfico del tablero: "
+        "cada usuario virtual carga el mapa y las paradas y, cada --intervalo segundos, "
+        "lanza a la vez las predicciones de los segmentos y la recomendación de ruta. "
+        "Los límites de predicción y recomendación son por usuario: usa --credenciales "
+        "con una cuenta por usuario virtual o sube LIMITE_PREDICCION/LIMITE_RECOMENDACION "
+        "en el servidor"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Servidor a probar")
+        parser.add_argument("--usuario", help="Usuario para /api/auth/login/ (compartido por todos)")
+        parser.add_argument("--password")
+        parser.add_argument("--credenciales", metavar="ARCHIVO",
+                            help="Un 'usuario:password' por línea; cada usuario virtual usa su propia cuenta")
+        parser.add_argument("--usuarios", type=int, default=10, help="Usuarios virtuales simultáneos")
+        parser.add_argument("--duracion", type=float, default=60.0, help="Segundos de prueba")
+        parser.add_argument("--intervalo", type=float, default=30.0,
+                            help="Segundos entre ciclos de sondeo de cada usuario (0 = sin pausa)")
+        parser.add_argument("--segmentos", default="1-10", help="Segmentos a predecir por ciclo (p. ej. 1-10 o 1,2,3)")
+        parser.add_argument("--fecha", default=date.today().isoformat(), help="Fecha de las predicciones")
+        parser.add_argument("--timeout", type=float, default=30.0)
+        parser.add_argument("--json", dest="salida_json", help="Guarda el resumen en este archivo")
+
+    def handle(self, *args, **options):
+        self.base = options["url"].rstrip("/")
+        self.timeout = options["timeout"]
+        self.segmentos = _rango(options["segmentos"])
+        self.fecha = options["fecha"]
+        self.stats = Estadisticas()
+
+        # Un pool de conexiones compartido, con espacio para las ráfagas de todos los usuarios
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=options["usuarios"] * (len(self.segmentos) + 1))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        if options["credenciales"]:
+            cuentas = _credenciales(options["credenciales"])
+        elif options["usuario"] and options["password"]:
+            cuentas = [(options["usuario"], options["password"])]
+        else:
+            raise CommandError("Indica --usuario y --password, o --credenciales")
+        if len(cuentas) < options["usuarios"]:
+            self.stdout.write(self.style.WARNING(
+                f"{len(cuentas)} cuenta(s) para {options['usuarios']} usuarios virtuales: comparten "
+                "los límites por usuario y parte de las peticiones responderá 429 "
+                "(columna '429 %'), salvo que el servidor suba LIMITE_PREDICCION/LIMITE_RECOMENDACION"
+            ))
+        # Una sesión JWT por cuenta, repartidas en orden entre los usuarios virtuales
+        tokens = [self._login(usuario, password) for usuario, password in cuentas[:options["usuarios"]]]
+
+        fin = time.monotonic() + options["duracion"]
+        inicio = time.monotonic()
+        self.stdout.write(
+            f"{options['usuarios']} usuarios durante {options['duracion']:g}s "
+            f"(ciclo cada {options['intervalo']:g}s, {len(self.segmentos)} predicciones por ciclo)..."
+        )
+        with ThreadPoolExecutor(max_workers=options["usuarios"]) as pool:
+            futuros = [
+                pool.submit(self._usuario, tokens[i % len(tokens)], fin, options["intervalo"])
+                for i in range(options["usuarios"])
+            ]
+            for futuro in futuros:
+                futuro.result()
+        duracion = time.monotonic() - inicio
+
+        resumen = self.stats.resumen(duracion)
+        self._imprimir(resumen, duracion)
+        if options["salida_json"]:
+            with open(options["salida_json"], "w", encoding="utf-8") as f:
+                json.dump({"duracion_s": round(duracion, 2), "endpoints": resumen}, f, indent=2)
+
+    def _login(self, usuario, password):
+        try:
+            response = self.session.post(
+                f"{self.base}/api/auth/login/",
+                json={"username": usuario, "password": password},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            raise CommandError(f"No se pudo conectar a {self.base}: {e}")
+        if response.status_code != 200:
+            raise CommandError(f"Login de {usuario} falló ({response.status_code}): {response.text[:200]}")
+        return response.json()["access"]
+
+    def _pedir(self, endpoint, token, cuerpo=None):
+        nombre, metodo, ruta = endpoint
+        inicio = time.perf_counter()
+        try:
+            response = self.session.request(
+                metodo, f"{self.base}{ruta}", json=cuerpo, timeout=self.timeout,
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            estado = response.status_code
+        except requests.RequestException as e:
+            estado = type(e).__name__
+        self.stats.registrar(nombre, time.perf_counter() - inicio, estado)
+
+    def _usuario(self, token, fin, intervalo):
+        # Carga inicial del tablero
+        self._pedir(MAPA, token)
+        self._pedir(PARADAS, token)
+
+        with ThreadPoolExecutor(max_workers=len(self.segmentos) + 1) as rafaga:
+            while time.monotonic() < fin:
+                ciclo = time.monotonic()
+                # El frontend lanza todas las predicciones a la vez
+                futuros = [
+                    rafaga.submit(self._pedir, PREDICCION, token, {"segmento_id": s, "fecha": self.fecha})
+                    for s in self.segmentos
+                ]
+                futuros.append(rafaga.submit(
+                    self._pedir, RECOMENDACION, token, {"fecha_hora": f"{self.fecha} 08:00:00"}
+                ))
+                for futuro in futuros:
+                    futuro.result()
+
+                espera = intervalo - (time.monotonic() - ciclo)
+                if espera > 0:
+                    time.sleep(min(espera, max(0.0, fin - time.monotonic())))
+
+    def _imprimir(self, resumen, duracion):
+        total = sum(f["peticiones"] for f in resumen.values())
+        self.stdout.write(f"\n{total} peticiones en {duracion:.1f}s ({total / duracion:.1f}/s)\n")
+        self.stdout.write(
+            f"{'endpoint':<15}{'n':>7}{'req/s':>9}{'err %':>8}{'429 %':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+        )
+        for nombre, f in resumen.items():
+            linea = (
+                f"{nombre:<15}{f['peticiones']:>7}{f['por_segundo']:>9.2f}{f['errores_pct']:>8.1f}{f['limitadas_pct']:>8.1f}"
+                f"{f['p50_ms']:>10.1f}{f['p95_ms']:>10.1f}{f['p99_ms']:>10.1f}{f['max_ms']:>10.1f}"
+            )
+            if f["errores_pct"]:
+                linea = self.style.ERROR(linea)
+            elif f["limitadas_pct"]:
+                linea = self.style.WARNING(linea)
+            self.stdout.write(linea)
@@ -0,0 +1,300 @@
+# trafico/map_matching.py
+"""
+Map-matching de pings GPS crudos a segmentos.
+
+Las geometrías de todos los segmentos se proyectan a UTM (metros) y se
+cargan en un STRtree en memoria. Cada lote de pings se proyecta y se
+empareja con el segmento más cercano en una sola llamada vectorizada;
+la velocidad se deriva de pings consecutivos del mismo vehículo y se
+agrega por (segmento, cubeta de tiempo) en filas de MedicionTrafico.
+Una cubeta que ya tenía medición se combina con ella (ver guardar()).
+"""
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import transaction
+
+from . import presupuestos
+from .agregados import MARCA_MEDICIONES, actualizar_resumenes, descontar
+from .estadisticas import invalidar_estadisticas
+from .models import MarcaAgregado, MedicionTrafico, Segmento
+from .perezoso import importar
+from .versiones_cache import incrementar_version, obtener_version
+
+np = importar("numpy")
+pd = importar("pandas")
+shapely = importar("shapely")
+pyproj = importar("pyproj")
+
+# UTM zona 16N: cubre El Salvador con distorsión despreciable
+EPSG_METRICO = 32616
+DISTANCIA_MAXIMA = 30.0  # metros de un ping a su segmento
+INTERVALO_MAXIMO = 120.0  # segundos entre pings para derivar velocidad
+VELOCIDAD_MAXIMA = 150.0  # km/h; por encima se considera ruido del GPS
+CUBETA_MINUTOS = 15
+
+# Límites inferiores de velocidad (km/h) de los niveles 4, 3, 2 y 1,
+# según la distribución de dataset1.csv
+UMBRALES_CONGESTION = (10.0, 20.0, 28.0, 35.0)
+
+COLUMNAS = ("vehiculo_id", "fecha_hora", "lat", "lon")
+
+_CLAVE_VERSION = "map_matching:version"
+
+_transformador = None
+_indice = None
+_indice_version = None
+
+
+def proyectar(lon, lat):
+    """lon/lat (WGS84) -> x/y en metros, vectorizado."""
+    global _transformador
+    if _transformador is None:
+        _transformador = pyproj.Transformer.from_crs(4326, EPSG_METRICO, always_xy=True)
+    x, y = _transformador.transform(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+    return np.asarray(x), np.asarray(y)
+
+
+def nivel_por_velocidad(velocidad):
+    """Velocidad promedio (km/h) -> nivel de congestión 1 (fluido) a 5."""
+    return 5 - np.digitize(velocidad, UMBRALES_CONGESTION)
+
+
+class IndiceSegmentos:
+    """STRtree de las geometrías de los segmentos en coordenadas proyectadas."""
+
+    def __init__(self, segmentos):
+        ids = []
+        lineas = []
+        for segmento_id, coords in segmentos:
+            coords = np.asarray(coords, dtype=float)
+            x, y = proyectar(coords[:, 0], coords[:, 1])
+            ids.append(segmento_id)
+            lineas.append(shapely.linestrings(x, y))
+
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.arbol = shapely.STRtree(lineas)
+
+    @classmethod
+    def desde_bd(cls):
+        return cls(
+            (s.segmento_id, s.geometria.coords)
+            for s in Segmento.objects.only("segmento_id", "geometria")
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def emparejar(self, x, y, distancia_max=DISTANCIA_MAXIMA):
+        """
+        Segmento más cercano a cada punto proyectado (x, y), o -1 si no hay
+        ninguno a menos de `distancia_max` metros.
+        """
+        resultado = np.full(len(x), -1, dtype=np.int64)
+        if not len(self.ids) or not len(x):
+            return resultado
+
+        idx_puntos, idx_segmentos = self.arbol.query_nearest(
+            shapely.points(x, y), max_distance=distancia_max, all_matches=False
+        )
+        resultado[idx_puntos] = self.ids[idx_segmentos]
+        return resultado
+
+
+def obtener_indice():
+    """Índice de segmentos del proceso; se reconstruye si cambiaron los segmentos."""
+    global _indice, _indice_version
+    version = obtener_version(_CLAVE_VERSION)
+    if _indice is None or _indice_version != version:
+        _indice = IndiceSegmentos.desde_bd()
+        _indice_version = version
+    return _indice
+
+
+def invalidar():
+    """Se llama desde las señales de Segmento."""
+    incrementar_version(_CLAVE_VERSION)
+
+
+def velocidades(vehiculo, t, x, y):
+    """
+    Velocidad (km/h) de cada ping respecto al anterior del mismo vehículo.
+    Los arreglos deben venir ordenados por (vehiculo, t). NaN si no hay
+    ping previo, el intervalo es inválido o la velocidad es ruido.
+    """
+    resultado = np.full(len(t), np.nan)
+    if len(t) < 2:
+        return resultado
+
+    dt = np.diff(t)
+    validos = (vehiculo[1:] == vehiculo[:-1]) & (dt > 0) & (dt <= INTERVALO_MAXIMO)
+    distancia = np.hypot(np.diff(x), np.diff(y))
+
+    kmh = np.full(len(dt), np.nan)
+    kmh[validos] = distancia[validos] / dt[validos] * 3.6
+    kmh[kmh > VELOCIDAD_MAXIMA] = np.nan
+    resultado[1:] = kmh
+    return resultado
+
+
+def _a_segundos(serie):
+    """fecha_hora (ISO 8601 o epoch en segundos) -> segundos desde epoch (UTC)."""
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.to_numpy(dtype="float64")
+    fechas = pd.to_datetime(serie, utc=True, format="ISO8601")
+    return fechas.dt.tz_convert(None).to_numpy(dtype="datetime64[ms]").astype("int64") / 1000.0
+
+
+class Emparejador:
+    """
+    Procesa pings por lotes (p. ej. bloques de un CSV) y acumula las
+    sumas por (segmento, cubeta). El último ping de cada vehículo se
+    arrastra al lote siguiente para no perder la velocidad en el corte.
+    Se asume que los pings de cada vehículo llegan en orden temporal.
+    """
+
+    def __init__(self, indice=None, cubeta_minutos=CUBETA_MINUTOS, distancia_max=DISTANCIA_MAXIMA):
+        self.indice = indice if indice is not None else obtener_indice()
+        self.cubeta = cubeta_minutos * 60
+        self.distancia_max = distancia_max
+        self.pings = 0
+        self.emparejados = 0
+        self._ultimos = None
+        self._agregado = None
+
+    def procesar(self, pings):
+        """
+        pings: DataFrame con vehiculo_id, fecha_hora, lat, lon y, opcional,
+        velocidad (km/h) reportada por el dispositivo.
+        """
+        faltantes = [c for c in COLUMNAS if c not in pings]
+        if faltantes:
+            raise ValueError(f"Faltan columnas: {', '.join(faltantes)}")
+        if pings.empty:
+            return
+
+        x, y = proyectar(pings["lon"].to_numpy(), pings["lat"].to_numpy())
+        lote = pd.DataFrame({
+            "vehiculo_id": pings["vehiculo_id"].astype(str).to_numpy(),
+            "t": _a_segundos(pings["fecha_hora"]),
+            "x": x,
+            "y": y,
+            "velocidad": (
+                pd.to_numeric(pings["velocidad"], errors="coerce").to_numpy(dtype=float)
+                if "velocidad" in pings else np.nan
+            ),
+            "nuevo": True,
+        })
+        if self._ultimos is not None:
+            lote = pd.concat([self._ultimos, lote], ignore_index=True)
+        lote = lote.sort_values(["vehiculo_id", "t"], kind="stable", ignore_index=True)
+
+        vehiculo = pd.factorize(lote["vehiculo_id"])[0]
+        t = lote["t"].to_numpy()
+        x = lote["x"].to_numpy()
+        y = lote["y"].to_numpy()
+
+        reportada = lote["velocidad"].to_numpy(dtype=float)
+        velocidad = np.where(np.isnan(reportada), velocidades(vehiculo, t, x, y), reportada)
+
+        self._ultimos = lote.drop_duplicates("vehiculo_id", keep="last").assign(
+            nuevo=False, velocidad=np.nan
+        )
+
+        nuevos = lote["nuevo"].to_numpy(dtype=bool)
+        segmento = self.indice.emparejar(x[nuevos], y[nuevos], self.distancia_max)
+        velocidad = velocidad[nuevos]
+        t = t[nuevos]
+
+        validos = (segmento >= 0) & ~np.isnan(velocidad) & (velocidad >= 0) & (velocidad <= VELOCIDAD_MAXIMA)
+        self.pings += int(nuevos.sum())
+        self.emparejados += int(validos.sum())
+        if not validos.any():
+            return
+
+        parcial = pd.DataFrame({
+            "segmento_id": segmento[validos],
+            "cubeta": (t[validos] // self.cubeta * self.cubeta).astype("int64"),
+            "suma": velocidad[validos],
+            "muestras": 1,
+        })
+        if self._agregado is not None:
+            parcial = pd.concat([self._agregado, parcial], ignore_index=True)
+        self._agregado = parcial.groupby(["segmento_id", "cubeta"], as_index=False, sort=False).sum()
+
+    def resultados(self):
+        """Filas por (segmento, cubeta) listas para MedicionTrafico."""
+        if self._agregado is None:
+            return []
+
+        agregado = self._agregado.sort_values(["cubeta", "segmento_id"])
+        promedio = agregado["suma"].to_numpy() / agregado["muestras"].to_numpy()
+        niveles = nivel_por_velocidad(promedio)
+
+        return [
+            {
+                "segmento_id": int(seg),
+                "fecha_hora": datetime.fromtimestamp(int(cubeta), tz=dt_timezone.utc),
+                "velocidad_promedio": round(float(vel), 2),
+                "nivel_congestion": int(nivel),
+                "muestras": int(muestras),
+            }
+            for seg, cubeta, muestras, vel, nivel in zip(
+                agregado["segmento_id"], agregado["cubeta"], agregado["muestras"], promedio, niveles
+            )
+        ]
+
+
+def guardar(filas):
+    """
+    Guarda las mediciones agregadas y actualiza resúmenes y estadísticas
+    (bulk_create no dispara señales). Si el segmento ya tiene una medición
+    en esa cubeta (lote reenviado, cubeta repartida en dos envíos), se
+    reemplaza por el promedio de ambas ponderado por sus muestras.
+    Retorna la cantidad de mediciones guardadas.
+    """
+    if not filas:
+        return 0
+
+    claves = {(f["segmento_id"], f["fecha_hora"]) for f in filas}
+    with transaction.atomic():
+        # La marca de agua no avanza mientras se reemplazan filas ya resumidas
+        marca, _ = MarcaAgregado.objects.select_for_update().get_or_create(nombre=MARCA_MEDICIONES)
+        previas = MedicionTrafico.objects.select_for_update().filter(
+            segmento_id__in={s for s, _ in claves},
+            fecha_hora__in={t for _, t in claves},
+        ).only("id", "segmento_id", "fecha_hora", "velocidad_promedio", "muestras")
+
+        acumulado = {}
+        reemplazadas = []
+        for m in previas:
+            clave = (m.segmento_id, m.fecha_hora)
+            if clave not in claves:
+                continue
+            suma, muestras = acumulado.get(clave, (0.0, 0))
+            acumulado[clave] = (suma + float(m.velocidad_promedio) * m.muestras, muestras + m.muestras)
+            reemplazadas.append(m.id)
+
+        if reemplazadas:
+            # Un UPDATE por resumen horario y diario afectado (ver ingesta_gps)
+            presupuestos.items(len(reemplazadas))
+            descontar(MedicionTrafico.objects.filter(id__in=reemplazadas, id__lte=marca.ultimo_id))
+            MedicionTrafico.objects.filter(id__in=reemplazadas).delete()
+
+        nuevas = []
+        for f in filas:
+            suma, muestras = acumulado.get((f["segmento_id"], f["fecha_hora"]), (0.0, 0))
+            muestras += f["muestras"]
+            velocidad = (suma + f["velocidad_promedio"] * f["muestras"]) / muestras
+            nuevas.append(MedicionTrafico(
+                segmento_id=f["segmento_id"],
+                fecha_hora=f["fecha_hora"],
+                velocidad_promedio=Decimal(f"{velocidad:.2f}"),
+                nivel_congestion=int(nivel_por_velocidad(velocidad)),
+                muestras=muestras,
+            ))
+        MedicionTrafico.objects.bulk_create(nuevas, batch_size=5000)
+
+    _, segmentos = actualizar_resumenes()
+    invalidar_estadisticas(segmentos)
+    return len(filas)
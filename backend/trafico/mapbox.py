@@ -0,0 +1,393 @@
+# trafico/mapbox.py
+"""
+Cliente de la Mapbox Matrix API.
+
+- Session compartida (keep-alive + pool) con timeouts y reintentos con backoff.
+- Caché TTL en la caché de Django, por coordenadas redondeadas y cubeta de
+  tiempo (el perfil driving-traffic cambia con el tráfico del momento).
+- Las peticiones idénticas simultáneas dentro del proceso se unen en una.
+- Circuit breaker: tras varios fallos seguidos deja de llamar a Mapbox
+  por un rato y sirve la última respuesta conocida (stale) si la hay.
+- Un 429 (límite de peticiones de la cuenta) no se reintenta ni cuenta
+  como fallo del interruptor: se sirve la copia stale o se responde 429
+  con un Retry-After acotado.
+- Matrices más grandes que el límite de coordenadas por petición se parten
+  en bloques origen×destino que se piden en paralelo (y se cachean por
+  separado) y se unen en una sola matriz. Los bloques por matriz se acotan
+  a MAX_BLOQUES, lo que fija las coordenadas máximas de cada perfil.
+"""
+import contextvars
+import hashlib
+import json
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metricas
+from .perezoso import importar
+
+requests = importar("requests")
+urllib3 = importar("urllib3")
+
+PERFIL = "mapbox/driving-traffic"
+# Coordenadas máximas por petición según el perfil
+LIMITE_COORDENADAS = {
+    "mapbox/driving-traffic": 10,
+    "mapbox/driving": 25,
+    "mapbox/walking": 25,
+    "mapbox/cycling": 25,
+}
+MAX_COORDENADAS = 100
+# Peticiones a Mapbox por matriz: la Matrix API admite 60 por minuto por cuenta
+MAX_BLOQUES = 25
+# Tope del Retry-After que se espera o se reenvía al cliente tras un 429
+ESPERA_429_MAX = 60
+HILOS = 8
+ANOTACIONES = "duration,distance"
+TIMEOUT = (3.05, 10)  # (conexión, lectura) en segundos
+PRECISION = 5  # decimales de lon/lat en la clave (~1 m)
+CUBETA_SEGUNDOS = 5 * 60
+CACHE_TIMEOUT = 15 * 60
+# La copia "stale" vive más que la cubeta para cubrir caídas de Mapbox
+STALE_TIMEOUT = 24 * 60 * 60
+
+# Estados informados en la cabecera X-Cache
+HIT, MISS, STALE = "HIT", "MISS", "STALE"
+
+
+class MapboxError(Exception):
+    """Mapbox rechazó la petición (4xx): se propaga al cliente con su estado."""
+
+    def __init__(self, status, data):
+        super().__init__(data.get("message") if isinstance(data, dict) else str(data))
+        self.status = status
+        self.data = data
+
+
+class MapboxNoDisponible(Exception):
+    """Mapbox no responde y no hay copia previa que servir."""
+
+
+class MapboxLimitado(Exception):
+    """Mapbox respondió 429 y no hay copia previa que servir."""
+
+    def __init__(self, espera):
+        super().__init__(f"Límite de peticiones de Mapbox; reintentar en {espera} s")
+        self.espera = espera
+
+
+# ------------------------------
+# Transporte
+# ------------------------------
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            # Solo errores del servidor, con backoff propio (sin esperar un
+            # Retry-After arbitrario). Los 429 no se reintentan: ver _pedir().
+            retry = urllib3.util.retry.Retry(
+                total=2,
+                backoff_factor=0.3,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset({"GET"}),
+                raise_on_status=False,
+                respect_retry_after_header=False,
+            )
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+            _session = requests.Session()
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+    return _session
+
+
+def url_base():
+    # Configurable para apuntar a un servidor local de pruebas
+    return getattr(settings, "MAPBOX_API_URL", "https://api.mapbox.com").rstrip("/")
+
+
+# ------------------------------
+# Circuit breaker
+# ------------------------------
+class Interruptor:
+    """
+    Cerrado: deja pasar. Tras `fallos_max` fallos seguidos se abre durante
+    `espera` segundos; después deja pasar una petición de prueba (semiabierto).
+    """
+
+    def __init__(self, fallos_max=5, espera=30.0):
+        self.fallos_max = fallos_max
+        self.espera = espera
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        with self._lock:
+            ahora = time.monotonic()
+            if ahora < self.abierto_hasta:
+                return False
+            if self.fallos >= self.fallos_max:
+                # Semiabierto: una sola prueba; si falla vuelve a abrirse
+                self.abierto_hasta = ahora + self.espera
+            return True
+
+    def exito(self):
+        with self._lock:
+            self.fallos = 0
+            self.abierto_hasta = 0.0
+
+    def fallo(self):
+        with self._lock:
+            self.fallos += 1
+            if self.fallos >= self.fallos_max:
+                self.abierto_hasta = time.monotonic() + self.espera
+
+    @property
+    def abierto(self):
+        return time.monotonic() < self.abierto_hasta
+
+
+interruptor = Interruptor()
+
+
+# ------------------------------
+# Unión de peticiones simultáneas
+# ------------------------------
+_en_vuelo = {}
+_en_vuelo_lock = threading.Lock()
+
+
+def _una_vez(clave, funcion):
+    """Ejecuta `funcion` una sola vez por clave aunque la pidan varios hilos a la vez."""
+    with _en_vuelo_lock:
+        futuro = _en_vuelo.get(clave)
+        propio = futuro is None
+        if propio:
+            futuro = _en_vuelo[clave] = Future()
+
+    if not propio:
+        return futuro.result()
+
+    try:
+        resultado = funcion()
+    except BaseException as e:
+        futuro.set_exception(e)
+        raise
+    else:
+        futuro.set_result(resultado)
+        return resultado
+    finally:
+        with _en_vuelo_lock:
+            _en_vuelo.pop(clave, None)
+
+
+# ------------------------------
+# Matrix API
+# ------------------------------
+def _huella(perfil, coordenadas, sources, destinations):
+    datos = json.dumps(
+        [perfil, [(round(lng, PRECISION), round(lat, PRECISION)) for lng, lat in coordenadas], sources, destinations],
+        separators=(",", ":"),
+    )
+    return hashlib.sha1(datos.encode()).hexdigest()
+
+
+def _espera_429(response):
+    """Segundos hasta poder reintentar según Retry-After o X-Rate-Limit-Reset, acotados."""
+    try:
+        espera = float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        try:
+            espera = float(response.headers["X-Rate-Limit-Reset"]) - time.time()
+        except (KeyError, ValueError):
+            espera = ESPERA_429_MAX
+    return int(min(max(espera, 1), ESPERA_429_MAX))
+
+
+def _pedir(perfil, coordenadas, sources, destinations):
+    coords = ";".join(f"{lng:.{PRECISION}f},{lat:.{PRECISION}f}" for lng, lat in coordenadas)
+    params = {"annotations": ANOTACIONES, "access_token": settings.MAPBOX_ACCESS_TOKEN}
+    if sources is not None:
+        params["sources"] = ";".join(map(str, sources))
+    if destinations is not None:
+        params["destinations"] = ";".join(map(str, destinations))
+
+    # Los ';' de sources/destinations van literales, como en la documentación de Mapbox
+    response = get_session().get(
+        f"{url_base()}/directions-matrix/v1/{perfil}/{coords}?{urlencode(params, safe=';,')}",
+        timeout=TIMEOUT,
+    )
+    if response.status_code == 429:
+        raise MapboxLimitado(_espera_429(response))
+    if response.status_code >= 500:
+        raise requests.HTTPError(f"Mapbox respondió {response.status_code}", response=response)
+
+    try:
+        data = response.json()
+    except ValueError:
+        raise requests.HTTPError("Respuesta no JSON de Mapbox", response=response)
+
+    if response.status_code >= 400 or data.get("code") != "Ok":
+        raise MapboxError(response.status_code if response.status_code >= 400 else 422, data)
+    return data
+
+
+def matriz(coordenadas, sources=None, destinations=None, perfil=PERFIL):
+    """
+    Matriz de duraciones/distancias para [(lng, lat), ...].
+    Retorna (data, estado) con estado HIT, MISS o STALE.
+    """
+    huella = _huella(perfil, coordenadas, sources, destinations)
+    cubeta = int(time.time() // CUBETA_SEGUNDOS)
+    clave = f"mapbox:matrix:{huella}:{cubeta}"
+    clave_stale = f"mapbox:matrix:stale:{huella}"
+
+    data = cache.get(clave)
+    if data is not None:
+        metricas.cache("mapbox", HIT)
+        return data, HIT
+
+    def consultar():
+        # Otro hilo pudo completarla mientras esperábamos
+        data = cache.get(clave)
+        if data is not None:
+            return data, HIT
+
+        if not interruptor.permitir():
+            raise MapboxNoDisponible("Circuito abierto: Mapbox falló repetidamente")
+
+        try:
+            with metricas.etapa("mapbox_api"):
+                data = _pedir(perfil, coordenadas, sources, destinations)
+        except MapboxError:
+            interruptor.exito()  # Mapbox respondió: el fallo es de la petición
+            raise
+        except MapboxLimitado:
+            raise  # Mapbox está sano: no abre el circuito
+        except requests.RequestException as e:
+            interruptor.fallo()
+            raise MapboxNoDisponible(str(e))
+
+        interruptor.exito()
+        cache.set(clave, data, CACHE_TIMEOUT)
+        cache.set(clave_stale, data, STALE_TIMEOUT)
+        return data, MISS
+
+    try:
+        data, estado = _una_vez(clave, consultar)
+    except (MapboxNoDisponible, MapboxLimitado):
+        data = cache.get(clave_stale)
+        if data is None:
+            raise
+        data, estado = data, STALE
+
+    metricas.cache("mapbox", estado)
+    return data, estado
+
+
+# ------------------------------
+# Matrices grandes (por bloques)
+# ------------------------------
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Acota las peticiones simultáneas a Mapbox de todo el proceso
+            _pool = ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix="mapbox")
+    return _pool
+
+
+def bloques(n, limite):
+    """
+    Parte una matriz n×n en bloques (orígenes, destinos) de índices cuya
+    unión cabe en `limite` coordenadas: trozos de limite // 2 combinados
+    de a pares (los de la diagonal comparten coordenadas).
+    """
+    tamano = max(1, limite // 2)
+    trozos = [list(range(i, min(i + tamano, n))) for i in range(0, n, tamano)]
+    return [(a, b) for a in trozos for b in trozos]
+
+
+def max_coordenadas(perfil):
+    """Coordenadas máximas por matriz con el perfil sin pasar de MAX_BLOQUES peticiones."""
+    tamano = max(1, LIMITE_COORDENADAS[perfil] // 2)
+    return min(MAX_COORDENADAS, max(LIMITE_COORDENADAS[perfil], tamano * math.isqrt(MAX_BLOQUES)))
+
+
+def _pedir_bloque(coordenadas, origenes, destinos, perfil):
+    if origenes == destinos:
+        puntos = [coordenadas[i] for i in origenes]
+        return matriz(puntos, None, None, perfil)
+
+    puntos = [coordenadas[i] for i in origenes + destinos]
+    sources = list(range(len(origenes)))
+    destinations = list(range(len(origenes), len(puntos)))
+    return matriz(puntos, sources, destinations, perfil)
+
+
+def matriz_completa(coordenadas, perfil=PERFIL):
+    """
+    Matriz n×n para cualquier cantidad de coordenadas (hasta
+    max_coordenadas(perfil)). Retorna (data, estado); el estado es STALE si
+    algún bloque lo fue, MISS si alguno se pidió a Mapbox y HIT si todos
+    venían de la caché.
+    """
+    if perfil not in LIMITE_COORDENADAS:
+        raise ValueError(f"Perfil desconocido: {perfil}")
+    if len(coordenadas) > max_coordenadas(perfil):
+        raise ValueError(f"Máximo {max_coordenadas(perfil)} coordenadas por matriz con {perfil}")
+
+    limite = LIMITE_COORDENADAS[perfil]
+    if len(coordenadas) <= limite:
+        return matriz(coordenadas, perfil=perfil)
+
+    n = len(coordenadas)
+    partes = bloques(n, limite)
+    # Cada bloque corre en el contexto de la petición: sus etapas (mapbox_api) llegan a Server-Timing
+    futuros = [
+        _get_pool().submit(contextvars.copy_context().run, _pedir_bloque, coordenadas, origenes, destinos, perfil)
+        for origenes, destinos in partes
+    ]
+
+    durations = [[None] * n for _ in range(n)]
+    distances = [[None] * n for _ in range(n)]
+    sources = [None] * n
+    destinations = [None] * n
+    estados = set()
+
+    for (origenes, destinos), futuro in zip(partes, futuros):
+        data, estado = futuro.result()
+        estados.add(estado)
+
+        for fila, i in enumerate(origenes):
+            for col, j in enumerate(destinos):
+                durations[i][j] = data["durations"][fila][col]
+                distances[i][j] = data["distances"][fila][col]
+
+        for fila, i in enumerate(origenes):
+            sources[i] = sources[i] or data.get("sources", [None] * len(origenes))[fila]
+        for col, j in enumerate(destinos):
+            destinations[j] = destinations[j] or data.get("destinations", [None] * len(destinos))[col]
+
+    estado = STALE if STALE in estados else MISS if MISS in estados else HIT
+    return {
+        "code": "Ok",
+        "durations": durations,
+        "distances": distances,
+        "sources": sources,
+        "destinations": destinations,
+        "bloques": len(partes),
+    }, estado
@@ -0,0 +1,271 @@
+# trafico/matriz_local.py
+"""
+Motor de matriz de tiempos/distancias propio (sin Mapbox).
+
+Los segmentos forman un grafo: sus extremos a menos de SNAP_METROS se
+unen en un mismo nodo y cada segmento es una arista cuyo peso es el
+tiempo de recorrido con la velocidad predicha para la hora
+(PrediccionPorSegmento). Cada coordenada se proyecta sobre el segmento
+más cercano y se inserta en él como nodo intermedio, en aristas que se
+superponen al grafo compartido sin copiarlo; luego un Dijkstra por
+origen resuelve sus destinos y se detiene al alcanzarlos todos.
+
+El grafo es no dirigido: Segmento no guarda sentido de circulación, así
+que todos los segmentos se recorren en ambos sentidos (también los de
+una sola vía) y la matriz es simétrica; por eso cada origen solo busca
+los destinos siguientes.
+
+El grafo se guarda en memoria por hora y las matrices en la caché de
+Django; ambos dependen de las versiones de geometría y de predicciones
+de la hora que ya usan los vector tiles.
+"""
+import hashlib
+import heapq
+import itertools
+import json
+import threading
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from traffic_predictor.models import PrediccionPorSegmento
+from . import metricas, tiles
+from .map_matching import proyectar
+from .models import Segmento
+from .perezoso import importar
+
+nx = importar("networkx")
+np = importar("numpy")
+shapely = importar("shapely")
+
+SNAP_METROS = 20.0
+VELOCIDAD_POR_DEFECTO = 30.0  # km/h, la misma que usa la recomendación
+PRECISION = 5
+CACHE_TIMEOUT = 60 * 60
+GRAFOS_EN_MEMORIA = 4
+
+_grafos = OrderedDict()
+_grafos_lock = threading.Lock()
+
+
+def _agrupar_extremos(xy, tolerancia):
+    """Etiqueta de nodo para cada punto: los que están a < tolerancia comparten nodo (union-find)."""
+    puntos = shapely.points(xy)
+    izquierda, derecha = shapely.STRtree(puntos).query(puntos, predicate="dwithin", distance=tolerancia)
+
+    padre = np.arange(len(xy))
+
+    def raiz(i):
+        while padre[i] != i:
+            padre[i] = padre[padre[i]]
+            i = padre[i]
+        return i
+
+    for i, j in zip(izquierda, derecha):
+        ri, rj = raiz(i), raiz(j)
+        if ri != rj:
+            padre[max(ri, rj)] = min(ri, rj)
+
+    return [int(raiz(i)) for i in range(len(xy))]
+
+
+class Red:
+    """Grafo de la red de segmentos con los tiempos de una hora."""
+
+    def __init__(self, segmentos, velocidades):
+        """
+        segmentos: [(segmento_id, coords lon/lat), ...]
+        velocidades: {segmento_id: km/h}
+        """
+        if not segmentos:
+            raise ValueError("No hay segmentos para construir la red")
+
+        self.ids = []
+        self.lineas = []
+        extremos = []
+        for segmento_id, coords in segmentos:
+            coords = np.asarray(coords, dtype=float)
+            x, y = proyectar(coords[:, 0], coords[:, 1])
+            self.ids.append(segmento_id)
+            self.lineas.append(shapely.linestrings(x, y))
+            extremos.extend([(x[0], y[0]), (x[-1], y[-1])])
+
+        nodos = _agrupar_extremos(np.asarray(extremos), SNAP_METROS)
+        self.extremos = [(nodos[2 * k], nodos[2 * k + 1]) for k in range(len(self.ids))]
+        self.arbol = shapely.STRtree(self.lineas)
+
+        self.largos = []
+        self.duraciones = []
+        self.grafo = nx.Graph()
+        for k, segmento_id in enumerate(self.ids):
+            largo = float(self.lineas[k].length)
+            velocidad = float(velocidades.get(segmento_id) or VELOCIDAD_POR_DEFECTO)
+            duracion = largo / (velocidad / 3.6)
+            self.largos.append(largo)
+            self.duraciones.append(duracion)
+
+            u, v = self.extremos[k]
+            actual = self.grafo.get_edge_data(u, v)
+            # Entre dos nodos nos quedamos con el segmento más rápido
+            if u != v and (actual is None or actual["duracion"] > duracion):
+                self.grafo.add_edge(u, v, duracion=duracion, largo=largo)
+
+    @classmethod
+    def para_hora(cls, hora):
+        velocidades = dict(
+            PrediccionPorSegmento.objects.filter(fecha_hora_prediccion=hora)
+            .values_list("segmento_id", "velocidad_estimada")
+        )
+        segmentos = [
+            (s.segmento_id, s.geometria.coords)
+            for s in Segmento.objects.only("segmento_id", "geometria")
+        ]
+        return cls(segmentos, velocidades)
+
+    def _superponer_puntos(self, coordenadas):
+        """
+        Cada coordenada como nodo ("p", i) sobre su segmento más cercano,
+        sin tocar el grafo compartido. Retorna (extra, waypoints), con extra
+        = {nodo: {vecino: (duracion, largo)}}: las aristas a sumar al grafo.
+        """
+        lons, lats = zip(*coordenadas)
+        x, y = proyectar(lons, lats)
+        puntos = shapely.points(x, y)
+        _, cercanos = self.arbol.query_nearest(puntos, all_matches=False)
+        lineas = [self.lineas[k] for k in cercanos]
+        posiciones = shapely.line_locate_point(lineas, puntos)
+        separacion = shapely.distance(lineas, puntos)
+
+        por_segmento = {}
+        waypoints = []
+        for i, k in enumerate(cercanos):
+            por_segmento.setdefault(int(k), []).append((float(posiciones[i]), i))
+            waypoints.append({
+                "location": [lons[i], lats[i]],
+                "distance": round(float(separacion[i]), 1),
+                "segmento_id": self.ids[k],
+            })
+
+        # Cada segmento con puntos queda como cadena u - p1 - p2 - ... - v
+        extra = {}
+        for k, puntos_seg in por_segmento.items():
+            u, v = self.extremos[k]
+            largo = self.largos[k] or 1.0
+            segundos_por_metro = self.duraciones[k] / largo
+            cadena = [(0.0, u)] + [(pos, ("p", i)) for pos, i in sorted(puntos_seg)] + [(largo, v)]
+            for (pos_a, a), (pos_b, b) in zip(cadena, cadena[1:]):
+                tramo = pos_b - pos_a
+                if a == b:
+                    continue
+                arista = (tramo * segundos_por_metro, tramo)
+                for origen, destino in ((a, b), (b, a)):
+                    actual = extra.setdefault(origen, {}).get(destino)
+                    if actual is None or actual[0] > arista[0]:
+                        extra[origen][destino] = arista
+
+        return extra, waypoints
+
+    def _vecinos(self, nodo, extra):
+        if nodo in self.grafo:
+            for vecino, datos in self.grafo.adj[nodo].items():
+                yield vecino, datos["duracion"], datos["largo"]
+        for vecino, (duracion, largo) in extra.get(nodo, {}).items():
+            yield vecino, duracion, largo
+
+    def _dijkstra(self, origen, destinos, extra):
+        """
+        Tiempos (s) y largos (m) del camino más rápido desde `origen` a cada
+        destino alcanzable; se detiene al fijar todos los destinos.
+        """
+        pendientes = set(destinos)
+        resultado = {}
+        fijados = set()
+        mejor = {origen: 0.0}
+        orden = itertools.count()  # desempate: los nodos no se comparan entre sí
+        cola = [(0.0, 0.0, next(orden), origen)]
+
+        while cola and pendientes:
+            tiempo, largo, _, nodo = heapq.heappop(cola)
+            if nodo in fijados:
+                continue
+            fijados.add(nodo)
+            if nodo in pendientes:
+                pendientes.discard(nodo)
+                resultado[nodo] = (tiempo, largo)
+            for vecino, duracion, tramo in self._vecinos(nodo, extra):
+                nuevo = tiempo + duracion
+                if vecino not in fijados and nuevo < mejor.get(vecino, float("inf")):
+                    mejor[vecino] = nuevo
+                    heapq.heappush(cola, (nuevo, largo + tramo, next(orden), vecino))
+
+        return resultado
+
+    def matriz(self, coordenadas):
+        """Matriz n×n con el mismo formato que la Matrix API de Mapbox."""
+        extra, waypoints = self._superponer_puntos(coordenadas)
+        n = len(coordenadas)
+        # Sin conexión: null, como Mapbox
+        durations = [[None] * n for _ in range(n)]
+        distances = [[None] * n for _ in range(n)]
+
+        for i in range(n):
+            durations[i][i] = distances[i][i] = 0.0
+            # Grafo no dirigido: el tramo j -> i es el mismo que i -> j
+            destinos = [("p", j) for j in range(i + 1, n)]
+            for (_, j), (tiempo, largo) in self._dijkstra(("p", i), destinos, extra).items():
+                durations[i][j] = durations[j][i] = round(tiempo, 1)
+                distances[i][j] = distances[j][i] = round(largo, 1)
+
+        return {
+            "code": "Ok",
+            "durations": durations,
+            "distances": distances,
+            "sources": waypoints,
+            "destinations": waypoints,
+        }
+
+
+def obtener_red(hora):
+    """Red de la hora desde memoria; se reconstruye si cambió la geometría o las predicciones."""
+    hora = tiles.truncar_hora(hora)
+    clave = (hora, tiles.version_geometrias(), tiles.version_hora(hora))
+    with _grafos_lock:
+        red = _grafos.get(clave)
+        if red is not None:
+            _grafos.move_to_end(clave)
+            return red
+
+    with metricas.etapa("matriz_local_red"):
+        red = Red.para_hora(hora)
+
+    with _grafos_lock:
+        _grafos[clave] = red
+        while len(_grafos) > GRAFOS_EN_MEMORIA:
+            _grafos.popitem(last=False)
+    return red
+
+
+def matriz(coordenadas, hora=None):
+    """
+    Matriz de duraciones (s) y distancias (m) para [(lng, lat), ...] con
+    las velocidades predichas de `hora` (por defecto la actual).
+    Retorna (data, estado) con estado HIT o MISS.
+    """
+    # En UTC antes de truncar, como los tiles: +05:30 no debe caer en otra hora
+    hora = tiles.truncar_hora(hora or tiles.hora_actual())
+    redondeadas = [(round(lng, PRECISION), round(lat, PRECISION)) for lng, lat in coordenadas]
+    huella = hashlib.sha1(json.dumps(redondeadas).encode()).hexdigest()
+    clave = (
+        f"matriz_local:{hora:%Y%m%d%H}:"
+        f"{tiles.version_geometrias()}.{tiles.version_hora(hora)}:{huella}"
+    )
+
+    data = cache.get(clave)
+    metricas.cache("matriz_local", data is not None)
+    if data is not None:
+        return data, "HIT"
+
+    data = obtener_red(hora).matriz(redondeadas)
+    data["fecha_hora"] = hora.isoformat()
+    cache.set(clave, data, CACHE_TIMEOUT)
+    return data, "MISS"
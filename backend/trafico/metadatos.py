@@ -0,0 +1,128 @@
+# trafico/metadatos.py
+"""
+Metadatos de cada segmento derivados de la geometría: longitud geodésica
+(km) y cantidad de paradas de bus cercanas (join espacial con ParadaBus).
+
+refrescar() los calcula y los guarda en Segmento.longitud_km /
+paradas_cercanas. obtener() los sirve desde una caché en memoria del
+proceso, que se recarga cuando las señales suben la versión.
+"""
+from django.db import connection, transaction
+
+from .models import ParadaBus, Segmento
+from .paradas import DISTANCIA_POR_DEFECTO
+from .perezoso import importar
+from .versiones_cache import incrementar_version, obtener_version
+
+_CLAVE_VERSION = "segmentos_metadatos:version"
+pyproj = importar("pyproj")
+_geod = None
+
+_metadatos = None
+_metadatos_version = None
+
+
+def longitud_geodesica_km(geometria):
+    """Longitud de un LineString WGS84 sobre el elipsoide, en km."""
+    global _geod
+    if _geod is None:
+        _geod = pyproj.Geod(ellps="WGS84")
+    lons, lats = zip(*geometria.coords)
+    return _geod.line_length(lons, lats) / 1000.0
+
+
+# ------------------------------
+# Cálculo y guardado
+# ------------------------------
+def _refrescar_postgres(metros):
+    tabla_seg = Segmento._meta.db_table
+    tabla_par = ParadaBus._meta.db_table
+    sql = f"""
+        UPDATE {tabla_seg} s
+           SET longitud_km = ST_Length(s.geometria::geography) / 1000.0,
+               paradas_cercanas = c.total
+          FROM (
+                SELECT s2.segmento_id, COUNT(p.id) AS total
+                  FROM {tabla_seg} s2
+                  LEFT JOIN {tabla_par} p
+                    ON ST_DWithin(p.geom::geography, s2.geometria::geography, %s)
+                 GROUP BY s2.segmento_id
+          ) c
+         WHERE c.segmento_id = s.segmento_id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [metros])
+        return cursor.rowcount
+
+
+def _refrescar_generico(metros):
+    # Otros motores (p. ej. SpatiaLite): aproximación en grados (1° ~ 111 km)
+    grados = metros / 111_000.0
+    segmentos = list(Segmento.objects.only("segmento_id", "geometria"))
+    for s in segmentos:
+        s.longitud_km = longitud_geodesica_km(s.geometria)
+        s.paradas_cercanas = ParadaBus.objects.filter(geom__dwithin=(s.geometria, grados)).count()
+    Segmento.objects.bulk_update(segmentos, ["longitud_km", "paradas_cercanas"], batch_size=1000)
+    return len(segmentos)
+
+
+@transaction.atomic
+def refrescar(metros=DISTANCIA_POR_DEFECTO):
+    """
+    Recalcula longitud_km y paradas_cercanas de todos los segmentos
+    (paradas a menos de `metros`). Retorna la cantidad de segmentos.
+    """
+    if connection.vendor == "postgresql":
+        total = _refrescar_postgres(metros)
+    else:
+        total = _refrescar_generico(metros)
+
+    # UPDATE/bulk_update no disparan señales
+    transaction.on_commit(invalidar)
+    return total
+
+
+# ------------------------------
+# Caché en memoria
+# ------------------------------
+def _cargar():
+    metadatos = {}
+    sin_longitud = []
+
+    for segmento_id, nombre, longitud_km, paradas in Segmento.objects.values_list(
+        "segmento_id", "nombre", "longitud_km", "paradas_cercanas"
+    ):
+        metadatos[segmento_id] = {
+            "nombre": nombre,
+            "longitud_km": longitud_km,
+            "paradas_cercanas": paradas,
+        }
+        if longitud_km is None:
+            sin_longitud.append(segmento_id)
+
+    # Segmentos aún sin refrescar: la longitud se calcula al vuelo
+    if sin_longitud:
+        for s in Segmento.objects.filter(segmento_id__in=sin_longitud).only("segmento_id", "geometria"):
+            metadatos[s.segmento_id]["longitud_km"] = round(longitud_geodesica_km(s.geometria), 3)
+
+    return metadatos
+
+
+def obtener():
+    """{segmento_id: {"nombre", "longitud_km", "paradas_cercanas"}} de todos los segmentos."""
+    global _metadatos, _metadatos_version
+    version = obtener_version(_CLAVE_VERSION)
+    if _metadatos is None or _metadatos_version != version:
+        _metadatos = _cargar()
+        _metadatos_version = version
+    return _metadatos
+
+
+def info_segmento(segmento_id):
+    """Metadatos de un segmento, o None si no existe."""
+    return obtener().get(segmento_id)
+
+
+def invalidar():
+    """Se llama desde las señales de Segmento y después de refrescar()."""
+    incrementar_version(_CLAVE_VERSION)
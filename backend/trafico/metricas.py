@@ -0,0 +1,310 @@
+# trafico/metricas.py
+"""
+Instrumentación ligera por etapas.
+
+- etapa("nombre") mide un bloque (o una función, como decorador) y lo
+  registra en un histograma por etapa.
+- MetricasMiddleware mide cada petición y devuelve las etapas que corrieron
+  en ella en la cabecera Server-Timing.
+- /metrics expone todo en formato de texto de Prometheus: histogramas,
+  contadores de aciertos de caché (con su tasa de aciertos) y cargas de
+  modelos.
+
+Los valores viven en memoria de cada proceso (cada worker expone los
+suyos). Con METRICS_ENABLED = False las etapas no miden nada, el
+middleware deja pasar la petición tal cual y /metrics responde 404.
+
+/metrics solo responde a las IPs de METRICS_IPS (direcciones o redes) o a
+quien mande "Authorization: Bearer <METRICS_TOKEN>"; al resto, 403.
+
+Las etapas que corren en otros hilos (p. ej. el pool de Mapbox) llegan a
+la petición si la tarea se lanza con contextvars.copy_context().run.
+"""
+import bisect
+import contextvars
+import ipaddress
+import secrets
+import threading
+import time
+from contextlib import ContextDecorator, contextmanager
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+from .presupuestos import presupuesto_consultas
+
+# Límites (s) de las cubetas de los histogramas
+CUBETAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Etapas de la petición/comando en curso: {nombre: segundos}
+_tiempos = contextvars.ContextVar("metricas_tiempos", default=None)
+# Varios hilos pueden sumar etapas a la misma petición
+_tiempos_lock = threading.Lock()
+
+
+def habilitado():
+    return getattr(settings, "METRICS_ENABLED", True)
+
+
+def _etiquetas(nombres, valores):
+    if not nombres:
+        return ""
+    pares = ",".join(f'{n}="{str(v)}"' for n, v in zip(nombres, valores))
+    return "{" + pares + "}"
+
+
+# ------------------------------
+# Tipos de métrica
+# ------------------------------
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, valor=1, **etiquetas):
+        clave = tuple(etiquetas[n] for n in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def valores(self):
+        with self._lock:
+            return dict(self._valores)
+
+    def exportar(self):
+        for clave, valor in sorted(self.valores().items()):
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {valor}"
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), cubetas=CUBETAS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.cubetas = tuple(cubetas)
+        # {etiquetas: [conteos por cubeta (+Inf al final), suma]}
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(etiquetas[n] for n in self.etiquetas)
+        indice = bisect.bisect_left(self.cubetas, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.cubetas) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    def exportar(self):
+        with self._lock:
+            series = {clave: (list(conteos), suma) for clave, (conteos, suma) in self._series.items()}
+
+        for clave, (conteos, suma) in sorted(series.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.cubetas + ("+Inf",), conteos):
+                acumulado += conteo
+                etiquetas = _etiquetas(self.etiquetas + ("le",), clave + (limite,))
+                yield f"{self.nombre}_bucket{etiquetas} {acumulado}"
+            etiquetas = _etiquetas(self.etiquetas, clave)
+            yield f"{self.nombre}_sum{etiquetas} {suma:.6f}"
+            yield f"{self.nombre}_count{etiquetas} {acumulado}"
+
+
+class Registro:
+    def __init__(self):
+        self.metricas = []
+
+    def contador(self, *args, **kwargs):
+        metrica = Contador(*args, **kwargs)
+        self.metricas.append(metrica)
+        return metrica
+
+    def histograma(self, *args, **kwargs):
+        metrica = Histograma(*args, **kwargs)
+        self.metricas.append(metrica)
+        return metrica
+
+    def exportar(self):
+        lineas = []
+        for metrica in self.metricas:
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(metrica.exportar())
+        lineas.extend(_tasa_aciertos())
+        return "\n".join(lineas) + "\n"
+
+
+registro = Registro()
+
+PETICIONES = registro.histograma(
+    "trafico_peticion_segundos", "Duración de las peticiones HTTP", ("ruta", "metodo", "estado")
+)
+ETAPAS = registro.histograma("trafico_etapa_segundos", "Duración de cada etapa instrumentada", ("etapa",))
+CACHE = registro.contador("trafico_cache_total", "Consultas a cachés por resultado", ("cache", "resultado"))
+MODELOS = registro.contador("trafico_modelos_cargados_total", "Modelos Prophet cargados desde disco", ("segmento",))
+ADMISION = registro.contador(
+    "trafico_admision_total", "Peticiones ante los límites de tasa y de cómputo, por resultado", ("limite", "resultado")
+)
+COLA = registro.histograma("trafico_cola_computo_segundos", "Espera en cola por un turno de cómputo de modelos")
+
+
+def _tasa_aciertos():
+    """Gauge derivado: aciertos / consultas de cada caché desde el arranque."""
+    totales, aciertos = {}, {}
+    for (nombre, resultado), valor in CACHE.valores().items():
+        totales[nombre] = totales.get(nombre, 0) + valor
+        if resultado == "hit":
+            aciertos[nombre] = aciertos.get(nombre, 0) + valor
+
+    if not totales:
+        return
+    yield "# HELP trafico_cache_tasa_aciertos Fracción de consultas a cada caché resueltas sin recalcular"
+    yield "# TYPE trafico_cache_tasa_aciertos gauge"
+    for nombre in sorted(totales):
+        yield f'trafico_cache_tasa_aciertos{{cache="{nombre}"}} {aciertos.get(nombre, 0) / totales[nombre]:.4f}'
+
+
+# ------------------------------
+# API de instrumentación
+# ------------------------------
+class etapa(ContextDecorator):
+    """
+    with etapa("prediccion_modelo"): ...   o   @etapa("recomendacion")
+    Registra la duración en ETAPAS y en los tiempos de la petición en curso.
+    """
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+
+    def _recreate_cm(self):
+        # Como decorador, cada llamada usa su propia instancia (hilos, recursión)
+        return type(self)(self.nombre)
+
+    def __enter__(self):
+        self._inicio = time.perf_counter() if habilitado() else None
+        return self
+
+    def __exit__(self, *exc):
+        if self._inicio is None:
+            return False
+        duracion = time.perf_counter() - self._inicio
+        ETAPAS.observar(duracion, etapa=self.nombre)
+        tiempos = _tiempos.get()
+        if tiempos is not None:
+            # Una etapa que se repite (p. ej. un modelo por segmento) se acumula
+            with _tiempos_lock:
+                tiempos[self.nombre] = tiempos.get(self.nombre, 0.0) + duracion
+        return False
+
+
+def cache(nombre, acierto):
+    """Cuenta una consulta a la caché `nombre` (acierto=True/False o un estado HIT/MISS/STALE)."""
+    if not habilitado():
+        return
+    if isinstance(acierto, str):
+        resultado = acierto.lower()
+    else:
+        resultado = "hit" if acierto else "miss"
+    CACHE.inc(cache=nombre, resultado=resultado)
+
+
+def admision(limite, resultado, espera=None):
+    """Cuenta una decisión de admisión (permitida/en_cola/rechazada) y, si hubo cola, su espera (s)."""
+    if not habilitado():
+        return
+    ADMISION.inc(limite=limite, resultado=resultado)
+    if espera is not None:
+        COLA.observar(espera)
+
+
+def modelo_cargado(segmento_id):
+    if habilitado():
+        MODELOS.inc(segmento=segmento_id)
+
+
+@contextmanager
+def recolectar():
+    """Junta las etapas que corren dentro del bloque: {nombre: segundos}."""
+    tiempos = {}
+    token = _tiempos.set(tiempos)
+    try:
+        yield tiempos
+    finally:
+        _tiempos.reset(token)
+
+
+def resumen(tiempos):
+    """'a 1.20s, b 0.03s' ordenado por duración."""
+    return ", ".join(f"{n} {s:.2f}s" for n, s in sorted(tiempos.items(), key=lambda t: -t[1]))
+
+
+class ConTiempos:
+    """Mixin para comandos: al terminar imprime el tiempo de cada etapa."""
+
+    def execute(self, *args, **options):
+        with recolectar() as tiempos:
+            salida = super().execute(*args, **options)
+        if tiempos and options.get("verbosity", 1) >= 1:
+            self.stdout.write(f"Tiempos por etapa: {resumen(tiempos)}")
+        return salida
+
+
+# ------------------------------
+# HTTP
+# ------------------------------
+class MetricasMiddleware:
+    """Mide cada petición y agrega la cabecera Server-Timing."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not habilitado():
+            return self.get_response(request)
+
+        inicio = time.perf_counter()
+        with recolectar() as tiempos:
+            response = self.get_response(request)
+        total = time.perf_counter() - inicio
+
+        coincidencia = request.resolver_match
+        # La plantilla de la ruta (no la URL) mantiene acotadas las series
+        ruta = coincidencia.route if coincidencia else "sin_ruta"
+        PETICIONES.observar(total, ruta=ruta, metodo=request.method, estado=response.status_code)
+
+        partes = [f"{nombre};dur={segundos * 1000:.1f}" for nombre, segundos in tiempos.items()]
+        partes.append(f"total;dur={total * 1000:.1f}")
+        response["Server-Timing"] = ", ".join(partes)
+        return response
+
+
+def autorizado(request):
+    """True si la petición viene de METRICS_IPS o trae el METRICS_TOKEN."""
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token:
+        esquema, _, valor = request.headers.get("Authorization", "").partition(" ")
+        if esquema.lower() == "bearer" and secrets.compare_digest(valor.strip(), token):
+            return True
+    try:
+        ip = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(ip in ipaddress.ip_network(red, strict=False) for red in getattr(settings, "METRICS_IPS", ()))
+
+
+@presupuesto_consultas(0)
+def metricas(request):
+    """Endpoint: /metrics (formato de texto de Prometheus)."""
+    if not habilitado():
+        raise Http404
+    if not autorizado(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registro.exportar(), content_type=CONTENT_TYPE)
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2025-12-02 18:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def crear_indice_brin(apps, schema_editor):
+    # BRIN es exclusivo de PostgreSQL: ocupa unos pocos KB aunque la tabla
+    # tenga millones de filas, porque fecha_hora llega casi ordenada.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS medicion_fecha_brin "
+        "ON trafico_mediciontrafico USING brin (fecha_hora)"
+    )
+
+
+def eliminar_indice_brin(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS medicion_fecha_brin")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trafico', '0004_paradabus'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mediciontrafico',
+            index=models.Index(fields=['segmento', '-fecha_hora'], name='medicion_seg_fecha_idx'),
+        ),
+        migrations.RunPython(crear_indice_brin, eliminar_indice_brin),
+        migrations.CreateModel(
+            name='MedicionHoraria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hora', models.DateTimeField(help_text='Inicio de la hora agregada')),
+                ('muestras', models.PositiveIntegerField(default=0)),
+                ('suma_velocidad', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('velocidad_min', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('velocidad_max', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('suma_congestion', models.BigIntegerField(default=0)),
+                ('segmento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mediciones_horarias', to='trafico.segmento')),
+            ],
+            options={
+                'verbose_name': 'Medición horaria',
+                'verbose_name_plural': 'Mediciones horarias',
+                'ordering': ['-hora'],
+                'unique_together': {('segmento', 'hora')},
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.8 on 2025-12-04 16:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trafico', '0005_mediciontrafico_indices_medicionhoraria'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicionhoraria',
+            name='congestion_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='medicionhoraria',
+            name='congestion_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='medicionhoraria',
+            name='congestion_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='medicionhoraria',
+            name='congestion_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='medicionhoraria',
+            name='congestion_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='MedicionDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('muestras', models.PositiveIntegerField(default=0)),
+                ('suma_velocidad', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('velocidad_min', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('velocidad_max', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('suma_congestion', models.BigIntegerField(default=0)),
+                ('congestion_1', models.PositiveIntegerField(default=0)),
+                ('congestion_2', models.PositiveIntegerField(default=0)),
+                ('congestion_3', models.PositiveIntegerField(default=0)),
+                ('congestion_4', models.PositiveIntegerField(default=0)),
+                ('congestion_5', models.PositiveIntegerField(default=0)),
+                ('fecha', models.DateField(help_text='Día agregado')),
+                ('segmento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mediciones_diarias', to='trafico.segmento')),
+            ],
+            options={
+                'verbose_name': 'Medición diaria',
+                'verbose_name_plural': 'Mediciones diarias',
+                'ordering': ['-fecha'],
+                'unique_together': {('segmento', 'fecha')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MarcaAgregado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=50, unique=True)),
+                ('ultimo_id', models.BigIntegerField(default=0)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
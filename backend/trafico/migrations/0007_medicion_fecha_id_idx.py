@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2025-12-05 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trafico', '0006_resumenes_mediciones'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mediciontrafico',
+            index=models.Index(fields=['-fecha_hora', '-id'], name='medicion_fecha_id_idx'),
+        ),
+    ]
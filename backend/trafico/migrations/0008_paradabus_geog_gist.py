@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2025-12-08 09:20
+
+from django.db import migrations
+
+
+def crear_indices_geography(apps, schema_editor):
+    # Índices GiST funcionales para ST_DWithin(...::geography, metros).
+    # El planificador solo los usa si la consulta repite la misma expresión.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS paradabus_geom_geog_gist "
+        "ON trafico_paradabus USING gist ((geom::geography))"
+    )
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS segmento_geometria_geog_gist "
+        "ON trafico_segmento USING gist ((geometria::geography))"
+    )
+
+
+def eliminar_indices_geography(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS paradabus_geom_geog_gist")
+    schema_editor.execute("DROP INDEX IF EXISTS segmento_geometria_geog_gist")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trafico', '0007_medicion_fecha_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices_geography, eliminar_indices_geography),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trafico', '0008_paradabus_geog_gist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediciontrafico',
+            name='muestras',
+            field=models.PositiveIntegerField(default=1, help_text='Lecturas promediadas en la fila (pings GPS por cubeta)'),
+        ),
+    ]
@@ -23,6 +23,102 @@ class MedicionTrafico(models.Model):
     fecha_hora = models.DateTimeField()
     velocidad_promedio = models.DecimalField(max_digits=5, decimal_places=2)
     nivel_congestion = models.IntegerField()
+    muestras = models.PositiveIntegerField(default=1,
+                                           help_text="Lecturas promediadas en la fila (pings GPS por cubeta)")
+
+    class Meta:
+        indexes = [
+            # Historial por tramo: filtro por segmento + orden por fecha descendente
+            models.Index(fields=["segmento", "-fecha_hora"], name="medicion_seg_fecha_idx"),
+            # Paginación keyset global sobre (fecha_hora, id)
+            models.Index(fields=["-fecha_hora", "-id"], name="medicion_fecha_id_idx"),
+        ]
+        # El índice BRIN sobre fecha_hora (solo PostgreSQL) se crea en la migración 0005.
+
+
+class ResumenMediciones(models.Model):
+    """
+    Campos comunes de los resúmenes (rollups) de MedicionTrafico.
+    Guarda sumas y conteos en lugar de promedios para poder combinar
+    lotes nuevos sobre un periodo ya agregado sin perder exactitud.
+    """
+    NIVELES_CONGESTION = (1, 2, 3, 4, 5)
+
+    muestras = models.PositiveIntegerField(default=0)
+    suma_velocidad = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    velocidad_min = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    velocidad_max = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    suma_congestion = models.BigIntegerField(default=0)
+
+    # Distribución de congestión: cantidad de muestras por nivel (1-5)
+    congestion_1 = models.PositiveIntegerField(default=0)
+    congestion_2 = models.PositiveIntegerField(default=0)
+    congestion_3 = models.PositiveIntegerField(default=0)
+    congestion_4 = models.PositiveIntegerField(default=0)
+    congestion_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def velocidad_promedio(self):
+        return float(self.suma_velocidad) / self.muestras if self.muestras else None
+
+    @property
+    def nivel_congestion_promedio(self):
+        return self.suma_congestion / self.muestras if self.muestras else None
+
+    @property
+    def distribucion_congestion(self):
+        return [getattr(self, f"congestion_{n}") for n in self.NIVELES_CONGESTION]
+
+
+class MedicionHoraria(ResumenMediciones):
+    """
+    Resumen horario por segmento. También conserva el historial de las
+    mediciones crudas que ya fueron depuradas (downsampling).
+    """
+    segmento = models.ForeignKey(Segmento, on_delete=models.CASCADE, related_name="mediciones_horarias")
+    hora = models.DateTimeField(help_text="Inicio de la hora agregada")
+
+    class Meta:
+        unique_together = ("segmento", "hora")
+        ordering = ["-hora"]
+        verbose_name = "Medición horaria"
+        verbose_name_plural = "Mediciones horarias"
+
+    def __str__(self):
+        return f"{self.segmento_id} - {self.hora:%Y-%m-%d %H:00}"
+
+
+class MedicionDiaria(ResumenMediciones):
+    """
+    Resumen diario por segmento (gráficos de tendencia del dashboard).
+    """
+    segmento = models.ForeignKey(Segmento, on_delete=models.CASCADE, related_name="mediciones_diarias")
+    fecha = models.DateField(help_text="Día agregado")
+
+    class Meta:
+        unique_together = ("segmento", "fecha")
+        ordering = ["-fecha"]
+        verbose_name = "Medición diaria"
+        verbose_name_plural = "Mediciones diarias"
+
+    def __str__(self):
+        return f"{self.segmento_id} - {self.fecha:%Y-%m-%d}"
+
+
+class MarcaAgregado(models.Model):
+    """
+    Marca de agua (watermark) del último MedicionTrafico.id ya incluido
+    en los resúmenes. Permite procesar solo las filas nuevas.
+    """
+    nombre = models.CharField(max_length=50, unique=True)
+    ultimo_id = models.BigIntegerField(default=0)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.nombre}: {self.ultimo_id}"
 
 class RutaAlterna(models.Model):
     nombre = models.CharField(max_length=150)
@@ -0,0 +1,97 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginación por cursor (keyset) sobre (fecha_hora, id) en orden descendente.
+
+    En lugar de OFFSET, cada página filtra por la última posición vista:
+        fecha_hora < f  OR  (fecha_hora = f AND id < i)
+    así la página 1000 cuesta lo mismo que la primera y no hace COUNT(*).
+    Acepta instancias de modelo o diccionarios (querysets con .values()).
+    """
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    cursor_query_param = "cursor"
+    ordering = ("-fecha_hora", "-id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        campo, desempate = (o.lstrip("-") for o in self.ordering)
+
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            valor, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(**{f"{campo}__lt": valor}) | Q(**{campo: valor, f"{desempate}__lt": pk})
+            )
+
+        # Pedimos una fila extra solo para saber si hay página siguiente
+        resultados = list(queryset[: self.page_size + 1])
+        self.siguiente = None
+        if len(resultados) > self.page_size:
+            resultados = resultados[: self.page_size]
+            ultimo = resultados[-1]
+            self.siguiente = (self._valor(ultimo, campo), self._valor(ultimo, desempate))
+
+        return resultados
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_next_link(self):
+        if self.siguiente is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(*self.siguiente))
+
+    # ------------------------------
+    # Codificación del cursor
+    # ------------------------------
+    @staticmethod
+    def _valor(item, campo):
+        return item[campo] if isinstance(item, dict) else getattr(item, campo)
+
+    @staticmethod
+    def encode_cursor(valor, pk):
+        crudo = json.dumps([valor.isoformat(), pk]).encode()
+        return base64.urlsafe_b64encode(crudo).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            valor, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            fecha = parse_datetime(valor)
+            if fecha is None:
+                raise ValueError(valor)
+            return fecha, int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound("Cursor inválido")
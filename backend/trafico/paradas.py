@@ -0,0 +1,203 @@
+# trafico/paradas.py
+"""
+Búsqueda de paradas cercanas a segmentos con distancia real en metros.
+
+En PostgreSQL se compara como geography (ST_DWithin en metros) usando el
+índice GiST funcional sobre geom::geography (migración 0008). Una sola
+consulta resuelve varios segmentos a la vez y trae también las paradas
+asociadas por FK, que se usan como respaldo si no hay ninguna cercana.
+
+paradas_json() arma la lista completa de paradas como JSON dentro de
+PostgreSQL (json_build_object + ST_X/ST_Y) y la entrega por bloques desde
+un cursor del servidor, sin instanciar modelos ni serializadores. El
+alias de BD se resuelve antes de empezar a iterar: el cuerpo de un
+StreamingHttpResponse se recorre fuera de la petición (ver replicas.py).
+"""
+import json
+
+from django.contrib.gis.geos import Polygon
+from django.db import connection, connections
+
+from . import replicas
+from .models import ParadaBus, Segmento
+
+DISTANCIA_POR_DEFECTO = 30.0  # metros
+DISTANCIA_MAXIMA = 5_000.0
+TAMANO_BLOQUE = 2_000
+
+
+def _fila_a_parada(pk, osm_id, nombre, segmento_id, lat, lon):
+    # Mismo formato que ParadaBusSerializer
+    return {
+        "id": pk,
+        "osm_id": osm_id,
+        "nombre": nombre,
+        "segmento": segmento_id,
+        "lat": lat,
+        "lon": lon,
+    }
+
+
+def _paradas_postgres(segmento_ids, metros):
+    sql = f"""
+        SELECT s.segmento_id,
+               p.id, p.osm_id, p.nombre, p.segmento_id, ST_Y(p.geom), ST_X(p.geom),
+               ST_DWithin(p.geom::geography, s.geometria::geography, %s) AS cerca
+        FROM {Segmento._meta.db_table} s
+        JOIN {ParadaBus._meta.db_table} p
+          ON ST_DWithin(p.geom::geography, s.geometria::geography, %s)
+          OR p.segmento_id = s.segmento_id
+        WHERE s.segmento_id = ANY(%s)
+        ORDER BY s.segmento_id, p.id
+    """
+    cercanas = {}
+    por_fk = {}
+    with connections[replicas.lectura()].cursor() as cursor:
+        cursor.execute(sql, [metros, metros, list(segmento_ids)])
+        for seg_id, *parada, cerca in cursor.fetchall():
+            destino = cercanas if cerca else por_fk
+            destino.setdefault(seg_id, []).append(_fila_a_parada(*parada))
+    return cercanas, por_fk
+
+
+def _paradas_generico(segmento_ids, metros):
+    # Otros motores (p. ej. SpatiaLite): aproximación en grados (1° ~ 111 km)
+    cercanas = {}
+    por_fk = {}
+    grados = metros / 111_000.0
+    for segmento in Segmento.objects.filter(segmento_id__in=segmento_ids):
+        for p in ParadaBus.objects.filter(geom__dwithin=(segmento.geometria, grados)).order_by("id"):
+            cercanas.setdefault(segmento.segmento_id, []).append(
+                _fila_a_parada(p.id, p.osm_id, p.nombre, p.segmento_id, p.geom.y, p.geom.x)
+            )
+    for p in ParadaBus.objects.filter(segmento_id__in=segmento_ids).order_by("id"):
+        por_fk.setdefault(p.segmento_id, []).append(
+            _fila_a_parada(p.id, p.osm_id, p.nombre, p.segmento_id, p.geom.y, p.geom.x)
+        )
+    return cercanas, por_fk
+
+
+def paradas_por_segmentos(segmento_ids, metros=DISTANCIA_POR_DEFECTO):
+    """
+    Retorna {segmento_id: [parada, ...]} con las paradas a menos de `metros`
+    de cada segmento. Si un segmento no tiene ninguna cercana se devuelven
+    las paradas asociadas a él por segmento_id.
+    """
+    segmento_ids = list(segmento_ids)
+    if not segmento_ids:
+        return {}
+
+    if connection.vendor == "postgresql":
+        cercanas, por_fk = _paradas_postgres(segmento_ids, metros)
+    else:
+        cercanas, por_fk = _paradas_generico(segmento_ids, metros)
+
+    return {
+        seg_id: cercanas.get(seg_id) or por_fk.get(seg_id, [])
+        for seg_id in segmento_ids
+    }
+
+
+# ------------------------------
+# Lista completa como JSON
+# ------------------------------
+def _json_postgres(bbox, alias):
+    filtro = ""
+    params = []
+    if bbox:
+        filtro = "WHERE p.geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)"
+        params = list(bbox)
+
+    sql = f"""
+        SELECT json_build_object(
+                   'id', p.id, 'osm_id', p.osm_id, 'nombre', p.nombre,
+                   'segmento', p.segmento_id, 'lat', ST_Y(p.geom), 'lon', ST_X(p.geom)
+               )::text
+        FROM {ParadaBus._meta.db_table} p
+        {filtro}
+        ORDER BY p.id
+    """
+    with connections[alias].chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            filas = cursor.fetchmany(TAMANO_BLOQUE)
+            if not filas:
+                break
+            yield ",".join(f[0] for f in filas).encode()
+
+
+def _json_generico(bbox, alias):
+    filas = consulta_paradas(bbox).using(alias).iterator(chunk_size=TAMANO_BLOQUE)
+    for pagina in _paginas(a_diccionarios(filas)):
+        yield json.dumps(pagina, separators=(",", ":"))[1:-1].encode()
+
+
+def _paginas(filas):
+    pagina = []
+    for fila in filas:
+        pagina.append(fila)
+        if len(pagina) == TAMANO_BLOQUE:
+            yield pagina
+            pagina = []
+    if pagina:
+        yield pagina
+
+
+def consulta_paradas(bbox=None):
+    """values_list de paradas (opcionalmente dentro del bbox), ordenadas por id."""
+    qs = ParadaBus.objects.order_by("id").values_list("id", "osm_id", "nombre", "segmento_id", "geom")
+    if bbox:
+        area = Polygon.from_bbox(bbox)
+        area.srid = 4326
+        qs = qs.filter(geom__bboxoverlaps=area)
+    return qs
+
+
+def a_diccionarios(filas):
+    """Filas de consulta_paradas() -> diccionarios con el formato de ParadaBusSerializer."""
+    for pk, osm_id, nombre, segmento_id, geom in filas:
+        yield _fila_a_parada(pk, osm_id, nombre, segmento_id, geom.y, geom.x)
+
+
+def paradas_json(bbox=None, alias=None):
+    """
+    Generador de bytes con la lista JSON de paradas (mismo formato que
+    ParadaBusSerializer), listo para un StreamingHttpResponse. `alias` es la
+    BD de lectura; si no se da, se elige ahora y no al iterar.
+    """
+    alias = alias or replicas.lectura()
+    if connection.vendor == "postgresql":
+        bloques = _json_postgres(bbox, alias)
+    else:
+        bloques = _json_generico(bbox, alias)
+    return _lista(bloques)
+
+
+def _lista(bloques):
+    yield b"["
+    separador = b""
+    for bloque in bloques:
+        yield separador + bloque
+        separador = b","
+    yield b"]"
+
+
+def parse_distancia(valor):
+    """Distancia en metros desde un query param (ValueError si es inválida)."""
+    if valor in (None, ""):
+        return DISTANCIA_POR_DEFECTO
+    metros = float(valor)
+    if not 0 < metros <= DISTANCIA_MAXIMA:
+        raise ValueError(f"dist debe estar entre 0 y {DISTANCIA_MAXIMA:.0f} metros")
+    return metros
+
+
+def parse_bbox(valor):
+    """'minlon,minlat,maxlon,maxlat' -> tupla de floats (ValueError si es inválida)."""
+    partes = [float(v) for v in valor.split(",")]
+    if len(partes) != 4:
+        raise ValueError("bbox debe ser minlon,minlat,maxlon,maxlat")
+    minx, miny, maxx, maxy = partes
+    if minx >= maxx or miny >= maxy:
+        raise ValueError("bbox con límites invertidos")
+    return minx, miny, maxx, maxy
@@ -0,0 +1,49 @@
+# trafico/parametros.py
+"""Lectura de parámetros de consulta comunes a varias vistas."""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import BooleanField
+
+
+def parse_limite(valor, fin=False):
+    """
+    Acepta 'YYYY-MM-DD' o ISO 8601 completo y retorna un datetime aware.
+    Una fecha sola como límite final incluye el día entero.
+    Lanza ValueError si el valor no es una fecha.
+    """
+    if not valor:
+        return None
+
+    dt = parse_datetime(valor)
+    if dt is None:
+        d = parse_date(valor)
+        if d is None:
+            raise ValueError(f"Fecha inválida: {valor}")
+        dt = datetime.combine(d + timedelta(days=1) if fin else d, time.min)
+
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
+def parse_entero(valor):
+    """Entero opcional: None si viene vacío, ValueError si no es numérico."""
+    if valor in (None, ""):
+        return None
+    return int(valor)
+
+
+def parse_booleano(valor, defecto=False):
+    """
+    Booleano de JSON o de query string ("true", "false", "1", "0"...):
+    el defecto si viene vacío, ValueError si no se reconoce.
+    """
+    if valor in (None, ""):
+        return defecto
+    try:
+        return BooleanField().to_internal_value(valor)
+    except ValidationError:
+        raise ValueError(f"Valor booleano inválido: {valor}") from None
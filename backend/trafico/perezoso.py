@@ -0,0 +1,46 @@
+# trafico/perezoso.py
+"""
+Importación diferida de librerías pesadas (pandas, numpy, shapely,
+pyproj, networkx, joblib, requests).
+
+    np = importar("numpy")
+
+devuelve un sustituto que importa el módulo real en el primer acceso a
+un atributo (np.array, ...). Así cargar las URLs, correr un comando de
+manage.py o levantar un worker no paga el stack de ciencia de datos
+hasta que una petición lo necesita de verdad. Cada atributo resuelto se
+copia al sustituto: los accesos siguientes no pasan por __getattr__.
+
+El arranque se mide con `python manage.py benchmark_arranque`.
+"""
+import importlib
+import threading
+
+_lock = threading.Lock()
+
+
+class ModuloPerezoso:
+    def __init__(self, nombre):
+        self.__dict__["_nombre"] = nombre
+        self.__dict__["_modulo"] = None
+
+    def _cargar(self):
+        if self._modulo is None:
+            with _lock:
+                if self._modulo is None:
+                    self.__dict__["_modulo"] = importlib.import_module(self._nombre)
+        return self._modulo
+
+    def __getattr__(self, atributo):
+        valor = getattr(self._cargar(), atributo)
+        self.__dict__[atributo] = valor
+        return valor
+
+    def __repr__(self):
+        estado = "cargado" if self._modulo is not None else "sin cargar"
+        return f"<módulo perezoso {self._nombre!r} ({estado})>"
+
+
+def importar(nombre):
+    """Sustituto de `import nombre` que difiere la importación al primer uso."""
+    return ModuloPerezoso(nombre)
@@ -0,0 +1,254 @@
+# trafico/perfilado.py
+"""
+Perfilado bajo demanda de peticiones reales.
+
+PerfiladoMiddleware ejecuta la vista bajo cProfile cuando:
+- un usuario staff (sesión o JWT) envía la cabecera X-Perfilar: 1 o ?_perfilar=1, o
+- la petición cae en la fracción muestreada (PERFILADO_MUESTREO, 0 = nunca).
+
+Cada perfil se guarda en PERFILADO_DIR como <id>.prof (abrible con pstats,
+snakeviz, etc.) más <id>.json con los datos de la petición, las funciones
+más costosas y el log de consultas SQL (con las repetidas agrupadas, para
+detectar N+1). Solo se conservan los últimos PERFILADO_MAX. La respuesta
+lleva la cabecera X-Perfil con el id; el admin los lista en
+/admin/perfiles/.
+
+En las respuestas por streaming (exportaciones, paradas) el trabajo pesado
+corre al iterar el cuerpo, después de la vista: el perfil se sigue
+tomando fragmento a fragmento y se guarda cuando el servidor cierra la
+respuesta. Si el cliente corta antes, el perfil queda con "completo": false.
+"""
+import cProfile
+import io
+import json
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+CABECERA = "X-Perfilar"
+PARAMETRO = "_perfilar"
+FUNCIONES_RESUMEN = 40
+CONSULTAS_MAX = 500
+
+# cProfile no admite dos perfiladores activos a la vez: uno por proceso
+_perfilando = threading.Lock()
+
+
+def directorio():
+    return Path(getattr(settings, "PERFILADO_DIR", Path(settings.BASE_DIR) / "cache" / "perfiles"))
+
+
+def _es_staff(request):
+    usuario = getattr(request, "user", None)
+    if usuario is not None and usuario.is_authenticated:
+        return usuario.is_staff
+
+    # Las vistas de la API autentican con JWT dentro de DRF, después del middleware
+    from rest_framework.exceptions import AuthenticationFailed
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+
+    try:
+        resultado = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return bool(resultado and resultado[0].is_staff)
+
+
+def motivo(request):
+    """'staff', 'muestreo' o None si la petición no se perfila."""
+    if request.headers.get(CABECERA) == "1" or request.GET.get(PARAMETRO) == "1":
+        if _es_staff(request):
+            return "staff"
+    muestreo = getattr(settings, "PERFILADO_MUESTREO", 0.0)
+    if muestreo and random.random() < muestreo:
+        return "muestreo"
+    return None
+
+
+def _registrador(consultas, alias):
+    def registrar(execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if len(consultas) < CONSULTAS_MAX:
+                consultas.append({
+                    "bd": alias,
+                    "sql": sql,
+                    "segundos": round(time.perf_counter() - inicio, 6),
+                })
+    return registrar
+
+
+def _resumen(perfil):
+    salida = io.StringIO()
+    pstats.Stats(perfil, stream=salida).sort_stats("cumulative").print_stats(FUNCIONES_RESUMEN)
+    return salida.getvalue()
+
+
+def _rotar(carpeta):
+    maximo = getattr(settings, "PERFILADO_MAX", 50)
+    perfiles = sorted(carpeta.glob("*.json"))
+    for viejo in perfiles[:-maximo] if len(perfiles) > maximo else []:
+        viejo.unlink(missing_ok=True)
+        viejo.with_suffix(".prof").unlink(missing_ok=True)
+
+
+def _nuevo_id():
+    # El id empieza por la fecha: ordenar por nombre es ordenar por antigüedad
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:6]}"
+
+
+def guardar(perfil, datos, perfil_id=None):
+    carpeta = directorio()
+    carpeta.mkdir(parents=True, exist_ok=True)
+    perfil_id = perfil_id or _nuevo_id()
+    datos["id"] = perfil_id
+
+    perfil.dump_stats(carpeta / f"{perfil_id}.prof")
+    (carpeta / f"{perfil_id}.json").write_text(json.dumps(datos, ensure_ascii=False), encoding="utf-8")
+    _rotar(carpeta)
+    return perfil_id
+
+
+def listar():
+    """Perfiles guardados, del más reciente al más viejo (sin el resumen ni las consultas)."""
+    perfiles = []
+    for archivo in sorted(directorio().glob("*.json"), reverse=True):
+        try:
+            datos = json.loads(archivo.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        datos.pop("resumen", None)
+        datos.pop("consultas", None)
+        perfiles.append(datos)
+    return perfiles
+
+
+def obtener(perfil_id):
+    """Datos completos de un perfil, o None si no existe (o el id no es válido)."""
+    if not perfil_id.replace("-", "").isalnum():
+        return None
+    archivo = directorio() / f"{perfil_id}.json"
+    if not archivo.exists():
+        return None
+    return json.loads(archivo.read_text(encoding="utf-8"))
+
+
+class _Perfil:
+    """Un perfil en curso (cProfile y log de SQL) que se activa por tramos."""
+
+    def __init__(self, request, razon):
+        self.request = request
+        self.razon = razon
+        self.id = _nuevo_id()
+        self.perfil = cProfile.Profile()
+        self.consultas = []
+        self.inicio = time.perf_counter()
+
+    @contextmanager
+    def activo(self):
+        with ExitStack() as pila:
+            for alias in connections:
+                pila.enter_context(connections[alias].execute_wrapper(_registrador(self.consultas, alias)))
+            self.perfil.enable()
+            try:
+                yield
+            finally:
+                self.perfil.disable()
+
+    def guardar(self, response, **extra):
+        duracion = time.perf_counter() - self.inicio
+        repetidas = Counter(c["sql"] for c in self.consultas)
+        usuario = getattr(self.request, "user", None)
+
+        guardar(self.perfil, {
+            "fecha": datetime.now(timezone.utc).isoformat(),
+            "metodo": self.request.method,
+            "ruta": self.request.get_full_path(),
+            "estado": response.status_code,
+            "motivo": self.razon,
+            "usuario": usuario.get_username() if usuario is not None and usuario.is_authenticated else None,
+            "segundos": round(duracion, 4),
+            "total_consultas": len(self.consultas),
+            "segundos_sql": round(sum(c["segundos"] for c in self.consultas), 4),
+            "repetidas": [
+                {"sql": sql, "veces": veces} for sql, veces in repetidas.most_common(10) if veces > 1
+            ],
+            "consultas": self.consultas,
+            "resumen": _resumen(self.perfil),
+            **extra,
+        }, self.id)
+
+
+class _FlujoPerfilado:
+    """
+    streaming_content que sigue perfilando mientras se itera. Django llama a
+    close() al cerrar la respuesta: ahí se guarda el perfil y se libera
+    _perfilando (que queda tomado mientras dure el flujo).
+    """
+
+    def __init__(self, contenido, perfil, response):
+        self._iterador = iter(contenido)
+        self._perfil = perfil
+        self._response = response
+        self._completo = False
+        self._cerrado = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._perfil.activo():
+            try:
+                return next(self._iterador)
+            except StopIteration:
+                self._completo = True
+                raise
+
+    def close(self):
+        if self._cerrado:
+            return
+        self._cerrado = True
+        try:
+            self._perfil.guardar(self._response, streaming=True, completo=self._completo)
+        finally:
+            _perfilando.release()
+
+
+class PerfiladoMiddleware:
+    """Va después de AuthenticationMiddleware (usa request.user)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        razon = motivo(request)
+        if razon is None or not _perfilando.acquire(blocking=False):
+            return self.get_response(request)
+
+        perfil = _Perfil(request, razon)
+        en_flujo = False
+        try:
+            with perfil.activo():
+                response = self.get_response(request)
+            response["X-Perfil"] = perfil.id
+            if response.streaming:
+                # El flujo guarda el perfil y libera el lock al cerrarse
+                response.streaming_content = _FlujoPerfilado(response.streaming_content, perfil, response)
+                en_flujo = True
+            else:
+                perfil.guardar(response)
+            return response
+        finally:
+            if not en_flujo:
+                _perfilando.release()
@@ -0,0 +1,205 @@
+# trafico/presupuestos.py
+"""
+Presupuestos de consultas SQL por vista, para que no vuelvan los N+1.
+
+- @presupuesto_consultas(n) declara el máximo de consultas de una vista
+  (función o clase). Las vistas de terceros (login JWT, etc.) se declaran
+  en settings.PRESUPUESTOS_CONSULTAS = {nombre_url: n}.
+- Una vista que hace trabajo proporcional a los datos de forma intencional
+  (p. ej. generar las predicciones que faltan) declara también el costo por
+  elemento: @presupuesto_consultas(n, por_item=k). El código solo informa
+  cuántos elementos procesó con items(m); el presupuesto queda en n + k·m.
+- PresupuestoConsultasMiddleware cuenta las consultas de cada petición en
+  todos los alias de BD y, según PRESUPUESTO_CONSULTAS_MODO, registra un
+  warning ("log") o lanza PresupuestoExcedido ("error"); con "off" no hace
+  nada. La cabecera X-Consultas informa "usadas/presupuesto".
+- PresupuestoTestMixin.assertPresupuesto(nombre_url) lo verifica en tests.
+
+Las respuestas por streaming consultan después de salir de la vista: el
+middleware envuelve streaming_content para seguir contando mientras se
+itera y verifica el presupuesto al terminar. X-Consultas ya salió con las
+cabeceras, así que solo refleja lo hecho dentro de la vista.
+"""
+import contextvars
+import logging
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+
+logger = logging.getLogger(__name__)
+
+# Cuenta de la petición en curso
+_cuenta = contextvars.ContextVar("presupuesto_cuenta", default=None)
+
+
+class PresupuestoExcedido(Exception):
+    """Una vista hizo más consultas de las declaradas."""
+
+
+class _Cuenta:
+    def __init__(self, padre=None, registrar=False):
+        self.consultas = 0
+        self.items = 0
+        # Los items también llegan a la cuenta que envuelve a esta (tests)
+        self.padre = padre
+        self.sql = [] if registrar else None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.consultas += 1
+        if self.sql is not None:
+            self.sql.append(sql)
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def _contando(cuenta):
+    """Cuenta las consultas de todos los alias y expone `cuenta` a items()."""
+    token = _cuenta.set(cuenta)
+    try:
+        with ExitStack() as pila:
+            for alias in connections:
+                pila.enter_context(connections[alias].execute_wrapper(cuenta))
+            yield cuenta
+    finally:
+        _cuenta.reset(token)
+
+
+def presupuesto_consultas(maximo, por_item=0):
+    """
+    Decorador de vistas (función o clase): máximo de consultas por petición,
+    más `por_item` por cada elemento informado con items().
+    """
+    def decorar(vista):
+        vista.presupuesto_consultas = maximo
+        vista.presupuesto_por_item = por_item
+        return vista
+    return decorar
+
+
+def items(cantidad):
+    """Informa que la petición en curso procesó `cantidad` elementos más."""
+    cuenta = _cuenta.get()
+    while cuenta is not None:
+        cuenta.items += cantidad
+        cuenta = cuenta.padre
+
+
+def presupuesto_de(callback, nombre_url=None):
+    """Presupuesto declarado para una vista, o None si no tiene."""
+    configurados = getattr(settings, "PRESUPUESTOS_CONSULTAS", {})
+    if nombre_url in configurados:
+        return configurados[nombre_url]
+    maximo = getattr(callback, "presupuesto_consultas", None)
+    if maximo is None:
+        # Vistas basadas en clase: as_view() guarda la clase en view_class
+        maximo = getattr(getattr(callback, "view_class", None), "presupuesto_consultas", None)
+    return maximo
+
+
+def por_item_de(callback):
+    """Consultas por elemento declaradas para una vista (0 si no declara)."""
+    por_item = getattr(callback, "presupuesto_por_item", None)
+    if por_item is None:
+        por_item = getattr(getattr(callback, "view_class", None), "presupuesto_por_item", 0)
+    return por_item
+
+
+def modo():
+    return getattr(settings, "PRESUPUESTO_CONSULTAS_MODO", "off")
+
+
+class PresupuestoConsultasMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if modo() == "off":
+            return self.get_response(request)
+
+        cuenta = _Cuenta(padre=_cuenta.get())
+        with _contando(cuenta):
+            response = self.get_response(request)
+
+        coincidencia = request.resolver_match
+        if coincidencia is None:
+            return response
+        base = presupuesto_de(coincidencia.func, coincidencia.url_name)
+        if base is None:
+            return response
+        por_item = por_item_de(coincidencia.func)
+
+        def verificar():
+            maximo = base + por_item * cuenta.items
+            if cuenta.consultas > maximo:
+                mensaje = (
+                    f"{request.method} {request.path} ({coincidencia.url_name}): "
+                    f"{cuenta.consultas} consultas, presupuesto {maximo}"
+                )
+                if modo() == "error":
+                    raise PresupuestoExcedido(mensaje)
+                logger.warning(mensaje)
+
+        response["X-Consultas"] = f"{cuenta.consultas}/{base + por_item * cuenta.items}"
+        if response.streaming:
+            response.streaming_content = _contar_streaming(response.streaming_content, cuenta, verificar)
+        else:
+            verificar()
+        return response
+
+
+def _contar_streaming(contenido, cuenta, verificar):
+    """
+    Itera `contenido` contando sus consultas y verifica al final. Cada
+    fragmento se pide dentro de _contando: bajo ASGI cada next() puede correr
+    en otro hilo, con otras conexiones.
+    """
+    iterador = iter(contenido)
+    while True:
+        with _contando(cuenta):
+            try:
+                fragmento = next(iterador)
+            except StopIteration:
+                break
+        yield fragmento
+    verificar()
+
+
+# ------------------------------
+# Tests
+# ------------------------------
+def rutas(patrones=None, prefijo=""):
+    """[(ruta, nombre_url, callback)] de todas las URLs del proyecto (recorre los include)."""
+    if patrones is None:
+        patrones = get_resolver().url_patterns
+    resultado = []
+    for patron in patrones:
+        if isinstance(patron, URLResolver):
+            resultado.extend(rutas(patron.url_patterns, prefijo + str(patron.pattern)))
+        elif isinstance(patron, URLPattern):
+            resultado.append((prefijo + str(patron.pattern), patron.name, patron.callback))
+    return resultado
+
+
+class PresupuestoTestMixin:
+    """
+    Para TestCase: with self.assertPresupuesto("mediciones"): self.client.get(...).
+    Cuenta todos los alias de BD; una respuesta por streaming se consume
+    dentro del bloque (p. ej. b"".join(r.streaming_content)).
+    """
+
+    @contextmanager
+    def assertPresupuesto(self, nombre_url, *args, **kwargs):
+        coincidencia = get_resolver().resolve(reverse(nombre_url, args=args, kwargs=kwargs))
+        base = presupuesto_de(coincidencia.func, nombre_url)
+        self.assertIsNotNone(base, f"{nombre_url} no declara presupuesto de consultas")
+
+        with _contando(_Cuenta(registrar=True)) as cuenta:
+            yield
+        maximo = base + por_item_de(coincidencia.func) * cuenta.items
+        self.assertLessEqual(
+            cuenta.consultas, maximo,
+            f"{nombre_url}: {cuenta.consultas} consultas, presupuesto {maximo}\n"
+            + "\n".join(cuenta.sql),
+        )
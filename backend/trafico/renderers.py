@@ -0,0 +1,37 @@
+# trafico/renderers.py
+"""
+Renderer JSON de DRF sobre orjson (opcional: `pip install orjson`).
+
+orjson serializa en C los dict/list/str/números y, de forma nativa,
+datetime/date/UUID; lo que no conoce (Decimal de velocidad_estimada,
+tipos de numpy, textos perezosos, timedelta...) pasa por el mismo
+JSONEncoder.default de DRF, así que la salida es equivalente a la de
+JSONRenderer. Sin orjson instalado, delega en JSONRenderer.
+
+Diferencia: NaN/Infinity salen como null en vez de lanzar ValueError.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # dependencia opcional
+    orjson = None
+
+_encoder = JSONEncoder()
+
+
+class ORJSONRenderer(JSONRenderer):
+    opciones = 0 if orjson is None else (orjson.OPT_UTC_Z | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b""
+
+        opciones = self.opciones
+        # orjson solo sabe indentar con 2 espacios (?indent= del browsable API / Accept)
+        if self.get_indent(accepted_media_type or "", renderer_context or {}):
+            opciones |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_encoder.default, option=opciones)
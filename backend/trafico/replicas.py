@@ -0,0 +1,129 @@
+# trafico/replicas.py
+"""
+Réplicas de lectura de PostgreSQL.
+
+- EnrutadorReplicas (DATABASE_ROUTERS) manda las lecturas del ORM a una
+  réplica de settings.REPLICAS_BD y las escrituras a "default".
+- Después de la primera escritura de una petición, todo lo que queda de
+  ella (lecturas incluidas) va a la primaria: así no se lee una réplica
+  atrasada justo después de escribir. Lo mismo dentro de un atomic().
+- Cada petición usa una sola réplica (elegida al azar) para ver datos
+  coherentes entre consultas. ReplicasMiddleware delimita la petición e
+  informa el alias usado en la cabecera X-BD.
+- El SQL crudo de solo lectura usa connections[lectura()].
+- Durante REPLICAS_RETRASO_MAX segundos después de invalidar una caché
+  (versiones_cache), la petición que lee la versión de esa caché para
+  reconstruirla sigue en la primaria: no debe guardar en la versión nueva
+  lo que aún muestra una réplica atrasada. Las que dependen de otras
+  cachés no se ven afectadas.
+
+Fuera de una petición (comandos, o el cuerpo de un StreamingHttpResponse
+que se itera después del middleware) no hay estado compartido: todo va a
+la primaria. Un comando de solo lectura puede abrir su propia sesión con
+`with replicas.sesion():`. Las vistas que responden por streaming
+resuelven el alias con lectura() antes de devolver la respuesta y se lo
+pasan al generador.
+"""
+import contextlib
+import contextvars
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class _Estado:
+    def __init__(self, escribio=False):
+        self.escribio = escribio
+        self.primaria = False
+        self.replica = None
+        self.usadas = set()
+
+
+_estado = contextvars.ContextVar("replicas_estado", default=None)
+
+
+def _actual():
+    estado = _estado.get()
+    if estado is None:
+        # Sin sesión: estado descartable (no se guarda en el contexto del hilo)
+        return _Estado(escribio=True)
+    return estado
+
+
+@contextlib.contextmanager
+def sesion():
+    """Delimita una petición (o un comando): una réplica y un solo estado."""
+    estado = _Estado()
+    token = _estado.set(estado)
+    try:
+        yield estado
+    finally:
+        _estado.reset(token)
+
+
+def despues_de_invalidar(momento):
+    """
+    La petición va a reconstruir una caché invalidada en `momento` (epoch):
+    si fue hace menos de REPLICAS_RETRASO_MAX, el resto de sus lecturas va
+    a la primaria.
+    """
+    if time.time() - momento < settings.REPLICAS_RETRASO_MAX:
+        _actual().primaria = True
+
+
+def lectura():
+    """Alias para una lectura en este momento: una réplica o "default"."""
+    replicas = getattr(settings, "REPLICAS_BD", ())
+    estado = _actual()
+    if (
+        not replicas
+        or estado.escribio
+        or estado.primaria
+        or connections[DEFAULT_DB_ALIAS].in_atomic_block
+    ):
+        alias = DEFAULT_DB_ALIAS
+    else:
+        if estado.replica not in replicas:
+            estado.replica = random.choice(replicas)
+        alias = estado.replica
+    estado.usadas.add(alias)
+    return alias
+
+
+def escritura():
+    """Marca la petición como escrita (las lecturas siguientes van a la primaria)."""
+    estado = _actual()
+    estado.escribio = True
+    estado.usadas.add(DEFAULT_DB_ALIAS)
+    return DEFAULT_DB_ALIAS
+
+
+class EnrutadorReplicas:
+    def db_for_read(self, model, **hints):
+        return lectura()
+
+    def db_for_write(self, model, **hints):
+        return escritura()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplicas y primaria tienen los mismos datos
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in getattr(settings, "REPLICAS_BD", ()):
+            return False  # se replican desde la primaria
+        return None
+
+
+class ReplicasMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with sesion() as estado:
+            response = self.get_response(request)
+        if getattr(settings, "REPLICAS_BD", ()) and estado.usadas:
+            response["X-BD"] = ",".join(sorted(estado.usadas))
+        return response
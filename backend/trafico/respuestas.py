@@ -0,0 +1,53 @@
+# trafico/respuestas.py
+"""Respuestas HTTP para payloads JSON precalculados y comprimidos."""
+import gzip
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+from . import compresion
+
+
+def etag_coincide(request, etag):
+    """True si el If-None-Match del cliente incluye el ETag (o es '*')."""
+    cabecera = request.headers.get("If-None-Match")
+    if not cabecera:
+        return False
+    etags = parse_etags(cabecera)
+    # Comparación débil: los proxies pueden agregar W/ al comprimir
+    return "*" in etags or etag.removeprefix("W/") in (e.removeprefix("W/") for e in etags)
+
+
+def no_modificado(request, modificado):
+    """True si no hay If-None-Match y el If-Modified-Since del cliente es >= modificado (epoch)."""
+    if request.headers.get("If-None-Match"):
+        return False
+    desde = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+    return desde is not None and desde >= modificado
+
+
+def acepta_gzip(request):
+    return compresion.acepta(request.headers.get("Accept-Encoding", ""), "gzip")
+
+
+def respuesta_precalculada(request, cuerpo_gzip, etag, content_type="application/json", modificado=None):
+    """
+    Devuelve el blob tal cual si el cliente acepta gzip (sin recomprimir),
+    lo descomprime si no, y responde 304 cuando el ETag coincide (o, sin
+    ETag del cliente, cuando If-Modified-Since >= modificado).
+    """
+    if etag_coincide(request, etag) or (modificado is not None and no_modificado(request, modificado)):
+        respuesta = HttpResponseNotModified()
+    elif acepta_gzip(request):
+        respuesta = HttpResponse(cuerpo_gzip, content_type=content_type)
+        respuesta["Content-Encoding"] = "gzip"
+    else:
+        respuesta = HttpResponse(gzip.decompress(cuerpo_gzip), content_type=content_type)
+
+    respuesta["ETag"] = etag
+    if modificado is not None:
+        respuesta["Last-Modified"] = http_date(modificado)
+    respuesta["Cache-Control"] = "no-cache"  # el navegador revalida siempre con If-None-Match
+    patch_vary_headers(respuesta, ("Accept-Encoding",))
+    return respuesta
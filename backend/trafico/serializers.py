@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Segmento, MedicionTrafico, ParadaBus
+from .models import Segmento, MedicionTrafico, MedicionHoraria, MedicionDiaria, ParadaBus
 
 
 class SegmentoMapSerializer(serializers.ModelSerializer):
@@ -25,14 +25,52 @@ class MedicionStatsSerializer(serializers.ModelSerializer):
     """
     Serializador para GRÁFICOS y ESTADÍSTICAS.
     Muestra los datos puros sin geometría.
+    Recibe diccionarios de .values() con `nombre_tramo` ya anotado desde el
+    JOIN, para no instanciar modelos ni consultar el segmento fila por fila.
     """
-    nombre_tramo = serializers.CharField(source="segmento.nombre", read_only=True)
+    nombre_tramo = serializers.CharField(read_only=True)
 
     class Meta:
         model = MedicionTrafico
         fields = ("id", "fecha_hora", "velocidad_promedio", "nivel_congestion", "nombre_tramo")
 
 
+class ResumenSerializerMixin(serializers.Serializer):
+    """
+    Campos calculados comunes a los resúmenes horario y diario.
+    `distribucion_congestion` es la cantidad de muestras por nivel [1..5].
+    """
+    velocidad_promedio = serializers.FloatField(read_only=True)
+    nivel_congestion_promedio = serializers.FloatField(read_only=True)
+    distribucion_congestion = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+
+    CAMPOS = (
+        "segmento",
+        "muestras",
+        "velocidad_promedio",
+        "velocidad_min",
+        "velocidad_max",
+        "nivel_congestion_promedio",
+        "distribucion_congestion",
+    )
+
+
+class MedicionHorariaSerializer(ResumenSerializerMixin, serializers.ModelSerializer):
+    """Resumen por segmento y hora para los gráficos del dashboard."""
+
+    class Meta:
+        model = MedicionHoraria
+        fields = ("hora",) + ResumenSerializerMixin.CAMPOS
+
+
+class MedicionDiariaSerializer(ResumenSerializerMixin, serializers.ModelSerializer):
+    """Resumen por segmento y día para los gráficos de tendencia."""
+
+    class Meta:
+        model = MedicionDiaria
+        fields = ("fecha",) + ResumenSerializerMixin.CAMPOS
+
+
 class ParadaBusSerializer(serializers.ModelSerializer):
     """
     Serializador para las paradas de bus.
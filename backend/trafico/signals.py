@@ -0,0 +1,45 @@
+# trafico/signals.py
+"""
+Invalidación de cachés derivadas de los datos de tráfico.
+Los bulk_create/QuerySet.delete() no disparan señales: las ingestas
+masivas llaman a las funciones de invalidación explícitamente.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from traffic_predictor.models import PrediccionPorSegmento
+
+from . import cache_http, estadisticas, geojson, map_matching, metadatos, tiles
+from .models import MedicionTrafico, ParadaBus, Segmento
+
+
+@receiver(post_save, sender=MedicionTrafico, dispatch_uid="medicion_invalida_estadisticas")
+def medicion_guardada(sender, instance, **kwargs):
+    # Dentro de estadisticas.carga_masiva() se invalida una sola vez al final
+    estadisticas.medicion_guardada(instance.segmento_id)
+
+
+@receiver(post_save, sender=Segmento, dispatch_uid="segmento_guardado_invalida_mapa")
+@receiver(post_delete, sender=Segmento, dispatch_uid="segmento_borrado_invalida_mapa")
+def segmento_modificado(sender, **kwargs):
+    # El blob del mapa se reconstruye en la próxima petición a /api/segmentos/
+    geojson.invalidar()
+    cache_http.invalidar("segmentos")
+    tiles.invalidar_geometrias()
+    map_matching.invalidar()
+    metadatos.invalidar()
+
+
+@receiver(post_save, sender=ParadaBus, dispatch_uid="parada_guardada_invalida_tiles")
+@receiver(post_delete, sender=ParadaBus, dispatch_uid="parada_borrada_invalida_tiles")
+def parada_modificada(sender, **kwargs):
+    tiles.invalidar_geometrias()
+    cache_http.invalidar("paradas")
+
+
+@receiver(post_save, sender=PrediccionPorSegmento, dispatch_uid="prediccion_guardada_invalida_tiles")
+@receiver(post_delete, sender=PrediccionPorSegmento, dispatch_uid="prediccion_borrada_invalida_tiles")
+def prediccion_modificada(sender, instance, **kwargs):
+    tiles.invalidar_hora(instance.fecha_hora_prediccion)
+    # Solo las respuestas cacheadas de ese segmento
+    cache_http.invalidar("predicciones", parte=str(instance.segmento_id))
@@ -1,3 +1,1361 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import tempfile
+import threading
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+from django.contrib.auth import get_user_model
+from django.contrib.gis.geos import LineString, Point
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.decorators import api_view
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from traffic_predictor.predict import regresores_segmento
+
+from .management.commands import particionar_mediciones, prueba_carga
+from .agregados import actualizar_resumenes, descontar, marca_actual
+from .models import Segmento, MedicionDiaria, MedicionHoraria, MedicionTrafico, ParadaBus
+from . import (
+    benchmarks, cache_http, compresion, estadisticas, exportar, geojson, limites, mapbox, matriz_local,
+    metadatos, paradas, perfilado, presupuestos, replicas, tiles,
+)
+from .serializers import ParadaBusSerializer, SegmentoMapSerializer
+from .replicas import EnrutadorReplicas, ReplicasMiddleware
+from .respuestas import respuesta_precalculada
+from .versiones_cache import obtener_version
+from .presupuestos import (
+    PresupuestoConsultasMiddleware, PresupuestoExcedido, PresupuestoTestMixin,
+    presupuesto_consultas, presupuesto_de, rutas,
+)
+
+
+class MedicionListTests(TestCase):
+    """
+    /trafico/mediciones/: una consulta por página (sin N+1 ni COUNT) y
+    paginación keyset estable aunque varias filas compartan fecha_hora.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        linea = LineString((-89.29, 13.676), (-89.30, 13.68), srid=4326)
+        segmentos = [
+            Segmento.objects.create(segmento_id=i, nombre=f"Tramo {i}", geometria=linea)
+            for i in (1, 2)
+        ]
+        cls.inicio = timezone.now().replace(microsecond=0) - timedelta(days=1)
+
+        # Tres mediciones por minuto para forzar empates en fecha_hora
+        MedicionTrafico.objects.bulk_create([
+            MedicionTrafico(
+                segmento=segmentos[i % 2],
+                fecha_hora=cls.inicio + timedelta(minutes=i // 3),
+                velocidad_promedio=30,
+                nivel_congestion=3,
+            )
+            for i in range(250)
+        ])
+
+    def test_una_consulta_por_pagina(self):
+        with self.assertNumQueries(1):
+            primera = self.client.get(reverse("mediciones"), {"page_size": 50})
+        self.assertEqual(len(primera.data["results"]), 50)
+        self.assertIn(primera.data["results"][0]["nombre_tramo"], ("Tramo 1", "Tramo 2"))
+
+        # Una página profunda cuesta lo mismo que la primera
+        url = primera.data["next"]
+        for _ in range(3):
+            url = self.client.get(url).data["next"]
+        with self.assertNumQueries(1):
+            profunda = self.client.get(url)
+        self.assertEqual(len(profunda.data["results"]), 50)
+
+    def test_recorre_todo_sin_repetir(self):
+        vistos = []
+        url = reverse("mediciones") + "?page_size=40"
+        while url:
+            data = self.client.get(url).data
+            vistos.extend((m["fecha_hora"], m["id"]) for m in data["results"])
+            url = data["next"]
+
+        self.assertEqual(len(vistos), 250)
+        self.assertEqual(len({pk for _, pk in vistos}), 250)
+        self.assertEqual(vistos, sorted(vistos, reverse=True))
+
+    def test_filtro_por_segmento_y_rango(self):
+        desde = self.inicio + timedelta(minutes=10)
+        hasta = self.inicio + timedelta(minutes=20)
+        respuesta = self.client.get(reverse("mediciones"), {
+            "segmento": 1,
+            "desde": desde.isoformat(),
+            "hasta": hasta.isoformat(),
+        })
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.data["results"])
+        self.assertTrue(all(m["nombre_tramo"] == "Tramo 1" for m in respuesta.data["results"]))
+
+    def test_cursor_invalido(self):
+        respuesta = self.client.get(reverse("mediciones"), {"cursor": "no-es-un-cursor"})
+        self.assertEqual(respuesta.status_code, 404)
+
+    def test_respuesta_comprimida_segun_accept_encoding(self):
+        plana = self.client.get(reverse("mediciones"), {"page_size": 200})
+        comprimida = self.client.get(reverse("mediciones"), {"page_size": 200}, HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertNotIn("Content-Encoding", plana)
+        self.assertEqual(comprimida["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", comprimida["Vary"])
+        self.assertLess(len(comprimida.content), len(plana.content))
+        self.assertEqual(json.loads(gzip.decompress(comprimida.content)), plana.json())
+
+
+def _duracion(lng_a, lng_b):
+    return round(abs(lng_a - lng_b) * 1e4, 1)
+
+
+class _MapboxFalso(BaseHTTPRequestHandler):
+    """Servidor local que imita la Matrix API y cuenta las llamadas."""
+    llamadas = 0
+    fallar = False
+    limitar = False
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        type(self).llamadas += 1
+        if self.fallar:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.limitar:
+            self.send_response(429)
+            self.send_header("Retry-After", "3600")
+            self.end_headers()
+            return
+        ruta, _, consulta = self.path.partition("?")
+        lngs = [float(c.split(",")[0]) for c in ruta.rsplit("/", 1)[1].split(";")]
+        params = dict(p.split("=", 1) for p in consulta.split("&"))
+        todos = ";".join(map(str, range(len(lngs))))
+        sources = [int(i) for i in params.get("sources", todos).split(";")]
+        destinations = [int(i) for i in params.get("destinations", todos).split(";")]
+        cuerpo = json.dumps({
+            "code": "Ok",
+            "durations": [[_duracion(lngs[i], lngs[j]) for j in destinations] for i in sources],
+            "distances": [[1000 * _duracion(lngs[i], lngs[j]) for j in destinations] for i in sources],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+
+class MatrixProxyTests(TestCase):
+    """
+    /trafico/matrix/ contra un servidor local: caché por coordenadas,
+    respuesta stale cuando Mapbox falla y matrices partidas en bloques.
+    """
+    coordenadas = [{"lat": 13.676, "lng": -89.29}, {"lat": 13.680, "lng": -89.300}]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor = ThreadingHTTPServer(("127.0.0.1", 0), _MapboxFalso)
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+        cls.ajustes = override_settings(
+            MAPBOX_API_URL=f"http://127.0.0.1:{cls.servidor.server_port}",
+            MAPBOX_ACCESS_TOKEN="token-de-prueba",
+        )
+        cls.ajustes.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ajustes.disable()
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        mapbox.interruptor.exito()
+        _MapboxFalso.llamadas = 0
+        _MapboxFalso.fallar = False
+        _MapboxFalso.limitar = False
+
+    def pedir(self, coordenadas=None):
+        return self.client.post(
+            reverse("matrix_api"),
+            {"coordinates": coordenadas or self.coordenadas},
+            content_type="application/json",
+        )
+
+    def test_segunda_peticion_sale_de_cache(self):
+        primera = self.pedir()
+        segunda = self.pedir()
+
+        self.assertEqual(primera.status_code, 200)
+        self.assertEqual(primera["X-Cache"], "MISS")
+        self.assertEqual(segunda["X-Cache"], "HIT")
+        self.assertEqual(segunda.json()["durations"], [[0.0, 100.0], [100.0, 0.0]])
+        self.assertEqual(_MapboxFalso.llamadas, 1)
+
+    def test_sirve_stale_si_mapbox_falla(self):
+        self.pedir()
+        _MapboxFalso.fallar = True
+
+        # En otra cubeta de tiempo ya no hay copia fresca, solo la stale
+        with mock.patch.object(mapbox, "CUBETA_SEGUNDOS", 1):
+            respuesta = self.pedir()
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta["X-Cache"], "STALE")
+
+    def test_sin_copia_previa_responde_503(self):
+        _MapboxFalso.fallar = True
+        respuesta = self.pedir()
+        self.assertEqual(respuesta.status_code, 503)
+
+    def test_429_no_se_reintenta_ni_abre_el_circuito(self):
+        _MapboxFalso.limitar = True
+        for _ in range(mapbox.interruptor.fallos_max + 1):
+            respuesta = self.pedir()
+            self.assertEqual(respuesta.status_code, 429)
+            self.assertEqual(respuesta["Retry-After"], str(mapbox.ESPERA_429_MAX))
+
+        self.assertEqual(_MapboxFalso.llamadas, mapbox.interruptor.fallos_max + 1)
+        self.assertFalse(mapbox.interruptor.abierto)
+
+    def test_429_sirve_stale(self):
+        self.pedir()
+        _MapboxFalso.limitar = True
+        with mock.patch.object(mapbox, "CUBETA_SEGUNDOS", 1):
+            respuesta = self.pedir()
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta["X-Cache"], "STALE")
+
+    def test_bloques_acotados_por_perfil(self):
+        self.assertEqual(mapbox.max_coordenadas("mapbox/driving-traffic"), 25)
+        self.assertEqual(mapbox.max_coordenadas("mapbox/driving"), 60)
+
+        coordenadas = [{"lat": 13.7, "lng": -89.2 - i / 100} for i in range(26)]
+        respuesta = self.pedir(coordenadas)
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(_MapboxFalso.llamadas, 0)
+
+    def test_matriz_grande_por_bloques(self):
+        # 12 puntos con driving-traffic (límite 10): trozos de 5 -> 3 x 3 bloques
+        coordenadas = [{"lat": 13.7, "lng": -89.2 - i / 100} for i in range(12)]
+        respuesta = self.pedir(coordenadas)
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()["bloques"], 9)
+        self.assertEqual(_MapboxFalso.llamadas, 9)
+        esperada = [[_duracion(a["lng"], b["lng"]) for b in coordenadas] for a in coordenadas]
+        self.assertEqual(respuesta.json()["durations"], esperada)
+
+        # Los primeros 5 puntos son un bloque de la diagonal: salen de la caché
+        subconjunto = self.pedir(coordenadas[:5])
+        self.assertEqual(subconjunto["X-Cache"], "HIT")
+        self.assertEqual(_MapboxFalso.llamadas, 9)
+
+    def test_server_timing_y_metrics(self):
+        respuesta = self.pedir()
+        self.assertIn("matriz_mapbox;dur=", respuesta["Server-Timing"])
+        self.assertIn("total;dur=", respuesta["Server-Timing"])
+
+        metricas = self.client.get(reverse("metrics"))
+        self.assertEqual(metricas.status_code, 200)
+        texto = metricas.content.decode()
+        self.assertIn('trafico_etapa_segundos_count{etapa="matriz_mapbox"}', texto)
+        self.assertIn('trafico_cache_total{cache="mapbox",resultado="miss"}', texto)
+
+    def test_server_timing_incluye_los_bloques_en_paralelo(self):
+        coordenadas = [{"lat": 13.7, "lng": -89.2 - i / 100} for i in range(12)]
+        respuesta = self.pedir(coordenadas)
+        self.assertEqual(respuesta.json()["bloques"], 9)
+        self.assertIn("mapbox_api;dur=", respuesta["Server-Timing"])
+
+    @override_settings(METRICS_IPS=["10.0.0.0/8"], METRICS_TOKEN="token-metricas")
+    def test_metrics_restringido(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        self.assertEqual(self.client.get(reverse("metrics"), REMOTE_ADDR="10.1.2.3").status_code, 200)
+        self.assertEqual(
+            self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer token-metricas").status_code, 200
+        )
+        self.assertEqual(self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer otro").status_code, 403)
+
+
+class PerfiladoTests(TestCase):
+    """Perfilado bajo demanda: solo staff con la cabecera, visible en el admin."""
+
+    def setUp(self):
+        ajustes = override_settings(PERFILADO_DIR=tempfile.mkdtemp(), PERFILADO_MUESTREO=0.0)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def test_staff_con_cabecera_genera_perfil(self):
+        staff = get_user_model().objects.create_user("admin", password="x", is_staff=True)
+        self.client.force_login(staff)
+
+        respuesta = self.client.get(reverse("mediciones"), HTTP_X_PERFILAR="1")
+        self.assertIn("X-Perfil", respuesta)
+
+        lista = self.client.get(reverse("perfiles_lista"))
+        self.assertContains(lista, "/trafico/mediciones/")
+        detalle = self.client.get(reverse("perfil_detalle", args=[respuesta["X-Perfil"]]))
+        self.assertContains(detalle, "Consultas SQL")
+
+    def test_sin_staff_no_se_perfila(self):
+        usuario = get_user_model().objects.create_user("comun", password="x")
+        self.client.force_login(usuario)
+
+        respuesta = self.client.get(reverse("mediciones"), HTTP_X_PERFILAR="1")
+        self.assertNotIn("X-Perfil", respuesta)
+
+    def test_streaming_se_perfila_al_iterar(self):
+        staff = get_user_model().objects.create_user("admin", password="x", is_staff=True)
+        self.client.force_login(staff)
+        cache.clear()
+
+        respuesta = self.client.get(reverse("paradas_todos_segmentos"), HTTP_X_PERFILAR="1")
+        self.assertTrue(respuesta.streaming)
+        # La consulta de las paradas corre al iterar: el perfil se guarda al cerrar
+        self.assertIsNone(perfilado.obtener(respuesta["X-Perfil"]))
+        b"".join(respuesta.streaming_content)
+
+        datos = perfilado.obtener(respuesta["X-Perfil"])
+        self.assertTrue(datos["streaming"])
+        self.assertTrue(datos["completo"])
+        self.assertTrue(any("trafico_paradabus" in c["sql"] for c in datos["consultas"]))
+
+
+class PresupuestoConsultasTests(PresupuestoTestMixin, TestCase):
+    """Cada vista declara su presupuesto de consultas y lo respeta."""
+
+    @classmethod
+    def setUpTestData(cls):
+        linea = LineString((-89.29, 13.676), (-89.30, 13.68), srid=4326)
+        for i in (1, 2, 3):
+            Segmento.objects.create(segmento_id=i, nombre=f"Tramo {i}", geometria=linea)
+
+    def test_todas_las_rutas_declaran_presupuesto(self):
+        sin_presupuesto = [
+            ruta for ruta, nombre, callback in rutas()
+            # El admin y la documentación Swagger quedan fuera
+            if not ruta.startswith("admin/") and not (nombre or "").startswith("schema-")
+            and presupuesto_de(callback, nombre) is None
+        ]
+        self.assertEqual(sin_presupuesto, [])
+
+    def test_vistas_dentro_del_presupuesto(self):
+        with self.assertPresupuesto("segmentos"):
+            self.client.get(reverse("segmentos"))
+        with self.assertPresupuesto("mediciones"):
+            self.client.get(reverse("mediciones"))
+        with self.assertPresupuesto("paradas_por_segmentos_lote"):
+            self.client.get(reverse("paradas_por_segmentos_lote"), {"ids": "1,2,3"})
+
+    @override_settings(PRESUPUESTO_CONSULTAS_MODO="error", PRESUPUESTOS_CONSULTAS={"mediciones": 0})
+    def test_modo_error_al_exceder(self):
+        with self.assertRaises(PresupuestoExcedido):
+            self.client.get(reverse("mediciones"))
+
+    @override_settings(PRESUPUESTO_CONSULTAS_MODO="log")
+    def test_cabecera_x_consultas(self):
+        respuesta = self.client.get(reverse("mediciones"))
+        self.assertEqual(respuesta["X-Consultas"], "1/2")
+
+    @override_settings(PRESUPUESTO_CONSULTAS_MODO="error", PRESUPUESTOS_CONSULTAS={"paradas_todos_segmentos": 0})
+    def test_streaming_cuenta_al_iterar(self):
+        cache.clear()
+        respuesta = self.client.get(reverse("paradas_todos_segmentos"))
+        self.assertTrue(respuesta.streaming)
+        # La consulta corre al iterar, después de salir de la vista
+        with self.assertRaises(PresupuestoExcedido):
+            b"".join(respuesta.streaming_content)
+
+    @override_settings(PRESUPUESTO_CONSULTAS_MODO="error")
+    def test_por_item_amplia_el_presupuesto(self):
+        @presupuesto_consultas(1, por_item=2)
+        def vista(request):
+            presupuestos.items(2)
+            for _ in range(5):
+                list(Segmento.objects.all())
+            return HttpResponse()
+
+        def resolver(request):
+            request.resolver_match = SimpleNamespace(func=vista, url_name="prueba")
+            return vista(request)
+
+        respuesta = PresupuestoConsultasMiddleware(resolver)(RequestFactory().get("/"))
+        self.assertEqual(respuesta["X-Consultas"], "5/5")
+
+    def test_assert_presupuesto_falla_al_exceder(self):
+        with self.assertRaises(AssertionError):
+            with self.assertPresupuesto("segmentos"):
+                for _ in range(3):
+                    list(Segmento.objects.using("default").all())
+
+
+class ArranqueTests(TestCase):
+    """Cargar las URLs y atender una petición no importa pandas, numpy, Prophet..."""
+
+    def test_sin_librerias_pesadas_al_arrancar(self):
+        resultado = benchmarks.arrancar("/metrics")
+        self.assertEqual(resultado["pesados"], [])
+
+
+class CacheHttpTests(TestCase):
+    """Paradas: HIT desde la caché, 304 con el ETag y nueva respuesta al cambiar una parada."""
+
+    @classmethod
+    def setUpTestData(cls):
+        linea = LineString((-89.29, 13.676), (-89.30, 13.68), srid=4326)
+        cls.segmento = Segmento.objects.create(segmento_id=1, nombre="Tramo 1", geometria=linea)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cache_etag_e_invalidacion(self):
+        url = reverse("paradas_por_segmento", args=[1])
+        primera = self.client.get(url)
+        self.assertEqual(primera["X-Cache"], "MISS")
+        self.assertIn("Last-Modified", primera)
+
+        with self.assertNumQueries(0):
+            segunda = self.client.get(url)
+        self.assertEqual(segunda["X-Cache"], "HIT")
+        self.assertEqual(segunda.json(), primera.json())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=primera["ETag"]).status_code, 304)
+
+        # post_save de ParadaBus invalida las respuestas de paradas
+        ParadaBus.objects.create(
+            segmento=self.segmento, osm_id="n1", nombre="Parada", geom=Point(-89.295, 13.678, srid=4326)
+        )
+        tercera = self.client.get(url, HTTP_IF_NONE_MATCH=primera["ETag"])
+        self.assertEqual(tercera.status_code, 200)
+        self.assertEqual(tercera["X-Cache"], "MISS")
+        self.assertEqual(len(tercera.json()), 1)
+
+    def test_invalidacion_por_parte(self):
+        estado = {"invalidar": False, "llamadas": 0}
+
+        @api_view(["GET"])
+        @cache_http.cachear("prueba", grupos=("predicciones",), parte=lambda request: request.GET["segmento"])
+        def vista(request):
+            estado["llamadas"] += 1
+            if estado["invalidar"]:
+                cache_http.invalidar("predicciones", parte=request.GET["segmento"])
+            return Response({"segmento": request.GET["segmento"]})
+
+        fabrica = RequestFactory()
+
+        def pedir(segmento):
+            return vista(fabrica.get("/prueba/", {"segmento": segmento}))["X-Cache"]
+
+        self.assertEqual([pedir("1"), pedir("2"), pedir("1")], ["MISS", "MISS", "HIT"])
+
+        # Invalidar el segmento 2 no toca las respuestas del 1
+        cache_http.invalidar("predicciones", parte="2")
+        self.assertEqual([pedir("1"), pedir("2")], ["HIT", "MISS"])
+
+        # Si la propia vista invalida sus datos, la respuesta no se guarda
+        estado["invalidar"] = True
+        self.assertEqual(pedir("3"), "MISS")
+        estado["invalidar"] = False
+        self.assertEqual([pedir("3"), pedir("3")], ["MISS", "HIT"])
+        self.assertEqual(estado["llamadas"], 5)
+
+
+@override_settings(REPLICAS_BD=["replica1", "replica2"])
+class ReplicasTests(SimpleTestCase):
+    """Lecturas a una réplica por petición; después de escribir, todo a la primaria."""
+
+    def setUp(self):
+        cache.clear()
+
+    def peticion(self, vista):
+        return ReplicasMiddleware(vista)(RequestFactory().get("/"))
+
+    def test_lecturas_a_replica_y_escrituras_a_primaria(self):
+        enrutador = EnrutadorReplicas()
+        alias = {}
+
+        def vista(request):
+            alias["lecturas"] = {enrutador.db_for_read(Segmento) for _ in range(10)}
+            alias["escritura"] = enrutador.db_for_write(MedicionTrafico)
+            alias["despues"] = enrutador.db_for_read(Segmento)
+            return HttpResponse()
+
+        respuesta = self.peticion(vista)
+        self.assertEqual(len(alias["lecturas"]), 1)  # siempre la misma réplica
+        self.assertIn(alias["lecturas"].pop(), ("replica1", "replica2"))
+        self.assertEqual(alias["escritura"], "default")
+        self.assertEqual(alias["despues"], "default")
+        self.assertIn("default", respuesta["X-BD"].split(","))
+
+        # La petición siguiente vuelve a leer de una réplica
+        def solo_lectura(request):
+            alias["siguiente"] = enrutador.db_for_read(Segmento)
+            return HttpResponse()
+
+        self.peticion(solo_lectura)
+        self.assertIn(alias["siguiente"], ("replica1", "replica2"))
+
+    @override_settings(REPLICAS_RETRASO_MAX=60)
+    def test_primaria_despues_de_invalidar(self):
+        enrutador = EnrutadorReplicas()
+        alias = []
+
+        def vista_de(grupo):
+            def vista(request):
+                # Como cachear(): lee la versión del grupo antes de consultar
+                obtener_version(f"cache_http:{grupo}:version")
+                alias.append(enrutador.db_for_read(Segmento))
+                return HttpResponse()
+            return vista
+
+        self.peticion(vista_de("segmentos"))
+        # La petición que reconstruye la caché invalidada no lee de una réplica atrasada...
+        cache_http.invalidar("segmentos")
+        self.peticion(vista_de("segmentos"))
+        # ...pero las que dependen de otro grupo siguen en las réplicas
+        self.peticion(vista_de("paradas"))
+        self.assertIn(alias[0], ("replica1", "replica2"))
+        self.assertEqual(alias[1], "default")
+        self.assertIn(alias[2], ("replica1", "replica2"))
+
+        with override_settings(REPLICAS_RETRASO_MAX=0):
+            self.peticion(vista_de("segmentos"))
+        self.assertIn(alias[3], ("replica1", "replica2"))
+
+    def test_sin_sesion_no_guarda_estado(self):
+        enrutador = EnrutadorReplicas()
+
+        def cuerpo():
+            yield enrutador.db_for_read(Segmento).encode()
+
+        def vista(request):
+            return StreamingHttpResponse(cuerpo())
+
+        # El cuerpo del streaming se itera después del middleware: sin sesión
+        # va a la primaria y no deja estado en el contexto del hilo
+        respuesta = self.peticion(vista)
+        self.assertEqual(b"".join(respuesta.streaming_content), b"default")
+        self.assertIsNone(replicas._estado.get())
+
+        with replicas.sesion():
+            self.assertIn(enrutador.db_for_read(Segmento), ("replica1", "replica2"))
+        self.assertIsNone(replicas._estado.get())
+
+    def test_no_migra_en_replicas(self):
+        enrutador = EnrutadorReplicas()
+        self.assertFalse(enrutador.allow_migrate("replica1", "trafico"))
+        self.assertIsNone(enrutador.allow_migrate("default", "trafico"))
+
+
+class LimitesTests(TestCase):
+    """Cubeta de tokens por cliente (429 + Retry-After) y turnos de cómputo."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cubeta_vacia_responde_429(self):
+        with mock.patch.object(limites.MatrizThrottle, "THROTTLE_RATES", {"matriz": "2/min"}):
+            # Coordenadas inválidas: 400 sin llamar a Mapbox, pero gastan token
+            estados = [
+                self.client.post(reverse("matrix_api"), {"coordinates": []}, content_type="application/json")
+                for _ in range(3)
+            ]
+
+        self.assertEqual([r.status_code for r in estados[:2]], [400, 400])
+        self.assertEqual(estados[2].status_code, 429)
+        self.assertGreaterEqual(int(estados[2]["Retry-After"]), 1)
+
+    @override_settings(LIMITE_COMPUTOS=1, COLA_COMPUTOS_SEGUNDOS=0.1)
+    def test_sin_turno_libre_lanza_saturado(self):
+        with limites.computo():
+            with self.assertRaises(limites.Saturado):
+                with limites.computo():
+                    pass
+
+        # Al terminar se libera el turno
+        with limites.computo():
+            pass
+
+
+class IngestaGpsTests(TestCase):
+    """/trafico/gps/: requiere usuario y no duplica mediciones al reenviar pings."""
+
+    # Dos pings sobre el tramo, en la misma cubeta de 15 minutos
+    pings = [
+        {"vehiculo_id": "bus-1", "fecha_hora": "2025-11-06T07:00:10Z", "lat": 13.6764, "lon": -89.291, "velocidad": 20},
+        {"vehiculo_id": "bus-1", "fecha_hora": "2025-11-06T07:00:40Z", "lat": 13.6768, "lon": -89.292, "velocidad": 40},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        linea = LineString((-89.29, 13.676), (-89.30, 13.68), srid=4326)
+        Segmento.objects.create(segmento_id=1, nombre="Tramo 1", geometria=linea)
+        cls.usuario = get_user_model().objects.create_user("gps", password="x")
+
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(self.usuario)
+
+    def enviar(self, pings, url=None):
+        return self.api.post(url or reverse("ingesta_gps"), {"pings": pings}, format="json")
+
+    def test_requiere_autenticacion(self):
+        respuesta = APIClient().post(reverse("ingesta_gps"), {"pings": self.pings}, format="json")
+        self.assertEqual(respuesta.status_code, 401)
+        self.assertFalse(MedicionTrafico.objects.exists())
+
+    def test_guardar_false_no_escribe(self):
+        respuesta = self.enviar(self.pings, url=reverse("ingesta_gps") + "?guardar=false")
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(len(respuesta.json()["mediciones"]), 1)
+        self.assertFalse(MedicionTrafico.objects.exists())
+
+    def test_reenvio_y_cubeta_partida_se_combinan(self):
+        # La cubeta llega en dos envíos y después se reenvía el lote completo
+        self.assertEqual(self.enviar(self.pings[:1]).status_code, 201)
+        self.assertEqual(self.enviar(self.pings[1:]).status_code, 201)
+        self.assertEqual(self.enviar(self.pings).status_code, 201)
+
+        medicion = MedicionTrafico.objects.get()
+        self.assertEqual(float(medicion.velocidad_promedio), 30.0)
+        self.assertEqual(medicion.muestras, 4)
+
+        # El resumen pesa la fila por sus muestras, una sola vez
+        horaria = MedicionHoraria.objects.get()
+        self.assertEqual(horaria.muestras, 4)
+        self.assertEqual(float(horaria.suma_velocidad), 120.0)
+        self.assertEqual(horaria.velocidad_promedio, 30.0)
+        self.assertEqual(sum(horaria.distribucion_congestion), 4)
+
+    def test_benchmark_con_n_no_multiplo(self):
+        # 100 pings: el último vehículo sintético queda incompleto
+        salida = io.StringIO()
+        call_command("emparejar_gps", benchmark=100, stdout=salida)
+        self.assertIn("100 pings en", salida.getvalue())
+        self.assertFalse(MedicionTrafico.objects.exists())
+
+
+class _OverpassFalso(BaseHTTPRequestHandler):
+    """Servidor local que imita Overpass: responde las paradas de `elementos`."""
+    llamadas = 0
+    elementos = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        type(self).llamadas += 1
+        self.rfile.read(int(self.headers["Content-Length"]))
+        cuerpo = json.dumps({"elements": self.elementos}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+
+class CargarParadasTests(TestCase):
+    """cargar_paradas contra un Overpass local: la caché en disco no oculta paradas nuevas."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor = ThreadingHTTPServer(("127.0.0.1", 0), _OverpassFalso)
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.servidor.server_port}/api/interpreter"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        linea = LineString((-89.29, 13.676), (-89.30, 13.68), srid=4326)
+        Segmento.objects.create(segmento_id=1, nombre="Tramo 1", geometria=linea)
+
+    def setUp(self):
+        cache.clear()
+        _OverpassFalso.llamadas = 0
+        _OverpassFalso.elementos = [{"id": 1, "lat": 13.6764, "lon": -89.291, "tags": {"name": "Parada 1"}}]
+        self.directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directorio.cleanup)
+
+    def cargar(self, **opciones):
+        call_command(
+            "cargar_paradas", overpass_url=self.url, cache_dir=self.directorio.name, stdout=io.StringIO(), **opciones
+        )
+
+    def test_cada_carga_consulta_overpass(self):
+        self.cargar()
+        _OverpassFalso.elementos.append({"id": 2, "lat": 13.6768, "lon": -89.292, "tags": {}})
+        self.cargar()
+
+        self.assertEqual(_OverpassFalso.llamadas, 2)
+        self.assertEqual(sorted(ParadaBus.objects.values_list("osm_id", flat=True)), ["1", "2"])
+
+    def test_offline_y_usar_cache_no_salen_a_la_red(self):
+        self.cargar()
+        self.cargar(offline=True)
+        self.cargar(usar_cache=24.0)
+
+        self.assertEqual(_OverpassFalso.llamadas, 1)
+        self.assertEqual(ParadaBus.objects.count(), 1)
+
+
+class TilesCacheTests(SimpleTestCase):
+    """Caché en disco de los vector tiles con varios workers escribiendo a la vez."""
+
+    def setUp(self):
+        cache.clear()
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = override_settings(TILES_CACHE_DIR=directorio.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.base = Path(directorio.name)
+
+    def test_limpieza_solo_borra_versiones_anteriores(self):
+        hora = f"{tiles.hora_actual():%Y%m%d%H}"
+        for version in ("v1.1", "v1.2", "v1.4", "v2.3"):
+            (self.base / f"{hora}-{version}").mkdir()
+
+        # Un worker con la versión 1.2 no borra las posteriores de otros workers
+        tiles._limpiar_obsoletos(self.base / f"{hora}-v1.2")
+        self.assertEqual(
+            sorted(d.name for d in self.base.iterdir()),
+            [f"{hora}-v1.2", f"{hora}-v1.4", f"{hora}-v2.3"],
+        )
+
+    def test_directorio_borrado_al_escribir(self):
+        with mock.patch.object(tiles, "generar_tile", return_value=b"mvt"), \
+                mock.patch.object(tiles.tempfile, "mkstemp", side_effect=FileNotFoundError):
+            self.assertEqual(tiles.obtener_tile(10, 1, 1), b"mvt")
+
+    def test_hora_con_offset_usa_la_hora_utc(self):
+        # 10:45 en +05:30 son las 05:15 UTC: la hora es la de las 05 UTC, no 10:00+05:30 (04:30 UTC)
+        india = datetime(2025, 11, 6, 10, 45, tzinfo=dt_timezone(timedelta(hours=5, minutes=30)))
+        utc = datetime(2025, 11, 6, 5, 0, tzinfo=dt_timezone.utc)
+        self.assertEqual(tiles.truncar_hora(india), utc)
+
+        tiles.invalidar_hora(india)
+        self.assertEqual(tiles.version_hora(utc), 2)
+        self.assertEqual(tiles._directorio_hora(india), tiles._directorio_hora(utc))
+        self.assertTrue(tiles._directorio_hora(india).name.startswith("2025110605-"))
+
+
+class EstadisticasInvalidacionTests(TestCase):
+    """Una carga fila a fila invalida las estadísticas una vez, no por cada medición."""
+
+    @classmethod
+    def setUpTestData(cls):
+        linea = LineString((-89.29, 13.676), (-89.30, 13.68), srid=4326)
+        cls.segmento = Segmento.objects.create(segmento_id=1, nombre="Tramo 1", geometria=linea)
+
+    def guardar(self):
+        MedicionTrafico.objects.create(
+            segmento=self.segmento, fecha_hora=timezone.now(), velocidad_promedio=30, nivel_congestion=3
+        )
+
+    def test_carga_masiva(self):
+        with mock.patch.object(estadisticas, "invalidar_estadisticas") as invalidar:
+            with estadisticas.carga_masiva():
+                for _ in range(3):
+                    self.guardar()
+                invalidar.assert_not_called()
+            invalidar.assert_called_once_with({1})
+
+            # Fuera de una carga, cada medición invalida su segmento
+            self.guardar()
+            invalidar.assert_called_with([1])
+
+
+class RespuestaPrecalculadaTests(SimpleTestCase):
+    """El blob gzip solo se entrega tal cual si Accept-Encoding acepta gzip (q > 0)."""
+
+    def test_negociacion_gzip(self):
+        cuerpo = gzip.compress(b'{"a": 1}')
+        fabrica = RequestFactory()
+        casos = (("gzip", "gzip"), ("*", "gzip"), ("br, gzip;q=0", None), ("x-gzip", None), ("", None))
+        for cabecera, esperado in casos:
+            with self.subTest(cabecera=cabecera):
+                respuesta = respuesta_precalculada(fabrica.get("/", HTTP_ACCEPT_ENCODING=cabecera), cuerpo, '"v1"')
+                self.assertEqual(respuesta.get("Content-Encoding"), esperado)
+                if esperado is None:
+                    self.assertEqual(respuesta.content, b'{"a": 1}')
+
+
+class ResumenesTests(TestCase):
+    """Resúmenes incrementales por marca de agua y depuración de mediciones crudas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        linea = LineString((-89.29, 13.676), (-89.30, 13.68), srid=4326)
+        cls.segmento = Segmento.objects.create(segmento_id=1, nombre="Tramo 1", geometria=linea)
+
+    def medir(self, fecha_hora, velocidad, nivel=3, muestras=1):
+        # bulk_create: sin señales, como las ingestas masivas
+        return MedicionTrafico.objects.bulk_create([MedicionTrafico(
+            segmento=self.segmento, fecha_hora=fecha_hora, velocidad_promedio=velocidad,
+            nivel_congestion=nivel, muestras=muestras,
+        )])[0]
+
+    def test_resumen_incremental(self):
+        hora = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+        self.medir(hora, 20, nivel=4)
+        self.medir(hora + timedelta(minutes=15), 40, nivel=2)
+
+        self.assertEqual(actualizar_resumenes(), (2, {1}))
+        horaria = MedicionHoraria.objects.get()
+        self.assertEqual((horaria.muestras, horaria.velocidad_promedio), (2, 30.0))
+        self.assertEqual(horaria.distribucion_congestion, [0, 1, 0, 1, 0])
+        self.assertEqual(MedicionDiaria.objects.get().muestras, 2)
+
+        # Sin filas nuevas no hay nada que procesar; una nueva se suma a lo ya agregado
+        self.assertEqual(actualizar_resumenes(), (0, set()))
+        self.medir(hora + timedelta(minutes=30), 60, nivel=1)
+        self.assertEqual(actualizar_resumenes(), (1, {1}))
+        horaria.refresh_from_db()
+        self.assertEqual((horaria.muestras, horaria.velocidad_promedio), (3, 40.0))
+        self.assertEqual((float(horaria.velocidad_min), float(horaria.velocidad_max)), (20.0, 60.0))
+
+    def test_resumen_ponderado_por_muestras(self):
+        hora = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+        self.medir(hora, 20, nivel=4, muestras=3)  # fila de la ingesta GPS con 3 pings
+        self.medir(hora + timedelta(minutes=15), 60, nivel=2)
+
+        self.assertEqual(actualizar_resumenes(), (2, {1}))
+        horaria = MedicionHoraria.objects.get()
+        self.assertEqual((horaria.muestras, horaria.velocidad_promedio), (4, 30.0))
+        self.assertEqual(horaria.nivel_congestion_promedio, 3.5)
+        self.assertEqual(horaria.distribucion_congestion, [0, 1, 0, 3, 0])
+
+        # Descontar resta lo mismo que se sumó
+        descontar(MedicionTrafico.objects.filter(muestras=3))
+        horaria.refresh_from_db()
+        self.assertEqual((horaria.muestras, horaria.velocidad_promedio), (1, 60.0))
+        self.assertEqual(horaria.distribucion_congestion, [0, 1, 0, 0, 0])
+
+    def test_depuracion_respeta_la_marca_de_agua(self):
+        vieja = timezone.now() - timedelta(days=100)
+        resumida = self.medir(vieja, 30)
+        actualizar_resumenes()
+        pendiente = self.medir(vieja + timedelta(minutes=1), 30)
+        self.assertLess(marca_actual(), pendiente.id)
+
+        # Aunque la actualización previa no avance la marca, la fila pendiente no se borra
+        with mock.patch(
+            "trafico.management.commands.depurar_mediciones.actualizar_resumenes", return_value=(0, set())
+        ):
+            call_command("depurar_mediciones", dias=90, stdout=io.StringIO())
+
+        self.assertEqual(list(MedicionTrafico.objects.values_list("id", flat=True)), [pendiente.id])
+        self.assertFalse(MedicionTrafico.objects.filter(id=resumida.id).exists())
+        # El historial de la fila borrada sigue en el resumen horario
+        self.assertEqual(MedicionHoraria.objects.get().muestras, 1)
+
+    def test_depuracion_resume_y_conserva_las_recientes(self):
+        vieja = (timezone.now() - timedelta(days=100)).replace(minute=0, second=0, microsecond=0)
+        self.medir(vieja, 20, muestras=1)
+        self.medir(vieja + timedelta(minutes=30), 40, muestras=3)
+        reciente = self.medir(timezone.now() - timedelta(days=1), 50)
+
+        salida = io.StringIO()
+        call_command("depurar_mediciones", dias=90, dry_run=True, stdout=salida)
+        self.assertIn("Se depurarían 2 mediciones", salida.getvalue())
+        self.assertEqual(MedicionTrafico.objects.count(), 3)
+
+        call_command("depurar_mediciones", dias=90, stdout=io.StringIO())
+        self.assertEqual(list(MedicionTrafico.objects.values_list("id", flat=True)), [reciente.id])
+        horaria = MedicionHoraria.objects.get(hora=vieja)
+        self.assertEqual((horaria.muestras, horaria.velocidad_promedio), (4, 35.0))
+
+
+class ParticionadoTests(TestCase):
+    """particionar_mediciones: particiones mensuales de MedicionTrafico (PostgreSQL)."""
+
+    def test_meses(self):
+        self.assertEqual(particionar_mediciones._sumar_meses(date(2025, 11, 1), 3), date(2026, 2, 1))
+        self.assertEqual(particionar_mediciones._sumar_meses(date(2025, 1, 1), -1), date(2024, 12, 1))
+        self.assertEqual(
+            particionar_mediciones._nombre_particion(date(2026, 2, 1)), "trafico_mediciontrafico_p2026_02"
+        )
+
+    def test_sin_convertir_no_crea_particiones(self):
+        with self.assertRaisesMessage(CommandError, "--convertir"):
+            call_command("particionar_mediciones", stdout=io.StringIO())
+
+    def test_convertir_conserva_las_filas(self):
+        segmento = Segmento.objects.create(
+            segmento_id=1, nombre="Tramo 1", geometria=LineString((-89.29, 13.676), (-89.30, 13.68), srid=4326)
+        )
+        antigua = timezone.now() - timedelta(days=70)
+        MedicionTrafico.objects.bulk_create([
+            MedicionTrafico(segmento=segmento, fecha_hora=fecha, velocidad_promedio=30, nivel_congestion=2)
+            for fecha in (antigua, timezone.now())
+        ])
+
+        # Dentro del TestCase las FK diferidas dejan eventos pendientes que impedirían el ALTER TABLE
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        call_command("particionar_mediciones", convertir=True, meses_futuros=2, stdout=io.StringIO())
+
+        comando = particionar_mediciones.Command()
+        self.assertTrue(comando._es_particionada())
+        self.assertEqual(MedicionTrafico.objects.count(), 2)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [particionar_mediciones._nombre_particion(antigua.date())])
+            self.assertIsNotNone(cursor.fetchone()[0])
+        # La identidad de id sigue después del máximo copiado
+        nueva = MedicionTrafico.objects.create(
+            segmento=segmento, fecha_hora=timezone.now(), velocidad_promedio=40, nivel_congestion=1
+        )
+        self.assertGreater(nueva.id, max(MedicionTrafico.objects.exclude(id=nueva.id).values_list("id", flat=True)))
+
+        # Las corridas mensuales solo agregan los meses que faltan
+        hoy = timezone.now().date().replace(day=1)
+        self.assertEqual(comando._crear_particiones(hoy, particionar_mediciones._sumar_meses(hoy, 2)), 0)
+        self.assertEqual(comando._crear_particiones(hoy, particionar_mediciones._sumar_meses(hoy, 3)), 1)
+
+
+class MatrizLocalTests(SimpleTestCase):
+    """engine=local sobre una red de tres segmentos con velocidades conocidas."""
+
+    def test_tiempos_y_distancias(self):
+        segmentos = [
+            (1, [(-89.30, 13.68), (-89.29, 13.68)]),
+            (2, [(-89.29, 13.68), (-89.27, 13.68)]),
+            (3, [(-89.20, 13.70), (-89.19, 13.70)]),  # sin conexión con los demás
+        ]
+        red = matriz_local.Red(segmentos, {1: 36, 2: 72})  # 10 y 20 m/s; el 3 a la velocidad por defecto
+        t1, t2 = red.largos[0] / 10, red.largos[1] / 20
+
+        data = red.matriz([(-89.30, 13.68), (-89.29, 13.68), (-89.27, 13.68), (-89.195, 13.70)])
+
+        esperadas = [
+            [0, t1, t1 + t2, None],
+            [t1, 0, t2, None],
+            [t1 + t2, t2, 0, None],
+            [None, None, None, 0],
+        ]
+        for fila, esperada in zip(data["durations"], esperadas):
+            for valor, esperado in zip(fila, esperada):
+                if esperado is None:
+                    self.assertIsNone(valor)
+                else:
+                    self.assertAlmostEqual(valor, esperado, delta=0.1)
+        self.assertAlmostEqual(data["distances"][0][2], red.largos[0] + red.largos[1], delta=0.1)
+        self.assertEqual([w["segmento_id"] for w in data["sources"]][3], 3)
+
+    def test_hora_con_offset_se_normaliza_a_utc(self):
+        cache.clear()
+        red = mock.Mock()
+        red.matriz.side_effect = lambda coordenadas: {"durations": [[0]]}
+        india = datetime(2025, 11, 6, 10, 45, tzinfo=dt_timezone(timedelta(hours=5, minutes=30)))
+        utc = datetime(2025, 11, 6, 5, 20, tzinfo=dt_timezone.utc)
+
+        with mock.patch.object(matriz_local, "obtener_red", return_value=red) as obtener:
+            data, estado = matriz_local.matriz([(-89.3, 13.68)], india)
+            _, otra = matriz_local.matriz([(-89.3, 13.68)], utc)
+
+        self.assertEqual(estado, "MISS")
+        self.assertEqual(otra, "HIT")  # misma hora UTC, misma clave
+        self.assertEqual(data["fecha_hora"], "2025-11-06T05:00:00+00:00")
+        obtener.assert_called_once_with(datetime(2025, 11, 6, 5, 0, tzinfo=dt_timezone.utc))
+
+
+class PruebaCargaTests(SimpleTestCase):
+    """prueba_carga: rangos de segmentos, cuentas por usuario y 429 aparte de los errores."""
+
+    def test_rango(self):
+        self.assertEqual(prueba_carga._rango("1-4"), [1, 2, 3, 4])
+        self.assertEqual(prueba_carga._rango("3,5,"), [3, 5])
+
+    def test_credenciales(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("# cuentas de prueba\nana:clave:con:dos\nbeto:x\n\n")
+        self.addCleanup(Path(f.name).unlink)
+        self.assertEqual(prueba_carga._credenciales(f.name), [("ana", "clave:con:dos"), ("beto", "x")])
+
+    def test_resumen_separa_429(self):
+        stats = prueba_carga.Estadisticas()
+        for estado in (200, 200, 429, 500):
+            stats.registrar("prediccion", 0.1, estado)
+        stats.registrar("prediccion", 0.2, "ConnectionError")
+
+        fila = stats.resumen(duracion=5)["prediccion"]
+        self.assertEqual(fila["peticiones"], 5)
+        self.assertEqual(fila["por_segundo"], 1.0)
+        self.assertEqual(fila["errores_pct"], 40.0)
+        self.assertEqual(fila["limitadas_pct"], 20.0)
+        self.assertEqual(fila["estados"], {"200": 2, "429": 1, "500": 1, "ConnectionError": 1})
+        self.assertEqual(fila["max_ms"], 200.0)
+
+
+class MetadatosTests(SimpleTestCase):
+    """Regresores de segmento: los del entrenamiento hasta activar REGRESORES_DESDE_BD."""
+
+    info = {"nombre": "Tramo 1", "longitud_km": 9.1, "paradas_cercanas": 0}
+
+    def modelo(self):
+        # Como un Prophet entrenado: columnas constantes sin estandarizar en history
+        return SimpleNamespace(
+            history=pd.DataFrame({"longitud_km": [12.755] * 3, "paradas_cercanas": [6] * 3}),
+            extra_regressors={
+                "longitud_km": {"mu": 0.0, "std": 1.0},
+                "paradas_cercanas": {"mu": 0.0, "std": 1.0},
+            },
+        )
+
+    def test_regresores_del_entrenamiento(self):
+        self.assertEqual(
+            regresores_segmento(self.modelo(), self.info),
+            {"longitud_km": 12.755, "paradas_cercanas": 6.0},
+        )
+
+    @override_settings(REGRESORES_DESDE_BD=True)
+    def test_regresores_desde_bd(self):
+        self.assertEqual(
+            regresores_segmento(self.modelo(), self.info),
+            {"longitud_km": 9.1, "paradas_cercanas": 0},
+        )
+
+    def test_modelo_sin_historia_usa_la_bd(self):
+        modelo = benchmarks.ModeloFalso(1)
+        self.assertEqual(regresores_segmento(modelo, self.info), {"longitud_km": 9.1, "paradas_cercanas": 0})
+
+
+class MetadatosBdTests(TestCase):
+    """refrescar() en PostGIS y en el camino genérico (SpatiaLite); la caché sigue a las señales."""
+
+    linea = LineString((-89.29, 13.676), (-89.30, 13.68), srid=4326)
+
+    @classmethod
+    def setUpTestData(cls):
+        Segmento.objects.create(segmento_id=1, nombre="Tramo 1", geometria=cls.linea)
+        # Dos paradas a menos de 30 m de la línea y una a varios km
+        for i, (lon, lat) in enumerate([(-89.29, 13.676), (-89.2951, 13.6781), (-89.25, 13.70)]):
+            ParadaBus.objects.create(segmento_id=1, osm_id=f"p{i}", nombre=f"Parada {i}", geom=Point(lon, lat, srid=4326))
+
+    def setUp(self):
+        cache.clear()
+
+    def refrescar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return metadatos.refrescar()
+
+    def comprobar(self):
+        segmento = Segmento.objects.get(segmento_id=1)
+        self.assertAlmostEqual(segmento.longitud_km, metadatos.longitud_geodesica_km(self.linea), places=3)
+        self.assertEqual(segmento.paradas_cercanas, 2)
+        # on_commit(invalidar): la caché en memoria ya ve los valores nuevos
+        self.assertEqual(metadatos.info_segmento(1)["paradas_cercanas"], 2)
+
+    def test_refrescar_postgis(self):
+        metadatos.obtener()
+        self.assertEqual(self.refrescar(), 1)
+        self.comprobar()
+
+    def test_refrescar_generico_spatialite(self):
+        metadatos.obtener()
+        with mock.patch.object(metadatos, "connection", SimpleNamespace(vendor="sqlite")):
+            self.assertEqual(self.refrescar(), 1)
+        self.comprobar()
+
+    def test_info_segmento_sigue_a_las_senales(self):
+        self.assertEqual(metadatos.info_segmento(1)["nombre"], "Tramo 1")
+        self.assertIsNone(metadatos.info_segmento(2))
+
+        nuevo = Segmento.objects.create(segmento_id=2, nombre="Tramo 2", geometria=self.linea)
+        self.assertEqual(metadatos.info_segmento(2)["nombre"], "Tramo 2")
+        # Sin refrescar, la longitud se calcula al vuelo
+        self.assertAlmostEqual(metadatos.info_segmento(2)["longitud_km"], metadatos.longitud_geodesica_km(self.linea), places=3)
+
+        nuevo.nombre = "Tramo 2 (norte)"
+        nuevo.save()
+        self.assertEqual(metadatos.info_segmento(2)["nombre"], "Tramo 2 (norte)")
+
+        nuevo.delete()
+        self.assertIsNone(metadatos.info_segmento(2))
+
+
+class ExportacionTests(TestCase):
+    """/trafico/exportar/: formatos, errores de parámetros y bloques de tamaño fijo."""
+
+    @classmethod
+    def setUpTestData(cls):
+        linea = LineString((-89.29, 13.676), (-89.30, 13.68), srid=4326)
+        segmento = Segmento.objects.create(segmento_id=1, nombre="Tramo 1", geometria=linea)
+        inicio = timezone.now().replace(microsecond=0) - timedelta(days=1)
+        MedicionTrafico.objects.bulk_create([
+            MedicionTrafico(segmento=segmento, fecha_hora=inicio + timedelta(minutes=i),
+                            velocidad_promedio=20 + i, nivel_congestion=1 + i % 5)
+            for i in range(5)
+        ])
+        cls.usuario = get_user_model().objects.create_user("exporta", password="x")
+
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(self.usuario)
+
+    def exportar(self, **params):
+        return self.api.get(reverse("exportar"), params)
+
+    def test_requiere_autenticacion(self):
+        self.assertEqual(APIClient().get(reverse("exportar")).status_code, 401)
+
+    def test_csv(self):
+        respuesta = self.exportar(formato="csv")
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('filename="mediciones.csv"', respuesta["Content-Disposition"])
+        lineas = b"".join(respuesta.streaming_content).decode().splitlines()
+        self.assertEqual(lineas[0], "id,segmento_id,fecha_hora,velocidad_promedio,nivel_congestion")
+        self.assertEqual([linea.split(",")[3] for linea in lineas[1:]], ["20.00", "21.00", "22.00", "23.00", "24.00"])
+
+    def test_ndjson(self):
+        respuesta = self.exportar(formato="ndjson", segmento=1)
+        filas = [json.loads(linea) for linea in b"".join(respuesta.streaming_content).splitlines()]
+        self.assertEqual(len(filas), 5)
+        self.assertEqual(filas[0]["velocidad_promedio"], 20.0)
+        self.assertEqual(MedicionTrafico.objects.get(id=filas[0]["id"]).fecha_hora.isoformat(), filas[0]["fecha_hora"])
+
+    def test_parquet_y_arrow(self):
+        try:
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            self.skipTest("pyarrow no está instalado")
+
+        parquet = self.exportar(formato="parquet")
+        tabla = pyarrow.parquet.read_table(io.BytesIO(b"".join(parquet.streaming_content)))
+        self.assertEqual(tabla.column("velocidad_promedio").to_pylist(), [20.0, 21.0, 22.0, 23.0, 24.0])
+
+        arrow = self.exportar(formato="arrow")
+        tabla = pyarrow.ipc.open_stream(b"".join(arrow.streaming_content)).read_all()
+        self.assertEqual(tabla.num_rows, 5)
+
+    def test_sin_pyarrow_responde_400(self):
+        with mock.patch.dict("sys.modules", {"pyarrow": None}):
+            for formato in ("parquet", "arrow"):
+                respuesta = self.exportar(formato=formato)
+                self.assertEqual(respuesta.status_code, 400)
+                self.assertIn("pyarrow", respuesta.json()["error"])
+
+    def test_parametros_invalidos(self):
+        for params in ({"fuente": "usuarios"}, {"formato": "xml"}, {"desde": "ayer"}, {"segmento": "uno"}):
+            respuesta = self.exportar(**params)
+            self.assertEqual(respuesta.status_code, 400, params)
+            self.assertIn("error", respuesta.json())
+
+    def test_bloques_de_tamano_fijo(self):
+        with mock.patch.object(exportar, "FILAS_POR_BLOQUE", 2):
+            respuesta = self.exportar(formato="ndjson")
+            bloques = list(respuesta.streaming_content)
+        # 5 filas en bloques de 2: la memoria depende del bloque, no del total
+        self.assertEqual([len(b.splitlines()) for b in bloques], [2, 2, 1])
+
+
+
+class CompresionTests(SimpleTestCase):
+    """gzip/brotli por Accept-Encoding; relleno aleatorio contra BREACH si hay credenciales."""
+
+    cuerpo = json.dumps([{"segmento_id": i, "token": "secreto"} for i in range(200)]).encode()
+
+    def responder(self, **cabeceras):
+        vista = lambda request: HttpResponse(self.cuerpo, content_type="application/json")
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="br, gzip", **cabeceras)
+        return compresion.CompresionMiddleware(vista)(request)
+
+    def test_sin_credenciales_es_determinista(self):
+        primera, segunda = self.responder(), self.responder()
+        self.assertEqual(primera.content, segunda.content)
+        self.assertEqual(primera["Vary"], "Accept-Encoding")
+
+    def test_con_credenciales_gzip_con_relleno(self):
+        for cabeceras in ({"HTTP_AUTHORIZATION": "Bearer x"}, {"HTTP_COOKIE": "sessionid=abc"}):
+            respuestas = [self.responder(**cabeceras) for _ in range(10)]
+            for respuesta in respuestas:
+                self.assertEqual(respuesta["Content-Encoding"], "gzip")  # nunca brotli
+                self.assertTrue(respuesta.content[3] & gzip.FNAME)
+                self.assertEqual(gzip.decompress(respuesta.content), self.cuerpo)
+            self.assertGreater(len({len(r.content) for r in respuestas}), 1)
+
+    def test_streaming_con_credenciales(self):
+        vista = lambda request: StreamingHttpResponse(
+            (self.cuerpo[i:i + 500] for i in range(0, len(self.cuerpo), 500)), content_type="application/json"
+        )
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip", HTTP_AUTHORIZATION="Bearer x")
+        respuesta = compresion.CompresionMiddleware(vista)(request)
+        contenido = b"".join(respuesta.streaming_content)
+        self.assertTrue(contenido[3] & gzip.FNAME)
+        self.assertEqual(gzip.decompress(contenido), self.cuerpo)
+
+
+class BenchmarksTests(SimpleTestCase):
+    """La suite solo corre con api.settings_bench y no toca la caché ni las carpetas compartidas."""
+
+    @override_settings(BENCHMARKS=False)
+    def test_sin_settings_de_bench_se_niega(self):
+        for comando in ("benchmark", "benchmark_json", "benchmark_arranque"):
+            with self.subTest(comando=comando), self.assertRaisesMessage(CommandError, "settings_bench"):
+                call_command(comando, stdout=io.StringIO())
+
+    @override_settings(BENCHMARKS=True)
+    def test_aislado_usa_cache_y_carpetas_propias(self):
+        cache.set("compartida", 1)
+        tiles_compartidos = tiles.directorio_cache()
+        with benchmarks.aislado() as carpeta:
+            self.assertIsNone(cache.get("compartida"))
+            cache.set("de_la_suite", 2)
+            self.assertEqual(tiles.directorio_cache().parent, carpeta)
+            self.assertEqual(perfilado.directorio().parent, carpeta)
+        self.assertFalse(carpeta.exists())
+        self.assertEqual(cache.get("compartida"), 1)
+        self.assertIsNone(cache.get("de_la_suite"))
+        self.assertEqual(tiles.directorio_cache(), tiles_compartidos)
+
+    def test_comparar_marca_regresiones(self):
+        base = {"casos": {"a": {"ms": 10.0}, "b": {"ms": 10.0}, "sin_base": {"ms": None}}}
+        actual = {"casos": {"a": {"ms": 11.0}, "b": {"ms": 13.0}, "nuevo": {"ms": 1.0}}}
+        filas = {caso: regresion for caso, _, _, _, regresion in benchmarks.comparar(actual, base)}
+        self.assertEqual(filas, {"a": False, "b": True})
+
+
+class ParadasCercanasTests(TestCase):
+    """Paradas a menos de N metros reales (geography), respaldo por FK, lote, bbox y paginación."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Tramo 1 de oeste a este sobre lat 13.70; tramo 2 lejos, sin paradas cerca
+        Segmento.objects.create(
+            segmento_id=1, nombre="Tramo 1", geometria=LineString((-89.30, 13.70), (-89.29, 13.70), srid=4326)
+        )
+        Segmento.objects.create(
+            segmento_id=2, nombre="Tramo 2", geometria=LineString((-89.10, 13.60), (-89.09, 13.60), srid=4326)
+        )
+        metro = 1 / 110_600  # grados de latitud por metro a 13.7°
+        cls.a_20m = ParadaBus.objects.create(
+            segmento_id=1, osm_id="a", nombre="A", geom=Point(-89.295, 13.70 + 20 * metro, srid=4326)
+        )
+        cls.a_50m = ParadaBus.objects.create(
+            segmento_id=1, osm_id="b", nombre="B", geom=Point(-89.295, 13.70 + 50 * metro, srid=4326)
+        )
+        cls.del_tramo_2 = ParadaBus.objects.create(
+            segmento_id=2, osm_id="c", nombre="C", geom=Point(-89.50, 13.90, srid=4326)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def ids(self, lista):
+        return [p["id"] for p in lista]
+
+    def test_distancia_en_metros_y_respaldo_por_fk(self):
+        for vendor in ("postgresql", "sqlite"):
+            with self.subTest(vendor=vendor), mock.patch.object(paradas, "connection", SimpleNamespace(vendor=vendor)):
+                resultado = paradas.paradas_por_segmentos([1, 2], 30)
+                self.assertEqual(self.ids(resultado[1]), [self.a_20m.id])
+                # Sin ninguna cercana, las asociadas por segmento_id
+                self.assertEqual(self.ids(resultado[2]), [self.del_tramo_2.id])
+                self.assertEqual(self.ids(paradas.paradas_por_segmentos([1], 100)[1]), [self.a_20m.id, self.a_50m.id])
+
+    def test_paradas_por_segmento(self):
+        respuesta = self.client.get(reverse("paradas_por_segmento", args=[1]), {"dist": 100})
+        self.assertEqual(self.ids(respuesta.json()), [self.a_20m.id, self.a_50m.id])
+        self.assertEqual(respuesta.json()[0]["segmento"], 1)
+
+        self.assertEqual(self.client.get(reverse("paradas_por_segmento", args=[1]), {"dist": 0}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("paradas_por_segmento", args=[1]), {"dist": 6000}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("paradas_por_segmento", args=[99])).status_code, 404)
+
+    def test_lote(self):
+        respuesta = self.client.get(reverse("paradas_por_segmentos_lote"), {"ids": "1,2"})
+        self.assertEqual(
+            {k: self.ids(v) for k, v in respuesta.json().items()},
+            {"1": [self.a_20m.id], "2": [self.del_tramo_2.id]},
+        )
+        # Sin ids: todos los segmentos
+        self.assertEqual(set(self.client.get(reverse("paradas_por_segmentos_lote")).json()), {"1", "2"})
+        self.assertEqual(self.client.get(reverse("paradas_por_segmentos_lote"), {"ids": "1,x"}).status_code, 400)
+
+    def test_bbox_y_paginacion(self):
+        url = reverse("paradas_todos_segmentos")
+        respuesta = self.client.get(url, {"bbox": "-89.31,13.69,-89.28,13.71"})
+        self.assertEqual(self.ids(json.loads(b"".join(respuesta.streaming_content))), [self.a_20m.id, self.a_50m.id])
+
+        pagina = self.client.get(url, {"limit": 1, "offset": 1}).json()
+        self.assertEqual(pagina["count"], 3)
+        self.assertEqual(self.ids(pagina["results"]), [self.a_50m.id])
+
+        self.assertEqual(self.client.get(url, {"bbox": "-89.28,13.69,-89.31,13.71"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"bbox": "1,2,3"}).status_code, 400)
+
+
+class JsonGeneradoTests(TestCase):
+    """El JSON armado en la BD (o en Python fuera de PostgreSQL) es el mismo que el de los serializadores."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Segmento.objects.create(
+            segmento_id=1, nombre="Tramo 1", geometria=LineString((-89.29, 13.676), (-89.30, 13.68), srid=4326)
+        )
+        Segmento.objects.create(
+            segmento_id=2, nombre="Tramo \"2\" – ñ",
+            geometria=LineString((-89.31, 13.69), (-89.3125, 13.6931), (-89.32, 13.70), srid=4326),
+        )
+        for i in range(5):
+            ParadaBus.objects.create(
+                segmento_id=1 + i % 2, osm_id=f"n{i}", nombre=f"Parada {i}" if i else "",
+                geom=Point(-89.29 - i / 1000, 13.676 + i / 3000, srid=4326),
+            )
+
+    def serializado(self, serializer, queryset):
+        return json.loads(JSONRenderer().render(serializer(queryset, many=True).data))
+
+    def test_paradas_como_el_serializador(self):
+        esperado = self.serializado(ParadaBusSerializer, ParadaBus.objects.order_by("id"))
+        bbox = (-89.2915, 13.67, -89.28, 13.68)
+        en_bbox = [p for p in esperado if bbox[0] <= p["lon"] <= bbox[2] and bbox[1] <= p["lat"] <= bbox[3]]
+        self.assertEqual(len(en_bbox), 2)
+        # PostgreSQL: json_build_object por un cursor del servidor; los demás motores, Python
+        for vendor in ("postgresql", "sqlite"):
+            with self.subTest(vendor=vendor), mock.patch.object(paradas, "connection", SimpleNamespace(vendor=vendor)):
+                self.assertEqual(json.loads(b"".join(paradas.paradas_json())), esperado)
+                self.assertEqual(json.loads(b"".join(paradas.paradas_json(bbox))), en_bbox)
+                self.assertEqual(list(paradas.a_diccionarios(paradas.consulta_paradas())), esperado)
+
+    def test_segmentos_como_el_serializador(self):
+        esperado = self.serializado(
+            SegmentoMapSerializer, Segmento.objects.only("segmento_id", "nombre", "geometria").order_by("segmento_id")
+        )
+        for vendor in ("postgresql", "sqlite"):
+            with self.subTest(vendor=vendor), mock.patch.object(geojson, "connection", SimpleNamespace(vendor=vendor)):
+                self.assertEqual(json.loads(geojson.construir("lista")), esperado)
+                coleccion = json.loads(geojson.construir("geojson"))
+                self.assertEqual(
+                    [(f["id"], f["properties"]["nombre"], f["geometry"]["coordinates"]) for f in coleccion["features"]],
+                    [(s["segmento_id"], s["nombre"], s["geometry"]) for s in esperado],
+                )
@@ -0,0 +1,207 @@
+# trafico/tiles.py
+"""
+Mapbox Vector Tiles (MVT) de segmentos y paradas.
+
+Cada tile se genera en PostGIS (ST_TileEnvelope + ST_AsMVTGeom + ST_AsMVT)
+filtrando con el índice espacial (&&) solo las geometrías del tile, con la
+congestión predicha de la hora como atributo de cada segmento. Los tiles
+se guardan en disco por (hora, versión); la versión sube cuando cambian
+las predicciones de esa hora o las geometrías. Las horas se normalizan a
+UTC (truncar_hora) antes de formar claves y directorios.
+"""
+import os
+import shutil
+import tempfile
+from datetime import timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, connections
+from django.utils import timezone
+
+from traffic_predictor.models import PrediccionPorSegmento
+from . import replicas
+from .estadisticas import BackendNoSoportado
+from .models import ParadaBus, Segmento
+from .versiones_cache import incrementar_version, obtener_version
+
+EXTENT = 4096
+BUFFER = 64
+ZOOM_MAX = 22
+# Por debajo de este zoom las paradas saturan el tile y no se incluyen
+ZOOM_MIN_PARADAS = 13
+# Directorios de horas más antiguas que esto se borran al escribir
+RETENCION = timedelta(hours=48)
+
+_VERSION_GEOMETRIA = "tiles:version:geometria"
+
+
+def directorio_cache():
+    return Path(getattr(settings, "TILES_CACHE_DIR", Path(settings.BASE_DIR) / "cache" / "tiles"))
+
+
+def truncar_hora(hora):
+    """
+    Hora en punto en UTC. Truncar en otra zona daría otra hora con offsets
+    que no son de horas enteras (+05:30), y la clave no debe depender del
+    offset con que llegó la fecha.
+    """
+    if timezone.is_naive(hora):
+        hora = timezone.make_aware(hora)
+    return hora.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def hora_actual():
+    return truncar_hora(timezone.now())
+
+
+def _clave_version_hora(hora):
+    return f"tiles:version:{truncar_hora(hora):%Y%m%d%H}"
+
+
+def invalidar_hora(hora):
+    """Las predicciones de esa hora cambiaron: sus tiles dejan de ser válidos."""
+    incrementar_version(_clave_version_hora(hora))
+
+
+def invalidar_geometrias():
+    """Cambió un segmento o una parada: invalida los tiles de todas las horas."""
+    incrementar_version(_VERSION_GEOMETRIA)
+
+
+def version_hora(hora):
+    """Versión de las predicciones de esa hora (sube con invalidar_hora)."""
+    return obtener_version(_clave_version_hora(hora))
+
+
+def version_geometrias():
+    return obtener_version(_VERSION_GEOMETRIA)
+
+
+def tile_valido(z, x, y):
+    return 0 <= z <= ZOOM_MAX and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+# ------------------------------
+# Generación en PostGIS
+# ------------------------------
+def generar_tile(z, x, y, hora):
+    if connection.vendor != "postgresql":
+        raise BackendNoSoportado("Los vector tiles requieren PostGIS")
+
+    params = {
+        "z": z, "x": x, "y": y,
+        "hora": hora,
+        "extent": EXTENT,
+        "buffer": BUFFER,
+    }
+    capa_paradas = ""
+    if z >= ZOOM_MIN_PARADAS:
+        capa_paradas = f"""
+            || COALESCE((
+                SELECT ST_AsMVT(t, 'paradas', %(extent)s, 'geom')
+                FROM (
+                    SELECT p.id, p.osm_id, p.nombre, p.segmento_id,
+                           ST_AsMVTGeom(ST_Transform(p.geom, 3857), l.env, %(extent)s, %(buffer)s, true) AS geom
+                    FROM {ParadaBus._meta.db_table} p, limites l
+                    WHERE p.geom && l.env_4326
+                ) t
+            ), ''::bytea)
+        """
+
+    sql = f"""
+        WITH limites AS (
+            SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS env,
+                   ST_Transform(ST_TileEnvelope(%(z)s, %(x)s, %(y)s), 4326) AS env_4326
+        )
+        SELECT COALESCE((
+            SELECT ST_AsMVT(t, 'segmentos', %(extent)s, 'geom')
+            FROM (
+                SELECT s.segmento_id, s.nombre,
+                       pr.nivel_congestion_predicho AS congestion,
+                       pr.velocidad_estimada::float AS velocidad_kmh,
+                       ST_AsMVTGeom(ST_Transform(s.geometria, 3857), l.env, %(extent)s, %(buffer)s, true) AS geom
+                FROM {Segmento._meta.db_table} s
+                CROSS JOIN limites l
+                LEFT JOIN {PrediccionPorSegmento._meta.db_table} pr
+                       ON pr.segmento_id = s.segmento_id
+                      AND pr.fecha_hora_prediccion = %(hora)s
+                WHERE s.geometria && l.env_4326
+            ) t
+        ), ''::bytea)
+        {capa_paradas}
+    """
+
+    with connections[replicas.lectura()].cursor() as cursor:
+        cursor.execute(sql, params)
+        return bytes(cursor.fetchone()[0])
+
+
+# ------------------------------
+# Caché en disco
+# ------------------------------
+def _directorio_hora(hora):
+    hora = truncar_hora(hora)
+    return directorio_cache() / f"{hora:%Y%m%d%H}-v{version_geometrias()}.{version_hora(hora)}"
+
+
+def _hora_y_version(nombre):
+    """'2025110607-v3.2' -> ('2025110607', 3, 2); None si no es un directorio de tiles."""
+    hora, _, version = nombre.partition("-v")
+    try:
+        geometria, prediccion = (int(v) for v in version.split("."))
+    except ValueError:
+        return None
+    return hora, geometria, prediccion
+
+
+def _limpiar_obsoletos(vigente):
+    """
+    Borra las versiones anteriores de la misma hora y las horas fuera de la
+    retención. Nunca una versión igual o posterior: un worker con contadores
+    atrasados (caché local por proceso) no borra la vigente de los demás.
+    """
+    hora, geometria, prediccion = _hora_y_version(vigente.name)
+    limite = f"{hora_actual() - RETENCION:%Y%m%d%H}"
+
+    for d in vigente.parent.iterdir():
+        datos = _hora_y_version(d.name)
+        if d == vigente or datos is None or not d.is_dir():
+            continue
+        hora_dir, geometria_dir, prediccion_dir = datos
+        anterior = hora_dir == hora and geometria_dir <= geometria and prediccion_dir <= prediccion
+        if anterior or hora_dir < limite:
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def obtener_tile(z, x, y, hora=None):
+    """
+    Retorna los bytes MVT del tile, desde disco si existe la versión vigente.
+    """
+    hora = truncar_hora(hora or hora_actual())
+    dir_hora = _directorio_hora(hora)
+    ruta = dir_hora / str(z) / str(x) / f"{y}.mvt"
+
+    try:
+        return ruta.read_bytes()
+    except FileNotFoundError:
+        pass
+
+    contenido = generar_tile(z, x, y, hora)
+
+    nuevo_dir = not dir_hora.exists()
+    try:
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        # Escritura atómica: otro worker nunca lee un archivo a medio escribir
+        fd, tmp = tempfile.mkstemp(dir=ruta.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(contenido)
+        os.replace(tmp, ruta)
+    except FileNotFoundError:
+        # Otro worker borró el directorio (esta versión ya es vieja): se sirve sin guardar
+        return contenido
+
+    if nuevo_dir:
+        _limpiar_obsoletos(dir_hora)
+
+    return contenido
@@ -6,8 +6,25 @@ urlpatterns = [
     # Matrix API
     path("matrix/", views.matrix_api, name="matrix_api"),
 
+    # Historial de mediciones (paginación keyset)
+    path("mediciones/", views.MedicionList.as_view(), name="mediciones"),
+
+    # Resúmenes pre-agregados para el dashboard
+    path("resumenes/horario/", views.MedicionHorariaList.as_view(), name="resumen_horario"),
+    path("resumenes/diario/", views.MedicionDiariaList.as_view(), name="resumen_diario"),
+
+    # Estadísticas por segmento (calculadas en PostgreSQL, cacheadas)
+    path("estadisticas/", views.estadisticas_segmentos, name="estadisticas"),
+
+    # Exportación por streaming (CSV / NDJSON / Parquet / Arrow)
+    path("exportar/", views.exportar_datos, name="exportar"),
+
+    # Ingesta de pings GPS (map-matching a segmentos)
+    path("gps/", views.ingesta_gps, name="ingesta_gps"),
+
     # Paradas de bus
     path("paradas/", views.paradas_todos_segmentos, name="paradas_todos_segmentos"),
+    path("paradas/por-segmentos/", views.paradas_por_segmentos_lote, name="paradas_por_segmentos_lote"),
     path(
         "segmentos/<int:segmento_id>/paradas/",
         views.paradas_por_segmento,
@@ -0,0 +1,38 @@
+# trafico/versiones_cache.py
+"""
+Invalidación de caché por versión: en vez de borrar claves, cada grupo
+tiene un contador que forma parte de sus claves. Subir el contador deja
+huérfanas (y expirarán solas) todas las entradas anteriores.
+
+Junto a cada contador se guarda el momento de su última subida. Quien lee
+la versión de una clave invalidada hace poco va a reconstruir esa caché:
+replicas.despues_de_invalidar() manda el resto de su petición a la
+primaria. Las peticiones que dependen de otros grupos siguen en réplicas.
+"""
+import time
+
+from django.core.cache import cache
+
+from . import replicas
+
+
+def _clave_momento(clave):
+    return f"{clave}:invalidada"
+
+
+def obtener_version(clave):
+    cache.add(clave, 1, timeout=None)
+    valores = cache.get_many([clave, _clave_momento(clave)])
+    invalidada = valores.get(_clave_momento(clave))
+    if invalidada is not None:
+        replicas.despues_de_invalidar(invalidada)
+    return valores.get(clave, 1)
+
+
+def incrementar_version(clave):
+    if not cache.add(clave, 2, timeout=None):
+        try:
+            cache.incr(clave)
+        except ValueError:  # expiró entre add() e incr()
+            cache.set(clave, 2, timeout=None)
+    cache.set(_clave_momento(clave), time.time(), timeout=None)
@@ -1,29 +1,54 @@
-import os
-import requests
-from django.conf import settings
+from datetime import timedelta
+from django.db.models import F
+from django.utils import timezone
 
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.contrib.gis.measure import D
 
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import generics, status
+from rest_framework.pagination import LimitOffsetPagination
 
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Segmento, MedicionTrafico, ParadaBus
+from .models import Segmento, MedicionTrafico, MedicionHoraria, MedicionDiaria
 from .serializers import (
     SegmentoMapSerializer,
     MedicionStatsSerializer,
-    ParadaBusSerializer,
+    MedicionHorariaSerializer,
+    MedicionDiariaSerializer,
 )
+from .filters import MedicionFilter, MedicionHorariaFilter, MedicionDiariaFilter
+from .pagination import KeysetPagination
+from . import cache_http, exportar
+from .parametros import parse_booleano, parse_entero, parse_limite
+from .estadisticas import BackendNoSoportado, estadisticas_cacheadas
+from . import geojson, tiles
+from .respuestas import respuesta_precalculada
+from .presupuestos import presupuesto_consultas
+from .paradas import (
+    a_diccionarios,
+    consulta_paradas,
+    paradas_json,
+    paradas_por_segmentos,
+    parse_bbox,
+    parse_distancia,
+)
+from . import map_matching, mapbox, matriz_local, metricas, replicas
+from .limites import ExportacionThrottle, MatrizThrottle
+from .perezoso import importar
+
+pd = importar("pandas")
 
 # -------------------------------
 # VISTA 1: API GEOESPACIAL (MAPA)
 # -------------------------------
+@presupuesto_consultas(2)
 class Segmentos(generics.ListAPIView):
     """
     Retorna los segmentos de carretera con sus coordenadas geométricas.
@@ -33,21 +58,301 @@ class Segmentos(generics.ListAPIView):
     serializer_class = SegmentoMapSerializer
     pagination_class = None  # No paginamos el mapa, queremos todos los tramos
 
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter("zoom", openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                          description="Nivel de zoom del mapa (0-22); simplifica la geometría"),
+        openapi.Parameter("formato", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          enum=list(geojson.FORMATOS), default="lista"),
+    ])
+    def list(self, request, *args, **kwargs):
+        """
+        Sirve el payload precalculado (gzip + ETag). Responde 304 si el
+        cliente ya tiene la versión actual (If-None-Match).
+        """
+        formato = request.query_params.get("formato", "lista")
+        if formato not in geojson.FORMATOS:
+            return Response({"error": f"Formato desconocido: {formato}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            zoom = parse_entero(request.query_params.get("zoom"))
+        except ValueError:
+            return Response({"error": "zoom debe ser un entero"}, status=status.HTTP_400_BAD_REQUEST)
+
+        cuerpo_gzip, etag = geojson.obtener(formato, zoom)
+        return respuesta_precalculada(
+            request, cuerpo_gzip, etag, modificado=cache_http.ultima_modificacion("segmentos")
+        )
+
 
 # --------------------------------------
 # VISTA 2: API DE DATOS (GRÁFICOS/DASH)
 # --------------------------------------
+@presupuesto_consultas(2)
 class MedicionList(generics.ListAPIView):
     """
     Retorna el historial de mediciones de velocidad y congestión.
-    Se puede filtrar por 'segmento' o 'nivel_congestion'.
+    Se puede filtrar por 'segmento', 'nivel_congestion' y rango 'desde'/'hasta'.
+    Una sola consulta por página (JOIN con el segmento, sin COUNT).
     """
-    queryset = MedicionTrafico.objects.all().order_by("-fecha_hora")
+    queryset = MedicionTrafico.objects.values(
+        "id", "fecha_hora", "velocidad_promedio", "nivel_congestion",
+        nombre_tramo=F("segmento__nombre"),
+    )
     serializer_class = MedicionStatsSerializer
 
-    # Configuración de Filtros (ej: /trafico/mediciones/?segmento=1)
+    # Paginación keyset sobre (fecha_hora, id): ?cursor=<next>&page_size=100
+    pagination_class = KeysetPagination
+
+    # Configuración de Filtros (ej: /trafico/mediciones/?segmento=1&desde=2025-11-06T00:00)
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = MedicionFilter
+
+
+# ------------------------------------------
+# VISTA 3: RESÚMENES PRE-AGREGADOS (ROLLUPS)
+# ------------------------------------------
+class ResumenListMixin:
+    """
+    Sirve los gráficos directamente desde las tablas de resumen.
+    Sin ?desde= se limita a una ventana reciente para que la consulta
+    tenga un tamaño acotado.
+    """
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ["segmento", "nivel_congestion"]
+    pagination_class = None
+    ventana_por_defecto = None  # timedelta
+    campo_periodo = None
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if "desde" not in self.request.query_params:
+            inicio = timezone.now() - self.ventana_por_defecto
+            if self.campo_periodo == "fecha":
+                inicio = inicio.date()
+            qs = qs.filter(**{f"{self.campo_periodo}__gte": inicio})
+        return qs
+
+
+@presupuesto_consultas(2)
+class MedicionHorariaList(ResumenListMixin, generics.ListAPIView):
+    """
+    Resumen por segmento y hora (velocidad promedio/min/max, distribución de
+    congestión y cantidad de muestras). Por defecto: últimos 7 días.
+    """
+    queryset = MedicionHoraria.objects.all().order_by("segmento_id", "hora")
+    serializer_class = MedicionHorariaSerializer
+    filterset_class = MedicionHorariaFilter
+    ventana_por_defecto = timedelta(days=7)
+    campo_periodo = "hora"
+
+
+@presupuesto_consultas(2)
+class MedicionDiariaList(ResumenListMixin, generics.ListAPIView):
+    """
+    Resumen por segmento y día. Por defecto: últimos 90 días.
+    """
+    queryset = MedicionDiaria.objects.all().order_by("segmento_id", "fecha")
+    serializer_class = MedicionDiariaSerializer
+    filterset_class = MedicionDiariaFilter
+    ventana_por_defecto = timedelta(days=90)
+    campo_periodo = "fecha"
+
+
+# ------------------------------------------
+# VISTA 4: EXPORTACIÓN (STREAMING)
+# ------------------------------------------
+@swagger_auto_schema(
+    method="get",
+    manual_parameters=[
+        openapi.Parameter("fuente", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          enum=list(exportar.FUENTES), default="mediciones"),
+        openapi.Parameter("formato", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          enum=list(exportar.FORMATOS), default="csv"),
+        openapi.Parameter("segmento", openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        openapi.Parameter("desde", openapi.IN_QUERY, type=openapi.TYPE_STRING, description="YYYY-MM-DD o ISO 8601"),
+        openapi.Parameter("hasta", openapi.IN_QUERY, type=openapi.TYPE_STRING, description="YYYY-MM-DD o ISO 8601 (exclusivo)"),
+    ],
+)
+@presupuesto_consultas(2)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@throttle_classes([ExportacionThrottle])
+def exportar_datos(request):
+    """
+    Exporta mediciones o predicciones como CSV, NDJSON, Parquet o Arrow.
+    La respuesta se genera por bloques desde un cursor del servidor, así
+    exportar millones de filas usa memoria constante. Recorre tablas
+    enteras: requiere usuario y tiene su propio límite de tasa.
+    """
+    params = request.query_params
+    fuente = params.get("fuente", "mediciones")
+    formato = params.get("formato", "csv")
+
+    try:
+        contenido = exportar.exportar(
+            fuente,
+            formato,
+            segmento=parse_entero(params.get("segmento")),
+            desde=parse_limite(params.get("desde")),
+            hasta=parse_limite(params.get("hasta"), fin=True),
+            alias=replicas.lectura(),  # antes de salir del middleware
+        )
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    content_type, extension = exportar.FORMATOS[formato]
+    respuesta = StreamingHttpResponse(contenido, content_type=content_type)
+    respuesta["Content-Disposition"] = f'attachment; filename="{fuente}.{extension}"'
+    return respuesta
+
+
+# ------------------------------------------
+# VISTA 5: ESTADÍSTICAS (CALCULADAS EN LA BD)
+# ------------------------------------------
+@swagger_auto_schema(
+    method="get",
+    manual_parameters=[
+        openapi.Parameter("segmento", openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        openapi.Parameter("desde", openapi.IN_QUERY, type=openapi.TYPE_STRING, description="YYYY-MM-DD o ISO 8601 (default: hace 30 días)"),
+        openapi.Parameter("hasta", openapi.IN_QUERY, type=openapi.TYPE_STRING, description="YYYY-MM-DD o ISO 8601 (default: ahora)"),
+    ],
+)
+@presupuesto_consultas(4)
+@api_view(["GET"])
+def estadisticas_segmentos(request):
+    """
+    Perfil por hora de la semana, percentiles de velocidad (p50/p90),
+    histograma de congestión y tendencia diaria por segmento.
+    Se calcula en PostgreSQL y se cachea por (segmento, rango).
+    """
+    params = request.query_params
+    try:
+        segmento = parse_entero(params.get("segmento"))
+        # Por defecto hasta la próxima hora exacta: la clave de caché se mantiene estable
+        proxima_hora = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        hasta = parse_limite(params.get("hasta"), fin=True) or proxima_hora
+        desde = parse_limite(params.get("desde")) or hasta - timedelta(days=30)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if desde >= hasta:
+        return Response({"error": "'desde' debe ser anterior a 'hasta'"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        datos = estadisticas_cacheadas(segmento, desde, hasta)
+    except BackendNoSoportado as e:
+        return Response({"error": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+    return Response({
+        "desde": desde,
+        "hasta": hasta,
+        "segmentos": datos,
+    })
+
+
+# ------------------------------------------
+# VISTA 6: VECTOR TILES (MVT)
+# ------------------------------------------
+@swagger_auto_schema(
+    method="get",
+    manual_parameters=[
+        openapi.Parameter("fecha_hora", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          description="Hora de la congestión predicha (ISO 8601). Por defecto la hora actual"),
+    ],
+)
+@presupuesto_consultas(2)
+@api_view(["GET"])
+def vector_tile(request, z, x, y):
+    """
+    Tile MVT con las capas 'segmentos' (con congestión y velocidad predichas
+    para la hora) y 'paradas' (desde zoom 13). Endpoint: /tiles/{z}/{x}/{y}.mvt
+    """
+    if not tiles.tile_valido(z, x, y):
+        return Response({"error": "Tile fuera de rango"}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        hora = parse_limite(request.query_params.get("fecha_hora"))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        contenido = tiles.obtener_tile(z, x, y, hora)
+    except BackendNoSoportado as e:
+        return Response({"error": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+    respuesta = HttpResponse(contenido, content_type="application/vnd.mapbox-vector-tile")
+    respuesta["Cache-Control"] = "public, max-age=60"
+    return respuesta
+
+
+# ------------------------------------------
+# VISTA 7: INGESTA GPS (MAP-MATCHING)
+# ------------------------------------------
+MAX_PINGS_POR_PETICION = 100_000
+
+
+@swagger_auto_schema(
+    method="post",
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            "pings": openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        "vehiculo_id": openapi.Schema(type=openapi.TYPE_STRING, example="bus-12"),
+                        "fecha_hora": openapi.Schema(type=openapi.TYPE_STRING, example="2025-11-06T07:00:10"),
+                        "lat": openapi.Schema(type=openapi.TYPE_NUMBER, example=13.677),
+                        "lon": openapi.Schema(type=openapi.TYPE_NUMBER, example=-89.291),
+                        "velocidad": openapi.Schema(type=openapi.TYPE_NUMBER, description="km/h (opcional)"),
+                    },
+                ),
+            ),
+            "cubeta_minutos": openapi.Schema(type=openapi.TYPE_INTEGER, default=map_matching.CUBETA_MINUTOS),
+            "guardar": openapi.Schema(type=openapi.TYPE_BOOLEAN, default=True),
+        },
+        required=["pings"],
+    ),
+)
+# Por medición reemplazada: un UPDATE del resumen horario y otro del diario;
+# la base incluye las 2 agregaciones y el borrado de las reemplazadas
+@presupuesto_consultas(21, por_item=2)
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def ingesta_gps(request):
+    """
+    Empareja un lote de pings GPS con los segmentos (STRtree en memoria),
+    deriva velocidades de pings consecutivos por vehículo y guarda una
+    medición por segmento y cubeta de tiempo.
+    Endpoint: /trafico/gps/
+    """
+    pings = request.data.get("pings")
+    if not isinstance(pings, list) or not pings:
+        return Response({"error": "Debes enviar una lista 'pings'."}, status=status.HTTP_400_BAD_REQUEST)
+    if len(pings) > MAX_PINGS_POR_PETICION:
+        return Response(
+            {"error": f"Máximo {MAX_PINGS_POR_PETICION} pings por petición."},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+
+    try:
+        guardar = parse_booleano(request.query_params.get("guardar", request.data.get("guardar")), defecto=True)
+        cubeta = int(request.data.get("cubeta_minutos", map_matching.CUBETA_MINUTOS))
+        if not 1 <= cubeta <= 24 * 60:
+            raise ValueError("cubeta_minutos debe estar entre 1 y 1440")
+        emparejador = map_matching.Emparejador(cubeta_minutos=cubeta)
+        emparejador.procesar(pd.DataFrame.from_records(pings))
+    except (TypeError, ValueError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    filas = emparejador.resultados()
+    if guardar:
+        map_matching.guardar(filas)
+
+    return Response({
+        "pings": emparejador.pings,
+        "emparejados": emparejador.emparejados,
+        "mediciones": filas,
+    }, status=status.HTTP_201_CREATED)
 
 
 # -----------------------------
@@ -55,6 +360,12 @@ class MedicionList(generics.ListAPIView):
 # -----------------------------
 @swagger_auto_schema(
     method="post",
+    manual_parameters=[
+        openapi.Parameter("engine", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          enum=["mapbox", "local"], default="mapbox"),
+        openapi.Parameter("fecha_hora", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          description="Solo engine=local: hora de las velocidades predichas (ISO 8601). Por defecto la actual"),
+    ],
     request_body=openapi.Schema(
         type=openapi.TYPE_OBJECT,
         properties={
@@ -77,14 +388,28 @@ class MedicionList(generics.ListAPIView):
                     {"lat": 13.692, "lng": -89.315},
                 ],
             ),
+            "profile": openapi.Schema(
+                type=openapi.TYPE_STRING,
+                enum=list(mapbox.LIMITE_COORDENADAS),
+                default=mapbox.PERFIL,
+            ),
         },
         required=["coordinates"],
     ),
 )
+@presupuesto_consultas(3)
 @api_view(["POST"])
+@throttle_classes([MatrizThrottle])
 def matrix_api(request):
     """
     Calcula los tiempos y distancias entre varios puntos usando Mapbox Matrix API.
+    Más coordenadas que el límite de Mapbox (10 con driving-traffic, 25 en los
+    demás perfiles) se piden por bloques en paralelo y se unen en una matriz,
+    hasta 25 coordenadas con driving-traffic y 60 con los demás perfiles.
+    Con ?engine=local se calcula sin Mapbox sobre el grafo de segmentos y
+    las velocidades predichas de la hora (ver trafico/matriz_local.py).
+    Las respuestas se cachean por coordenadas y ventana de 5 minutos (cabecera
+    X-Cache); si Mapbox falla se sirve la última respuesta conocida.
     """
     coordinates = request.data.get("coordinates", None)
 
@@ -94,75 +419,150 @@ def matrix_api(request):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    # Construcción del string de coordenadas para Mapbox
-    coords_str = ";".join([f"{c['lng']},{c['lat']}" for c in coordinates])
+    try:
+        coordenadas = [(float(c["lng"]), float(c["lat"])) for c in coordinates]
+    except (KeyError, TypeError, ValueError):
+        return Response(
+            {"error": "Cada coordenada debe tener 'lat' y 'lng' numéricos."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
-    # Token desde settings.py (cargado con os.getenv)
-    access_token = settings.MAPBOX_ACCESS_TOKEN
+    engine = request.query_params.get("engine", "mapbox")
+    if engine not in ("mapbox", "local"):
+        return Response({"error": f"engine desconocido: {engine}"}, status=status.HTTP_400_BAD_REQUEST)
+    if engine == "local":
+        return _matriz_local(request, coordenadas)
 
-    # URL de Matrix API
-    url = (
-        "https://api.mapbox.com/directions-matrix/v1/mapbox/driving-traffic/"
-        f"{coords_str}?annotations=duration,distance&access_token={access_token}"
-    )
+    perfil = request.data.get("profile", mapbox.PERFIL)
+
+    try:
+        with metricas.etapa("matriz_mapbox"):
+            data, estado = mapbox.matriz_completa(coordenadas, perfil)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except mapbox.MapboxError as e:
+        return Response(e.data, status=e.status)
+    except mapbox.MapboxLimitado as e:
+        return Response(
+            {"error": str(e)},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": str(e.espera)},
+        )
+    except mapbox.MapboxNoDisponible as e:
+        return Response(
+            {"error": f"Mapbox no disponible: {e}"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(int(mapbox.interruptor.espera))},
+        )
 
-    response = requests.get(url)
-    data = response.json()
+    return Response(data, headers={"X-Cache": estado})
 
-    return Response(data)
 
+def _matriz_local(request, coordenadas):
+    """?engine=local: matriz calculada con el grafo de segmentos y las velocidades predichas."""
+    if len(coordenadas) > mapbox.MAX_COORDENADAS:
+        return Response(
+            {"error": f"Máximo {mapbox.MAX_COORDENADAS} coordenadas por matriz"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
-# ------------------------------
-# NUEVAS VISTAS: PARADAS DE BUS
-# ------------------------------
-from django.shortcuts import get_object_or_404
-from django.contrib.gis.measure import D
-from rest_framework.decorators import api_view
-from rest_framework.response import Response
-from rest_framework import status
+    try:
+        hora = parse_limite(request.query_params.get("fecha_hora") or request.data.get("fecha_hora"))
+        with metricas.etapa("matriz_local"):
+            data, estado = matriz_local.matriz(coordenadas, hora)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-from .models import Segmento, ParadaBus
-from .serializers import ParadaBusSerializer
+    return Response(data, headers={"X-Cache": estado})
 
 
+# ------------------------------
+# NUEVAS VISTAS: PARADAS DE BUS
+# ------------------------------
+@swagger_auto_schema(
+    method="get",
+    manual_parameters=[
+        openapi.Parameter("bbox", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          description="minlon,minlat,maxlon,maxlat"),
+        openapi.Parameter("limit", openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        openapi.Parameter("offset", openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+    ],
+)
+@presupuesto_consultas(3)
 @api_view(["GET"])
+@cache_http.cachear("paradas", grupos=("paradas",))
 def paradas_todos_segmentos(request):
     """
-    Devuelve TODAS las paradas de bus.
+    Devuelve las paradas de bus, opcionalmente dentro de un bbox.
+    Con ?limit= (y ?offset=) la respuesta se pagina; sin él se devuelve la lista completa,
+    generada como JSON en la BD y enviada por streaming.
     Endpoint: /trafico/paradas/
     """
-    paradas = ParadaBus.objects.all()
-    serializer = ParadaBusSerializer(paradas, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    bbox = request.query_params.get("bbox")
+    try:
+        limites = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if "limit" in request.query_params:
+        paginador = LimitOffsetPagination()
+        pagina = paginador.paginate_queryset(consulta_paradas(limites), request)
+        return paginador.get_paginated_response(list(a_diccionarios(pagina)))
+
+    # El alias se elige aquí: el cuerpo se itera después de ReplicasMiddleware
+    return StreamingHttpResponse(
+        paradas_json(limites, alias=replicas.lectura()), content_type="application/json"
+    )
 
 
+@presupuesto_consultas(3)
 @api_view(["GET"])
+@cache_http.cachear("paradas_segmento", grupos=("segmentos", "paradas"))
 def paradas_por_segmento(request, segmento_id):
     """
-    Devuelve las paradas cercanas a la geometría del segmento.
-    Usa distancia en metros (convertida a grados).
-    Si no encuentra nada, intenta por segmento_id.
+    Devuelve las paradas a menos de ?dist= metros (default 30) de la
+    geometría del segmento. Si no encuentra nada, devuelve las asociadas
+    por segmento_id. Una sola consulta espacial (geography + índice GiST).
     """
-    segmento = get_object_or_404(Segmento, pk=segmento_id)
+    try:
+        metros = parse_distancia(request.query_params.get("dist"))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Aumentamos el radio por defecto a 300m (puedes subirlo si quieres)
-    dist_metros = float(request.query_params.get("dist", 30))
+    resultado = paradas_por_segmentos([segmento_id], metros)[segmento_id]
 
-    # Convertir metros a grados aprox (1 grado ~ 111,000 m)
-    dist_grados = dist_metros / 111_000.0
+    if not resultado:
+        get_object_or_404(Segmento, pk=segmento_id)
 
-    # 1) Intento con cercanía geométrica
-    try:
-        paradas_qs = ParadaBus.objects.filter(
-            geom__dwithin=(segmento.geometria, dist_grados)
-        )
-    except Exception as e:
-        print("⚠️ Error en geom__dwithin:", e)
-        paradas_qs = ParadaBus.objects.none()
+    return Response(resultado, status=status.HTTP_200_OK)
 
-    # 2) Si no encontró NADA por geometría, intentamos por segmento_id
-    if not paradas_qs.exists():
-        paradas_qs = ParadaBus.objects.filter(segmento_id=segmento_id)
 
-    serializer = ParadaBusSerializer(paradas_qs, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+@swagger_auto_schema(
+    method="get",
+    manual_parameters=[
+        openapi.Parameter("ids", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          description="IDs de segmento separados por coma (default: todos)"),
+        openapi.Parameter("dist", openapi.IN_QUERY, type=openapi.TYPE_NUMBER, description="Metros (default 30)"),
+    ],
+)
+@presupuesto_consultas(3)
+@api_view(["GET"])
+@cache_http.cachear("paradas_lote", grupos=("segmentos", "paradas"))
+def paradas_por_segmentos_lote(request):
+    """
+    Paradas cercanas de varios segmentos en una sola consulta (join espacial).
+    Respuesta: {"<segmento_id>": [paradas...], ...}
+    Endpoint: /trafico/paradas/por-segmentos/?ids=1,2,3&dist=30
+    """
+    try:
+        metros = parse_distancia(request.query_params.get("dist"))
+        ids = request.query_params.get("ids")
+        if ids:
+            segmento_ids = [int(v) for v in ids.split(",") if v.strip()]
+        else:
+            segmento_ids = list(Segmento.objects.values_list("segmento_id", flat=True))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    resultado = paradas_por_segmentos(segmento_ids, metros)
+    return Response({str(k): v for k, v in resultado.items()}, status=status.HTTP_200_OK)